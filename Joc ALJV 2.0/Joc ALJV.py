@@ -1,243 +1,278 @@
-import pygame
-import sys
-import os
-from transformers import pipeline
-import math
-import random
-import tempfile
-
-# Set the working directory to the directory of the script
-script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
-
-# Initialize Pygame
-pygame.init()
-
-# Set up the screen for Full HD resolution
-SCREEN_WIDTH = 1920
-SCREEN_HEIGHT = 1080
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Top-Down Game")
-
-# Colors
-WHITE = (255, 255, 255)
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-
-# Load background image
-background_image = pygame.image.load("grass.png").convert()
-background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-
-# Load and scale player and NPC sprites
-player_sprite_original = pygame.image.load("player.png").convert_alpha()
-npc_sprite_original = pygame.image.load("npc.png").convert_alpha()
-
-# Scale sprites down
-player_sprite = pygame.transform.scale(player_sprite_original, (100, 100))  # Adjust size as needed
-npc_sprite = pygame.transform.scale(npc_sprite_original, (100, 100))  # Adjust size as needed
-
-# Player attributes
-player_rect = player_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-player_speed = 1  # Player movement speed
-
-# NPC attributes (fixed in the center of the screen)
-npc_rect = npc_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-
-# Font
-font = pygame.font.SysFont(None, 30)
-
-# Load the question answering pipeline
-qa_pipeline = pipeline("question-answering")
-
-# Context for the single NPC
-npc_context = "context for the NPC"
-
-# Function to display text on the screen
-def draw_text(text, color, x, y):
-    text_surface = font.render(text, True, color)
-    screen.blit(text_surface, (x, y))
-
-# Function to calculate distance between two points
-def distance(x1, y1, x2, y2):
-    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-
-# Function to simulate asking the NPC a question and getting an answer
-def get_answer_for_npc(question):
-    answer = qa_pipeline(question=question, context=npc_context)
-    return answer["answer"]
-
-# Class for additional sprites
-class SpecificSprite(pygame.sprite.Sprite):
-    def __init__(self, name, image, x, y):
-        super().__init__()
-        self.name = name
-        self.image = pygame.transform.scale(image, (300, 300))  # Scale down sprite
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (x, y)
-
-# Function to spawn specific sprites in predefined grid spots
-def spawn_specific_sprites(sprite_info_list, grid_spots):
-    sprites = []
-    random.shuffle(grid_spots)  # Randomize the order of grid spots
-
-    for idx, (name, image_path) in enumerate(sprite_info_list):
-        if idx < len(grid_spots):
-            x, y = grid_spots[idx]
-            image = pygame.image.load(image_path).convert_alpha()
-            sprite = SpecificSprite(name, image, x, y)
-            sprites.append(sprite)
-
-    return sprites
-
-# Predefined grid spots around the screen dimensions
-sprite_size = 300  # Size of the sprites
-half_sprite_size = sprite_size // 2
-
-grid_spots = [
-    (0, 0),  # LEFT-UP
-    (SCREEN_WIDTH // 2 - half_sprite_size, 0),  # CENTER-UP
-    (SCREEN_WIDTH - sprite_size, 0),  # RIGHT-UP
-    (0, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-LEFT
-    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-RIGHT
-    (0, SCREEN_HEIGHT - sprite_size),  # LEFT-DOWN
-    (SCREEN_WIDTH // 2 - half_sprite_size, SCREEN_HEIGHT - sprite_size),  # CENTER-DOWN
-    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT - sprite_size)  # RIGHT-DOWN
-]
-
-# List of specific sprites with names and image paths (excluding the fountain)
-sprite_info_list = [
-    ("Pyramid", "pyramid.png"),
-    ("Palace", "palace.png"),
-    ("Stadium", "stadium.png"),
-    ("Japanese Palace", "japanese.png"),
-    ("Tower", "tower.png"),
-    ("Hospital", "hospital.png"),
-    ("Train Station", "trainstation.png"),
-    ("Hotel", "hotel.png"),
-    # Add more sprites as needed
-]
-
-# Spawn specific sprites
-specific_sprites = spawn_specific_sprites(sprite_info_list, grid_spots)
-
-# Create a sprite group for easy drawing and updating
-all_sprites = pygame.sprite.Group()
-all_sprites.add(specific_sprites)
-
-# Function to write neighboring sprite information to a temporary file
-def write_neighboring_sprite_info(sprites):
-    temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.txt')
-    with temp_file as file:
-        for sprite in sprites:
-            neighbors = {
-                "left": None,
-                "right": None,
-                "up": None,
-                "down": None
-            }
-            sprite_center = sprite.rect.center
-
-            for other in sprites:
-                if other == sprite:
-                    continue
-                other_center = other.rect.center
-
-                if other_center[0] < sprite_center[0] and abs(other_center[1] - sprite_center[1]) < sprite_size:
-                    neighbors["left"] = other.name
-                if other_center[0] > sprite_center[0] and abs(other_center[1] - sprite_center[1]) < sprite_size:
-                    neighbors["right"] = other.name
-                if other_center[1] < sprite_center[1] and abs(other_center[0] - sprite_center[0]) < sprite_size:
-                    neighbors["up"] = other.name
-                if other_center[1] > sprite_center[1] and abs(other_center[0] - sprite_center[0]) < sprite_size:
-                    neighbors["down"] = other.name
-
-            file.write(f"Sprite: {sprite.name}\n")
-            file.write(f"Position: {sprite.rect.topleft}\n")
-            file.write(f"Neighbors: {neighbors}\n\n")
-
-    print(f"Neighboring sprite information written to: {temp_file.name}")
-
-# Call the function to write neighboring sprite information
-write_neighboring_sprite_info(specific_sprites)
-
-# Main game loop
-def main():
-    global player_rect  # Declare global variables
-
-    running = True
-    in_dialogue = False
-    question = ""
-    answer = ""
-    current_npc = False
-
-    while running:
-        # Draw background image
-        screen.blit(background_image, (0, 0))
-
-        # Handle events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if in_dialogue:
-                    if event.key == pygame.K_BACKSPACE:
-                        question = question[:-1]
-                    elif event.key == pygame.K_RETURN:
-                        if question.strip():  # Check if the question is not empty
-                            answer = get_answer_for_npc(question)
-                        question = ""  # Clear the question
-                    else:
-                        question += event.unicode
-
-        # Player movement
-        keys = pygame.key.get_pressed()
-        player_dx = 0
-        player_dy = 0
-        if keys[pygame.K_LEFT]:
-            player_dx -= player_speed
-        if keys[pygame.K_RIGHT]:
-            player_dx += player_speed
-        if keys[pygame.K_UP]:
-            player_dy -= player_speed
-        if keys[pygame.K_DOWN]:
-            player_dy += player_speed
-        player_rect.x += player_dx
-        player_rect.y += player_dy
-
-        # Ensure player stays within screen bounds
-        player_rect.x = max(0, min(player_rect.x, SCREEN_WIDTH - player_rect.width))
-        player_rect.y = max(0, min(player_rect.y, SCREEN_HEIGHT - player_rect.height))
-
-        # Draw player sprite
-        screen.blit(player_sprite, player_rect.topleft)
-
-        # Draw NPC sprite
-        screen.blit(npc_sprite, npc_rect.topleft)
-
-        # Draw all specific sprites
-        all_sprites.draw(screen)
-
-        # Check for interaction with NPC
-        if player_rect.colliderect(npc_rect):
-            draw_text("Press E to interact", RED, npc_rect.x - 50, npc_rect.y - 30)
-            if keys[pygame.K_e]:
-                in_dialogue = True
-                current_npc = True
-        else:
-            current_npc = False
-
-        # Display interaction window
-        if in_dialogue:
-            pygame.draw.rect(screen, WHITE, (10, 10, SCREEN_WIDTH - 20, SCREEN_HEIGHT - 20))
-            if current_npc:
-                draw_text("NPC: Hello! What do you want to know?", RED, 20, 20)
-            draw_text("Your question: " + question, RED, 20, 50)
-            if answer:
-                draw_text("NPC: " + answer, RED, 20, 80)
-
-        pygame.display.flip()
-
-if __name__ == "__main__":
-    main()
+import pygame
+import sys
+import os
+import math
+import time
+import random
+import tempfile
+
+# Set the working directory to the directory of the script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+os.chdir(script_dir)
+
+# Make the shared NPC modules in the repository root importable
+sys.path.insert(0, os.path.dirname(script_dir))
+from town_spatial import SpatialGrid
+from npc_inference import InferenceWorker, LazyQAPipeline, StartupReport, load_qa_pipeline
+from npc_server import RemoteQAPipeline, server_address
+from asset_atlas import GAME_ASSET_SIZES, load_atlas
+from game_loop import SIMULATION_STEP, FixedStepClock, move_player
+from game_render import DirtyRenderer
+from game_text import TextCache, wrap_text
+from tracing import finish_tracing, toggle_tracing, tracer
+
+# Initialize Pygame
+pygame.init()
+
+# Set up the screen for Full HD resolution
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+pygame.display.set_caption("Top-Down Game")
+
+# With NPC_QA_SERVER set the questions go to a shared npc_server.py instead of a model in this process
+def load_npc_reader():
+    if server_address():
+        return RemoteQAPipeline(server_address())
+    return load_qa_pipeline()
+
+# Start loading the question answering model in the background now that the window is up
+startup_report = StartupReport()
+qa_pipeline = LazyQAPipeline(loader=load_npc_reader, report=startup_report,
+                             preload_modules=() if server_address() else ("transformers",)).start()
+
+# Colors
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+
+# Load background image
+asset_load_started = time.perf_counter()
+background_image = pygame.image.load("grass.png").convert()
+background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
+
+# Load all sprites, pre-scaled to their in-game sizes, from one atlas image
+# (built on first launch or with `python asset_atlas.py "Joc ALJV 2.0"`)
+sprite_images = load_atlas(".", GAME_ASSET_SIZES)
+player_sprite = sprite_images["player.png"]
+npc_sprite = sprite_images["npc.png"]
+
+# Player attributes
+player_rect = player_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+player_position = pygame.Vector2(player_rect.topleft)  # Exact position; player_rect holds the rounded one
+player_speed = 300  # Player movement speed in pixels per second
+
+# NPC attributes (fixed in the center of the screen)
+npc_rect = npc_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+
+# Font, and the rendered text surfaces that are reused from frame to frame
+font = pygame.font.SysFont(None, 30)
+text_cache = TextCache(max_entries=256)
+LINE_HEIGHT = 30
+DIALOGUE_TEXT_WIDTH = SCREEN_WIDTH - 40
+
+# Run the model on a background thread so the game keeps rendering while the NPC thinks
+qa_worker = InferenceWorker(qa_pipeline).start()
+
+# Context for the single NPC
+npc_context = "context for the NPC"
+
+# Function to display text on the screen
+def draw_text(text, color, x, y):
+    with tracer.span("draw_text"):
+        text_surface = text_cache.render(font, text, color)
+        renderer.blit(text_surface, (x, y))
+
+# Function to calculate distance between two points
+def distance(x1, y1, x2, y2):
+    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+
+# Class for additional sprites
+class SpecificSprite(pygame.sprite.Sprite):
+    def __init__(self, name, image, x, y):
+        super().__init__()
+        self.name = name
+        self.image = image if image.get_size() == (300, 300) else pygame.transform.scale(image, (300, 300))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+
+# Function to spawn specific sprites in predefined grid spots
+def spawn_specific_sprites(sprite_info_list, grid_spots):
+    sprites = []
+    random.shuffle(grid_spots)  # Randomize the order of grid spots
+
+    for idx, (name, image_path) in enumerate(sprite_info_list):
+        if idx < len(grid_spots):
+            x, y = grid_spots[idx]
+            image = sprite_images[image_path]
+            sprite = SpecificSprite(name, image, x, y)
+            sprites.append(sprite)
+
+    return sprites
+
+# Predefined grid spots around the screen dimensions
+sprite_size = 300  # Size of the sprites
+half_sprite_size = sprite_size // 2
+
+grid_spots = [
+    (0, 0),  # LEFT-UP
+    (SCREEN_WIDTH // 2 - half_sprite_size, 0),  # CENTER-UP
+    (SCREEN_WIDTH - sprite_size, 0),  # RIGHT-UP
+    (0, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-LEFT
+    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-RIGHT
+    (0, SCREEN_HEIGHT - sprite_size),  # LEFT-DOWN
+    (SCREEN_WIDTH // 2 - half_sprite_size, SCREEN_HEIGHT - sprite_size),  # CENTER-DOWN
+    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT - sprite_size)  # RIGHT-DOWN
+]
+
+# List of specific sprites with names and image paths (excluding the fountain)
+sprite_info_list = [
+    ("Pyramid", "pyramid.png"),
+    ("Palace", "palace.png"),
+    ("Stadium", "stadium.png"),
+    ("Japanese Palace", "japanese.png"),
+    ("Tower", "tower.png"),
+    ("Hospital", "hospital.png"),
+    ("Train Station", "trainstation.png"),
+    ("Hotel", "hotel.png"),
+    # Add more sprites as needed
+]
+
+# Spawn specific sprites
+specific_sprites = spawn_specific_sprites(sprite_info_list, grid_spots)
+startup_report.record("asset load", time.perf_counter() - asset_load_started)
+
+# Create a sprite group for easy drawing and updating
+all_sprites = pygame.sprite.Group()
+all_sprites.add(specific_sprites)
+
+# Function to write neighboring sprite information to a temporary file
+def write_neighboring_sprite_info(sprites):
+    temp_file = tempfile.NamedTemporaryFile(delete=False, mode='w', suffix='.txt')
+    with temp_file as file:
+        # Nearest building in each direction, looked up in a spatial grid instead of comparing every pair
+        index = SpatialGrid(sprite_size).insert_all(sprites)
+        for sprite in sprites:
+            neighbors = index.neighbors(sprite, sprite_size)
+
+            file.write(f"Sprite: {sprite.name}\n")
+            file.write(f"Position: {sprite.rect.topleft}\n")
+            file.write(f"Neighbors: {neighbors}\n\n")
+
+    print(f"Neighboring sprite information written to: {temp_file.name}")
+
+# Call the function to write neighboring sprite information
+write_neighboring_sprite_info(specific_sprites)
+
+# Function to draw the scenery that never moves: the background and the buildings
+def draw_scenery(surface):
+    surface.blit(background_image, (0, 0))
+    all_sprites.draw(surface)
+
+# Only the regions touched by the player, the NPC and the text are redrawn each frame (F2 redraws everything)
+renderer = DirtyRenderer(screen, draw_scenery)
+
+# Main game loop
+def main():
+    global player_rect  # Declare global variables
+
+    running = True
+    in_dialogue = False
+    question = ""
+    answer = ""
+    current_npc = False
+    pending_answer = None  # Question waiting on the inference worker
+    clock = FixedStepClock()
+    wrapped_answer = None  # Answer that answer_lines was laid out for
+    answer_lines = []
+
+    while running:
+        # Sleep off the rest of the frame budget (60 fps) so the loop doesn't spin against the inference
+        # worker, then work out how many movement steps are due
+        steps = clock.tick()
+
+        # Handle events
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+                finish_tracing()
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F2:
+                    renderer.toggle_full_redraw()
+                elif event.key == pygame.K_F3:
+                    toggle_tracing()
+                elif in_dialogue:
+                    if event.key == pygame.K_BACKSPACE:
+                        question = question[:-1]
+                    elif event.key == pygame.K_RETURN:
+                        if question.strip():  # Check if the question is not empty
+                            if pending_answer:
+                                pending_answer.cancel()
+                            pending_answer = qa_worker.submit("NPC", question, npc_context)
+                            answer = ""
+                        question = ""  # Clear the question
+                    else:
+                        question += event.unicode
+
+        # Player movement, in fixed steps so speed doesn't depend on the frame rate; the player stays on screen
+        keys = pygame.key.get_pressed()
+        for _ in range(steps):
+            move_player(keys, player_position, player_speed, SIMULATION_STEP, player_rect, (SCREEN_WIDTH, SCREEN_HEIGHT))
+
+        # Restore the background and buildings where last frame's player, NPC and text were
+        with tracer.span("all_sprites.draw"):
+            renderer.begin_frame()
+
+        # Draw player sprite
+        renderer.blit(player_sprite, player_rect.topleft)
+
+        # Draw NPC sprite
+        renderer.blit(npc_sprite, npc_rect.topleft)
+
+        # Check for interaction with NPC
+        if player_rect.colliderect(npc_rect):
+            draw_text("Press E to interact", RED, npc_rect.x - 50, npc_rect.y - 30)
+            if keys[pygame.K_e]:
+                in_dialogue = True
+                current_npc = True
+        else:
+            current_npc = False
+
+        # Pick up the answer once the worker is done, or drop it if the player walked away
+        if pending_answer:
+            if not current_npc:
+                pending_answer.cancel()
+                pending_answer = None
+            elif pending_answer.done:
+                answer = pending_answer.answer
+                pending_answer = None
+
+        # Display interaction window
+        if in_dialogue:
+            renderer.draw_rect(WHITE, (10, 10, SCREEN_WIDTH - 20, SCREEN_HEIGHT - 20))
+            if current_npc:
+                draw_text("NPC: Hello! What do you want to know?", RED, 20, 20)
+            draw_text("Your question: " + question, RED, 20, 50)
+            if pending_answer:
+                draw_text("NPC: thinking...", RED, 20, 80)
+            elif answer:
+                # Word-wrap the answer once, not every frame
+                if answer != wrapped_answer:
+                    wrapped_answer = answer
+                    answer_lines = wrap_text(font, "NPC: " + answer, DIALOGUE_TEXT_WIDTH)
+                for idx, line in enumerate(answer_lines):
+                    draw_text(line, RED, 20, 80 + idx * LINE_HEIGHT)
+
+        # Show that the NPC model is still loading in the background
+        if not qa_pipeline.ready:
+            draw_text("Loading NPC brain...", WHITE, 20, SCREEN_HEIGHT - 40)
+        else:
+            startup_report.print_once(qa_pipeline.error)
+
+        with tracer.span("display.flip"):
+            renderer.end_frame()
+
+if __name__ == "__main__":
+    main()
@@ -1,286 +1,325 @@
-import os
-import pygame
-import sys
-import math
-import random
-from transformers import pipeline
-
-# Set the working directory to the directory of the script
-script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
-
-# Initialize Pygame
-pygame.init()
-
-# Set up the screen for Full HD resolution
-SCREEN_WIDTH = 1920
-SCREEN_HEIGHT = 1080
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Top-Down Game")
-
-# Colors
-WHITE = (255, 255, 255)
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-
-# Load background image
-background_image = pygame.image.load("grass.png").convert()
-background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-
-# Load and scale player and NPC sprites
-player_sprite_original = pygame.image.load("player.png").convert_alpha()
-npc_sprite_original = pygame.image.load("npc.png").convert_alpha()
-
-# Scale sprites down
-player_sprite = pygame.transform.scale(player_sprite_original, (100, 100))  # Adjust size as needed
-npc_sprite = pygame.transform.scale(npc_sprite_original, (100, 100))  # Adjust size as needed
-
-# Player attributes
-player_rect = player_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-player_speed = 1  # Player movement speed
-
-# NPC attributes (fixed in the center of the screen)
-npc_rect = npc_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-
-# Font
-font = pygame.font.SysFont(None, 30)
-
-# Load the question answering pipeline
-qa_pipeline = pipeline("question-answering")
-
-# Function to display text on the screen
-def draw_text(text, color, x, y):
-    text_surface = font.render(text, True, color)
-    screen.blit(text_surface, (x, y))
-
-# Function to calculate distance between two points
-def distance(x1, y1, x2, y2):
-    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-
-# Function to simulate asking the NPC a question and getting an answer
-def get_answer_for_npc(question):
-    answer = qa_pipeline(question=question, context=npc_context)
-    return answer["answer"]
-
-# Class for additional sprites
-class SpecificSprite(pygame.sprite.Sprite):
-    def __init__(self, name, image, x, y):
-        super().__init__()
-        self.name = name
-        self.image = pygame.transform.scale(image, (300, 300))  # Scale down sprite
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (x, y)
-
-# Function to spawn specific sprites in predefined grid spots
-def spawn_specific_sprites(sprite_info_list, grid_spots):
-    sprites = []
-    random.shuffle(grid_spots)  # Randomize the order of grid spots
-
-    for idx, (name, image_path) in enumerate(sprite_info_list):
-        if idx < len(grid_spots):
-            x, y = grid_spots[idx]
-            image = pygame.image.load(image_path).convert_alpha()
-            sprite = SpecificSprite(name, image, x, y)
-            sprites.append(sprite)
-
-    return sprites
-
-# Predefined grid spots around the screen dimensions
-sprite_size = 300  # Size of the sprites
-half_sprite_size = sprite_size // 2
-
-grid_spots = [
-    (0, 0),  # LEFT-UP
-    (SCREEN_WIDTH // 2 - half_sprite_size, 0),  # CENTER-UP
-    (SCREEN_WIDTH - sprite_size, 0),  # RIGHT-UP
-    (0, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-LEFT
-    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-RIGHT
-    (0, SCREEN_HEIGHT - sprite_size),  # LEFT-DOWN
-    (SCREEN_WIDTH // 2 - half_sprite_size, SCREEN_HEIGHT - sprite_size),  # CENTER-DOWN
-    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT - sprite_size)  # RIGHT-DOWN
-]
-
-# List of specific sprites with names and image paths (excluding the fountain)
-sprite_info_list = [
-    ("Pyramid", "pyramid.png"),
-    ("Palace", "palace.png"),
-    ("Stadium", "stadium.png"),
-    ("Japanese Palace", "japanese.png"),
-    ("Tower", "tower.png"),
-    ("Hospital", "hospital.png"),
-    ("Train Station", "trainstation.png"),
-    ("Hotel", "hotel.png"),
-    # Add more sprites as needed
-]
-
-# Spawn specific sprites
-specific_sprites = spawn_specific_sprites(sprite_info_list, grid_spots)
-
-# Create a sprite group for easy drawing and updating
-all_sprites = pygame.sprite.Group()
-all_sprites.add(specific_sprites)
-
-# Function to write neighboring sprite information
-def get_neighboring_sprite_info(sprites):
-    info = []
-    for sprite in sprites:
-        neighbors = {
-            "left": None,
-            "right": None,
-            "up": None,
-            "down": None
-        }
-        sprite_center = sprite.rect.center
-
-        for other in sprites:
-            if other == sprite:
-                continue
-            other_center = other.rect.center
-
-            if other_center[0] < sprite_center[0] and abs(other_center[1] - sprite_center[1]) < sprite_size:
-                neighbors["left"] = other.name
-            if other_center[0] > sprite_center[0] and abs(other_center[1] - sprite_center[1]) < sprite_size:
-                neighbors["right"] = other.name
-            if other_center[1] < sprite_center[1] and abs(other_center[0] - sprite_center[0]) < sprite_size:
-                neighbors["up"] = other.name
-            if other_center[1] > sprite_center[1] and abs(other_center[0] - sprite_center[0]) < sprite_size:
-                neighbors["down"] = other.name
-
-        info.append((sprite.name, neighbors))
-    return info
-
-# Generate the town lore directly
-def generate_town_lore(sprites):
-    buildings_info = get_neighboring_sprite_info(sprites)
-    
-    lore = "This town is so strange because it only has 8 buildings arranged in a square.\n\n"
-    for name, neighbors in buildings_info:
-        lore += f"The {name} is located "
-        
-        locations = []
-        if neighbors['left']:
-            locations.append(f"to the right of the {neighbors['left']}")
-        if neighbors['right']:
-            locations.append(f"to the left of the {neighbors['right']}")
-        if neighbors['up']:
-            locations.append(f"below the {neighbors['up']}")
-        if neighbors['down']:
-            locations.append(f"above the {neighbors['down']}")
-        
-        if locations:
-            lore += " and ".join(locations) + ".\n"
-        else:
-            lore += "in an isolated spot.\n"
-
-    return lore
-
-def write_lore_to_file(lore, output_path):
-    with open(output_path, 'w') as file:
-        file.write(lore)
-
-# Generate town lore and write to file
-town_lore = generate_town_lore(specific_sprites)
-output_path = "town_lore.txt"
-write_lore_to_file(town_lore, output_path)
-
-# Set the NPC context to the generated town lore
-npc_context = town_lore
-
-print("Lore has been written to town_lore.txt")
-
-# Main game loop
-def main():
-    global player_rect  # Declare global variables
-
-    running = True
-    in_dialogue = False
-    question = ""
-    answer = ""
-    current_npc = False
-
-    while running:
-        # Draw background image
-        screen.blit(background_image, (0, 0))
-
-        # Handle events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if in_dialogue:
-                    if event.key == pygame.K_BACKSPACE:
-                        question = question[:-1]
-                    elif event.key == pygame.K_RETURN:
-                        if question.strip():  # Check if the question is not empty
-                            answer = get_answer_for_npc(question)
-                        question = ""  # Clear the question
-                    else:
-                        question += event.unicode
-
-        # Player movement
-        keys = pygame.key.get_pressed()
-        player_dx = 0
-        player_dy = 0
-        if keys[pygame.K_LEFT]:
-            player_dx -= player_speed
-        if keys[pygame.K_RIGHT]:
-            player_dx += player_speed
-        if keys[pygame.K_UP]:
-            player_dy -= player_speed
-        if keys[pygame.K_DOWN]:
-            player_dy += player_speed
-        player_rect.x += player_dx
-        player_rect.y += player_dy
-
-        # Ensure player stays within screen bounds
-        player_rect.x = max(0, min(player_rect.x, SCREEN_WIDTH - player_rect.width))
-        player_rect.y = max(0, min(player_rect.y, SCREEN_HEIGHT - player_rect.height))
-
-        # Draw player sprite
-        screen.blit(player_sprite, player_rect.topleft)
-
-        # Draw NPC sprite
-        screen.blit(npc_sprite, npc_rect.topleft)
-
-        # Draw all specific sprites
-        all_sprites.draw(screen)
-
-        # Check for interaction with NPC
-        if player_rect.colliderect(npc_rect):
-            draw_text("Press E to interact", RED, npc_rect.x - 50, npc_rect.y - 30)
-            if keys[pygame.K_e]:
-                in_dialogue = True
-                current_npc = True
-        else:
-            current_npc = False
-
-        # Display interaction window
-        if in_dialogue:
-            # Draw semi-transparent black background
-            pygame.draw.rect(screen, (0, 0, 0, 128), (10, 10, SCREEN_WIDTH - 20, SCREEN_HEIGHT - 20))
-    
-            # Limit the number of lines for NPC lore to fit within chat box height
-            max_npc_lines = (SCREEN_HEIGHT - 40) // 200  # Calculate maximum number of lines based on chat box height
-            npc_lines = [npc_context[i:i+180] for i in range(0, len(npc_context), 50)]  # Adjust line width as needed
-            npc_lines = npc_lines[:max_npc_lines]  # Limit the number of lines
-            for idx, line in enumerate(npc_lines):
-                draw_text("NPC: " + line, WHITE, 20, 20 + idx * 30)  # Display each line of NPC lore
-
-            if answer:
-                # Split NPC response into lines to fit within chat box width
-                answer_lines = [answer[i:i+50] for i in range(0, len(answer), 50)]  # Adjust line width as needed
-                for idx, line in enumerate(answer_lines):
-                    draw_text("NPC: " + line, WHITE, 20, 20 + len(npc_lines) * 30 + idx * 30)  # Display each line with "NPC:" prefix
-                    
-        # Close dialogue on pressing Esc
-        if keys[pygame.K_ESCAPE]:
-            in_dialogue = False
-            question = ""
-            answer = ""
-
-        pygame.display.flip()
-
-if __name__ == "__main__":
-    main()
+import os
+import pygame
+import sys
+import math
+import time
+import random
+
+# Set the working directory to the directory of the script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+os.chdir(script_dir)
+
+# Make the shared NPC modules in the repository root importable
+sys.path.insert(0, os.path.dirname(script_dir))
+from town_spatial import SpatialGrid
+from npc_inference import InferenceWorker, LazyQAPipeline, StartupReport, load_qa_pipeline
+from npc_server import RemoteQAPipeline, server_address
+from asset_atlas import GAME_ASSET_SIZES, load_atlas
+from game_loop import SIMULATION_STEP, FixedStepClock, move_player
+from game_render import DirtyRenderer
+from game_text import TextCache, wrap_text
+from tracing import finish_tracing, toggle_tracing, tracer
+from world_knowledge import KnowledgeQA, WorldKnowledge
+
+# Initialize Pygame
+pygame.init()
+
+# Set up the screen for Full HD resolution
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+pygame.display.set_caption("Top-Down Game")
+
+# With NPC_QA_SERVER set the questions go to a shared npc_server.py instead of a model in this process
+def load_npc_reader():
+    if server_address():
+        return RemoteQAPipeline(server_address())
+    return load_qa_pipeline()
+
+# Start loading the question answering model in the background now that the window is up
+startup_report = StartupReport()
+qa_pipeline = LazyQAPipeline(loader=load_npc_reader, report=startup_report,
+                             preload_modules=() if server_address() else ("transformers",)).start()
+
+# Colors
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+
+# Load background image
+asset_load_started = time.perf_counter()
+background_image = pygame.image.load("grass.png").convert()
+background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
+
+# Load all sprites, pre-scaled to their in-game sizes, from one atlas image
+# (built on first launch or with `python asset_atlas.py "Joc ALJV 3.0"`)
+sprite_images = load_atlas(".", GAME_ASSET_SIZES)
+player_sprite = sprite_images["player.png"]
+npc_sprite = sprite_images["npc.png"]
+
+# Player attributes
+player_rect = player_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+player_position = pygame.Vector2(player_rect.topleft)  # Exact position; player_rect holds the rounded one
+player_speed = 300  # Player movement speed in pixels per second
+
+# NPC attributes (fixed in the center of the screen)
+npc_rect = npc_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+
+# Font, and the rendered text surfaces that are reused from frame to frame
+font = pygame.font.SysFont(None, 30)
+text_cache = TextCache(max_entries=256)
+LINE_HEIGHT = 30
+DIALOGUE_TEXT_WIDTH = SCREEN_WIDTH - 40
+
+# Spatial questions are answered from the building neighbor table; the rest go to the model
+knowledge_reader = KnowledgeQA(qa_pipeline)
+
+# Run the model on a background thread so the game keeps rendering while the NPC thinks
+qa_worker = InferenceWorker(knowledge_reader).start()
+
+# Function to display text on the screen
+def draw_text(text, color, x, y):
+    with tracer.span("draw_text"):
+        text_surface = text_cache.render(font, text, color)
+        renderer.blit(text_surface, (x, y))
+
+# Function to calculate distance between two points
+def distance(x1, y1, x2, y2):
+    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+
+# Class for additional sprites
+class SpecificSprite(pygame.sprite.Sprite):
+    def __init__(self, name, image, x, y):
+        super().__init__()
+        self.name = name
+        self.image = image if image.get_size() == (300, 300) else pygame.transform.scale(image, (300, 300))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+
+# Function to spawn specific sprites in predefined grid spots
+def spawn_specific_sprites(sprite_info_list, grid_spots):
+    sprites = []
+    random.shuffle(grid_spots)  # Randomize the order of grid spots
+
+    for idx, (name, image_path) in enumerate(sprite_info_list):
+        if idx < len(grid_spots):
+            x, y = grid_spots[idx]
+            image = sprite_images[image_path]
+            sprite = SpecificSprite(name, image, x, y)
+            sprites.append(sprite)
+
+    return sprites
+
+# Predefined grid spots around the screen dimensions
+sprite_size = 300  # Size of the sprites
+half_sprite_size = sprite_size // 2
+
+grid_spots = [
+    (0, 0),  # LEFT-UP
+    (SCREEN_WIDTH // 2 - half_sprite_size, 0),  # CENTER-UP
+    (SCREEN_WIDTH - sprite_size, 0),  # RIGHT-UP
+    (0, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-LEFT
+    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-RIGHT
+    (0, SCREEN_HEIGHT - sprite_size),  # LEFT-DOWN
+    (SCREEN_WIDTH // 2 - half_sprite_size, SCREEN_HEIGHT - sprite_size),  # CENTER-DOWN
+    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT - sprite_size)  # RIGHT-DOWN
+]
+
+# List of specific sprites with names and image paths (excluding the fountain)
+sprite_info_list = [
+    ("Pyramid", "pyramid.png"),
+    ("Palace", "palace.png"),
+    ("Stadium", "stadium.png"),
+    ("Japanese Palace", "japanese.png"),
+    ("Tower", "tower.png"),
+    ("Hospital", "hospital.png"),
+    ("Train Station", "trainstation.png"),
+    ("Hotel", "hotel.png"),
+    # Add more sprites as needed
+]
+
+# Spawn specific sprites
+specific_sprites = spawn_specific_sprites(sprite_info_list, grid_spots)
+startup_report.record("asset load", time.perf_counter() - asset_load_started)
+
+# Create a sprite group for easy drawing and updating
+all_sprites = pygame.sprite.Group()
+all_sprites.add(specific_sprites)
+
+# Function to write neighboring sprite information: the nearest building in each direction,
+# looked up in a spatial grid instead of comparing every pair of buildings
+def get_neighboring_sprite_info(sprites, index=None):
+    index = index or SpatialGrid(sprite_size).insert_all(sprites)
+    info = []
+    for sprite in sprites:
+        neighbors = index.neighbors(sprite, sprite_size)
+        info.append((sprite.name, neighbors))
+    return info
+
+# Generate the town lore directly from the neighbor information
+def generate_town_lore(buildings_info):
+    lore = "This town is so strange because it only has 8 buildings arranged in a square.\n\n"
+    for name, neighbors in buildings_info:
+        lore += f"The {name} is located "
+        
+        locations = []
+        if neighbors['left']:
+            locations.append(f"to the right of the {neighbors['left']}")
+        if neighbors['right']:
+            locations.append(f"to the left of the {neighbors['right']}")
+        if neighbors['up']:
+            locations.append(f"below the {neighbors['up']}")
+        if neighbors['down']:
+            locations.append(f"above the {neighbors['down']}")
+        
+        if locations:
+            lore += " and ".join(locations) + ".\n"
+        else:
+            lore += "in an isolated spot.\n"
+
+    return lore
+
+def write_lore_to_file(lore, output_path):
+    with open(output_path, 'w') as file:
+        file.write(lore)
+
+# Generate town lore and write to file; the neighbor information is computed once and reused for the knowledge below
+buildings_info = get_neighboring_sprite_info(specific_sprites)
+town_lore = generate_town_lore(buildings_info)
+output_path = "town_lore.txt"
+write_lore_to_file(town_lore, output_path)
+
+# Set the NPC context to the generated town lore, with its neighbor table for the spatial questions
+npc_context = town_lore
+knowledge_reader.set_knowledge(npc_context, WorldKnowledge.from_neighbor_info(buildings_info))
+
+print("Lore has been written to town_lore.txt")
+
+# The lore shown at the top of the dialogue box doesn't change, so it is word-wrapped once;
+# only as many lines as fit above the answer are kept
+max_npc_lines = (SCREEN_HEIGHT - 40) // 200
+npc_lines = wrap_text(font, "NPC: " + npc_context, DIALOGUE_TEXT_WIDTH)[:max_npc_lines]
+
+# Function to draw the scenery that never moves: the background and the buildings
+def draw_scenery(surface):
+    surface.blit(background_image, (0, 0))
+    all_sprites.draw(surface)
+
+# Only the regions touched by the player, the NPC and the text are redrawn each frame (F2 redraws everything)
+renderer = DirtyRenderer(screen, draw_scenery)
+
+# Main game loop
+def main():
+    global player_rect  # Declare global variables
+
+    running = True
+    in_dialogue = False
+    question = ""
+    answer = ""
+    current_npc = False
+    pending_answer = None  # Question waiting on the inference worker
+    clock = FixedStepClock()
+    wrapped_answer = None  # Answer that answer_lines was laid out for
+    answer_lines = []
+
+    while running:
+        # Sleep off the rest of the frame budget (60 fps) so the loop doesn't spin against the inference
+        # worker, then work out how many movement steps are due
+        steps = clock.tick()
+
+        # Handle events
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+                finish_tracing()
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F2:
+                    renderer.toggle_full_redraw()
+                elif event.key == pygame.K_F3:
+                    toggle_tracing()
+                elif in_dialogue:
+                    if event.key == pygame.K_BACKSPACE:
+                        question = question[:-1]
+                    elif event.key == pygame.K_RETURN:
+                        if question.strip():  # Check if the question is not empty
+                            if pending_answer:
+                                pending_answer.cancel()
+                            pending_answer = qa_worker.submit("NPC", question, npc_context)
+                            answer = ""
+                        question = ""  # Clear the question
+                    else:
+                        question += event.unicode
+
+        # Player movement, in fixed steps so speed doesn't depend on the frame rate; the player stays on screen
+        keys = pygame.key.get_pressed()
+        for _ in range(steps):
+            move_player(keys, player_position, player_speed, SIMULATION_STEP, player_rect, (SCREEN_WIDTH, SCREEN_HEIGHT))
+
+        # Restore the background and buildings where last frame's player, NPC and text were
+        with tracer.span("all_sprites.draw"):
+            renderer.begin_frame()
+
+        # Draw player sprite
+        renderer.blit(player_sprite, player_rect.topleft)
+
+        # Draw NPC sprite
+        renderer.blit(npc_sprite, npc_rect.topleft)
+
+        # Check for interaction with NPC
+        if player_rect.colliderect(npc_rect):
+            draw_text("Press E to interact", RED, npc_rect.x - 50, npc_rect.y - 30)
+            if keys[pygame.K_e]:
+                in_dialogue = True
+                current_npc = True
+        else:
+            current_npc = False
+
+        # Pick up the answer once the worker is done, or drop it if the player walked away
+        if pending_answer:
+            if not current_npc:
+                pending_answer.cancel()
+                pending_answer = None
+            elif pending_answer.done:
+                answer = pending_answer.answer
+                pending_answer = None
+
+        # Display interaction window
+        if in_dialogue:
+            # Draw semi-transparent black background
+            renderer.draw_rect((0, 0, 0, 128), (10, 10, SCREEN_WIDTH - 20, SCREEN_HEIGHT - 20))
+    
+            for idx, line in enumerate(npc_lines):
+                draw_text(line, WHITE, 20, 20 + idx * LINE_HEIGHT)  # Display each line of NPC lore
+
+            if pending_answer:
+                draw_text("NPC: thinking...", WHITE, 20, 20 + len(npc_lines) * LINE_HEIGHT)
+            elif answer:
+                # Word-wrap the answer once, not every frame
+                if answer != wrapped_answer:
+                    wrapped_answer = answer
+                    answer_lines = wrap_text(font, "NPC: " + answer, DIALOGUE_TEXT_WIDTH)
+                for idx, line in enumerate(answer_lines):
+                    draw_text(line, WHITE, 20, 20 + (len(npc_lines) + idx) * LINE_HEIGHT)
+                    
+        # Close dialogue on pressing Esc
+        if keys[pygame.K_ESCAPE]:
+            in_dialogue = False
+            question = ""
+            answer = ""
+            if pending_answer:
+                pending_answer.cancel()
+                pending_answer = None
+
+        # Show that the NPC model is still loading in the background
+        if not qa_pipeline.ready:
+            draw_text("Loading NPC brain...", WHITE, 20, SCREEN_HEIGHT - 40)
+        else:
+            startup_report.print_once(qa_pipeline.error)
+
+        with tracer.span("display.flip"):
+            renderer.end_frame()
+
+if __name__ == "__main__":
+    main()
@@ -1,277 +1,494 @@
-import os
-import pygame
-import sys
-import math
-import random
-from transformers import pipeline
-
-# Set the working directory to the directory of the script
-script_dir = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_dir)
-
-# Initialize Pygame
-pygame.init()
-
-# Set up the screen for Full HD resolution
-SCREEN_WIDTH = 1920
-SCREEN_HEIGHT = 1080
-screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-pygame.display.set_caption("Top-Down Game")
-
-# Colors
-WHITE = (255, 255, 255)
-RED = (255, 0, 0)
-GREEN = (0, 255, 0)
-
-# Load background image
-background_image = pygame.image.load("grass.png").convert()
-background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
-
-# Load and scale player and NPC sprites
-player_sprite_original = pygame.image.load("player.png").convert_alpha()
-npc_sprite_original = pygame.image.load("npc.png").convert_alpha()
-
-# Scale sprites down
-player_sprite = pygame.transform.scale(player_sprite_original, (100, 100))  # Adjust size as needed
-npc_sprite = pygame.transform.scale(npc_sprite_original, (100, 100))  # Adjust size as needed
-
-# Player attributes
-player_rect = player_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-player_speed = 1  # Player movement speed
-
-# NPC attributes (fixed in the center of the screen)
-npc_rect = npc_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
-
-# Font
-font = pygame.font.SysFont(None, 30)
-
-# Load the question answering pipeline
-qa_pipeline = pipeline("question-answering")
-
-# Function to display text on the screen
-def draw_text(text, color, x, y):
-    text_surface = font.render(text, True, color)
-    screen.blit(text_surface, (x, y))
-
-# Function to calculate distance between two points
-def distance(x1, y1, x2, y2):
-    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
-
-# Function to simulate asking the NPC a question and getting an answer
-def get_answer_for_npc(question):
-    answer = qa_pipeline(question=question, context=npc_context)
-    return answer["answer"]
-
-# Class for additional sprites
-class SpecificSprite(pygame.sprite.Sprite):
-    def __init__(self, name, image, x, y):
-        super().__init__()
-        self.name = name
-        self.image = pygame.transform.scale(image, (300, 300))  # Scale down sprite
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (x, y)
-
-# Function to spawn specific sprites in predefined grid spots
-def spawn_specific_sprites(sprite_info_list, grid_spots):
-    sprites = []
-    random.shuffle(grid_spots)  # Randomize the order of grid spots
-
-    for idx, (name, image_path) in enumerate(sprite_info_list):
-        if idx < len(grid_spots):
-            x, y = grid_spots[idx]
-            image = pygame.image.load(image_path).convert_alpha()
-            sprite = SpecificSprite(name, image, x, y)
-            sprites.append(sprite)
-
-    return sprites
-
-# Predefined grid spots around the screen dimensions
-sprite_size = 300  # Size of the sprites
-half_sprite_size = sprite_size // 2
-
-grid_spots = [
-    (0, 0),  # LEFT-UP
-    (SCREEN_WIDTH // 2 - half_sprite_size, 0),  # CENTER-UP
-    (SCREEN_WIDTH - sprite_size, 0),  # RIGHT-UP
-    (0, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-LEFT
-    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-RIGHT
-    (0, SCREEN_HEIGHT - sprite_size),  # LEFT-DOWN
-    (SCREEN_WIDTH // 2 - half_sprite_size, SCREEN_HEIGHT - sprite_size),  # CENTER-DOWN
-    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT - sprite_size)  # RIGHT-DOWN
-]
-
-# List of specific sprites with names and image paths (excluding the fountain)
-sprite_info_list = [
-    ("Pyramid", "pyramid.png"),
-    ("Palace", "palace.png"),
-    ("Stadium", "stadium.png"),
-    ("Japanese Palace", "japanese.png"),
-    ("Tower", "tower.png"),
-    ("Hospital", "hospital.png"),
-    ("Train Station", "trainstation.png"),
-    ("Hotel", "hotel.png"),
-    # Add more sprites as needed
-]
-
-# Spawn specific sprites
-specific_sprites = spawn_specific_sprites(sprite_info_list, grid_spots)
-
-# Create a sprite group for easy drawing and updating
-all_sprites = pygame.sprite.Group()
-all_sprites.add(specific_sprites)
-
-# Function to write neighboring sprite information
-def get_neighboring_sprite_info(sprites):
-    info = []
-    for sprite in sprites:
-        neighbors = {
-            "left": None,
-            "right": None,
-            "up": None,
-            "down": None
-        }
-        sprite_center = sprite.rect.center
-
-        for other in sprites:
-            if other == sprite:
-                continue
-            other_center = other.rect.center
-
-            if other_center[0] < sprite_center[0] and abs(other_center[1] - sprite_center[1]) < sprite_size:
-                neighbors["left"] = other.name
-            if other_center[0] > sprite_center[0] and abs(other_center[1] - sprite_center[1]) < sprite_size:
-                neighbors["right"] = other.name
-            if other_center[1] < sprite_center[1] and abs(other_center[0] - sprite_center[0]) < sprite_size:
-                neighbors["up"] = other.name
-            if other_center[1] > sprite_center[1] and abs(other_center[0] - sprite_center[0]) < sprite_size:
-                neighbors["down"] = other.name
-
-        info.append((sprite.name, neighbors))
-    return info
-
-# Generate the town lore directly
-def generate_town_lore(sprites):
-    buildings_info = get_neighboring_sprite_info(sprites)
-    
-    lore = "This town is so strange because it only has 8 buildings arranged in a square.\n\n"
-    for name, neighbors in buildings_info:
-        lore += f"The {name} is located "
-        
-        locations = []
-        if neighbors['left']:
-            locations.append(f"to the right of the {neighbors['left']}")
-        if neighbors['right']:
-            locations.append(f"to the left of the {neighbors['right']}")
-        if neighbors['up']:
-            locations.append(f"below the {neighbors['up']}")
-        if neighbors['down']:
-            locations.append(f"above the {neighbors['down']}")
-        
-        if locations:
-            lore += " and ".join(locations) + ".\n"
-        else:
-            lore += "in an isolated spot.\n"
-
-    return lore
-
-def write_lore_to_file(lore, output_path):
-    with open(output_path, 'w') as file:
-        file.write(lore)
-
-# Generate town lore and write to file
-town_lore = generate_town_lore(specific_sprites)
-output_path = "town_lore.txt"
-write_lore_to_file(town_lore, output_path)
-
-# Set the NPC context to the generated town lore
-npc_context = town_lore
-
-print("Lore has been written to town_lore.txt")
-
-# Main game loop
-def main():
-    global player_rect  # Declare global variables
-
-    running = True
-    in_dialogue = False
-    question = ""
-    answer = ""
-    current_npc = False
-
-    while running:
-        # Draw background image
-        screen.blit(background_image, (0, 0))
-
-        # Handle events
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if in_dialogue:
-                    if event.key == pygame.K_BACKSPACE:
-                        question = question[:-1]
-                    elif event.key == pygame.K_RETURN:
-                        if question.strip():  # Check if the question is not empty
-                            answer = get_answer_for_npc(question)
-                        question = ""  # Clear the question
-                    else:
-                        question += event.unicode
-
-        # Player movement
-        keys = pygame.key.get_pressed()
-        player_dx = 0
-        player_dy = 0
-        if keys[pygame.K_LEFT]:
-            player_dx -= player_speed
-        if keys[pygame.K_RIGHT]:
-            player_dx += player_speed
-        if keys[pygame.K_UP]:
-            player_dy -= player_speed
-        if keys[pygame.K_DOWN]:
-            player_dy += player_speed
-        player_rect.x += player_dx
-        player_rect.y += player_dy
-
-        # Ensure player stays within screen bounds
-        player_rect.x = max(0, min(player_rect.x, SCREEN_WIDTH - player_rect.width))
-        player_rect.y = max(0, min(player_rect.y, SCREEN_HEIGHT - player_rect.height))
-
-        # Draw player sprite
-        screen.blit(player_sprite, player_rect.topleft)
-
-        # Draw NPC sprite
-        screen.blit(npc_sprite, npc_rect.topleft)
-
-        # Draw all specific sprites
-        all_sprites.draw(screen)
-
-        # Check for interaction with NPC
-        if player_rect.colliderect(npc_rect):
-            draw_text("Press E to interact", RED, npc_rect.x - 50, npc_rect.y - 30)
-            if keys[pygame.K_e]:
-                in_dialogue = True
-                current_npc = True
-        else:
-            current_npc = False
-
-        # Display interaction window
-        if in_dialogue:
-            # Draw semi-transparent black background
-            pygame.draw.rect(screen, (0, 0, 0, 128), (10, 10, SCREEN_WIDTH - 20, SCREEN_HEIGHT - 20))
-            draw_text("You: " + question, WHITE, 20, SCREEN_HEIGHT - 1030)
-            draw_text("NPC: This town is so strange it only has 8 building in a square!", WHITE, 20, 20)
-            if answer:
-                draw_text("NPC: " + answer, WHITE, 20, 80)
-
-        # Close dialogue on pressing Esc
-        if keys[pygame.K_ESCAPE]:
-            in_dialogue = False
-            question = ""
-            answer = ""
-
-        pygame.display.flip()
-
-if __name__ == "__main__":
-    main()
+import os
+import argparse
+import pygame
+import sys
+import math
+import time
+import random
+
+# Set the working directory to the directory of the script
+script_dir = os.path.dirname(os.path.abspath(__file__))
+os.chdir(script_dir)
+
+# Command line options; --benchmark runs a headless frame-time benchmark with recorded input
+parser = argparse.ArgumentParser(description="Top-Down Game")
+parser.add_argument("--benchmark", type=int, metavar="FRAMES", help="Run FRAMES frames headless and report frame times")
+parser.add_argument("--input-script", help="JSON input recording to replay in benchmark mode")
+parser.add_argument("--benchmark-output", help="Write the benchmark report as JSON to this file")
+parser.add_argument("--full-redraw", action="store_true", help="Redraw the whole screen every frame instead of only what changed (F2 toggles)")
+parser.add_argument("--fps", type=int, default=None, help="Frame rate cap (0 = uncapped; default 60, uncapped when benchmarking)")
+parser.add_argument("--town-size", type=int, default=0, help="Generate a town with this many buildings (default: the classic 8-building square)")
+parser.add_argument("--villagers", type=int, default=0, help="Number of extra NPCs wandering the town, all of whom know the town lore")
+parser.add_argument("--generate", action="store_true", help="NPCs write their replies with a small text generation model, shown as they are generated")
+parser.add_argument("--seed", type=int, default=None, help="Random seed for the town layout, to get the same town again")
+parser.add_argument("--semantic-cache", type=float, nargs="?", const=0.85, default=None, metavar="THRESHOLD",
+                    help="Also reuse answers to rephrased questions, matched by sentence embedding similarity (default 0.85)")
+parser.add_argument("--cache-audit", type=float, default=0.0, metavar="RATE",
+                    help="With --semantic-cache, send this fraction of similarity hits to the model anyway and count disagreements")
+options, _ = parser.parse_known_args()
+if options.benchmark:
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+# Make the shared NPC modules in the repository root importable
+sys.path.insert(0, os.path.dirname(script_dir))
+from town_spatial import SpatialGrid
+from town_generator import BUILDING_TYPES, generate_town
+from town_lore import TownLore
+from world_knowledge import KnowledgeQA, WorldKnowledge
+from npc_registry import NPC, NPCRegistry
+from npc_generation import StreamingWorker, load_chat_generator
+from npc_inference import InferenceWorker, LazyQAPipeline, StartupReport
+from npc_backends import load_qa_backend
+from npc_context_store import ContextStore
+from npc_retrieval import RetrievalQA
+from npc_cache import AnswerCache
+from npc_semantic_cache import SemanticAnswerCache
+from npc_answer_bundle import BundleQA, load_answer_bundle
+from npc_server import RemoteQAPipeline, server_address
+from game_benchmark import FrameProfiler, ScriptedInput
+from tracing import finish_tracing, toggle_tracing, tracer
+from game_text import TextCache, wrap_text
+from game_loop import SIMULATION_STEP, FixedStepClock, move_player
+from game_render import Camera, DirtyRenderer
+from asset_atlas import GAME_ASSET_SIZES, load_atlas
+
+# Initialize Pygame
+pygame.init()
+
+# Set up the screen for Full HD resolution
+SCREEN_WIDTH = 1920
+SCREEN_HEIGHT = 1080
+screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+pygame.display.set_caption("Top-Down Game")
+
+# NPC contexts are tokenized once by the context store and reused for every question;
+# long lore is indexed into passages so the model only reads the ones relevant to the question
+context_store = ContextStore()
+lore_reader = RetrievalQA(context_store)
+
+# The model backend (pipeline, quantized or onnx) is picked with the NPC_QA_BACKEND environment variable;
+# with NPC_QA_SERVER set the questions go to a shared npc_server.py instead of a model in this process
+def load_npc_reader():
+    if server_address():
+        return RemoteQAPipeline(server_address())
+    context_store.attach(load_qa_backend())
+    return lore_reader
+
+# Start loading the question answering model (or, with --generate, the dialogue model) in the background
+# now that the window is up
+startup_report = StartupReport()
+qa_pipeline = LazyQAPipeline(loader=load_chat_generator if options.generate else load_npc_reader,
+                             report=startup_report,
+                             preload_modules=() if server_address() and not options.generate else ("transformers",)).start()
+
+# Colors
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+
+# Load background image
+asset_load_started = time.perf_counter()
+background_image = pygame.image.load("grass.png").convert()
+background_image = pygame.transform.scale(background_image, (SCREEN_WIDTH, SCREEN_HEIGHT))
+
+# Load all sprites, pre-scaled to their in-game sizes, from one atlas image
+# (built on first launch or with `python asset_atlas.py "Joc ALJV 4.0"`)
+sprite_images = load_atlas(".", GAME_ASSET_SIZES)
+player_sprite = sprite_images["player.png"]
+npc_sprite = sprite_images["npc.png"]
+
+# Frame pacing: the loop renders at most TARGET_FPS frames per second and sleeps in between,
+# while movement is simulated in fixed SIMULATION_STEP increments of real time (see game_loop.py)
+TARGET_FPS = options.fps if options.fps is not None else (0 if options.benchmark else 60)
+
+# Player attributes
+player_rect = player_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+player_position = pygame.Vector2(player_rect.topleft)  # Exact position; player_rect holds the rounded one
+player_speed = 300  # Player movement speed in pixels per second
+
+# NPC attributes (the town's own NPC stands in the center of the first screen)
+npc_rect = npc_sprite.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
+npc_radius = npc_rect.width // 2
+
+# Font, and the rendered text surfaces that are reused from frame to frame
+font = pygame.font.SysFont(None, 30)
+text_cache = TextCache(max_entries=256)
+LINE_HEIGHT = 30
+DIALOGUE_TEXT_WIDTH = SCREEN_WIDTH - 40
+
+# Remember answers between questions (and between sessions); with --semantic-cache a rephrased
+# question can reuse the answer to the one it means
+answer_cache_path = "chat_cache.json" if options.generate else "answer_cache.json"
+if options.semantic_cache is not None:
+    answer_cache = SemanticAnswerCache(max_entries=1024, path=answer_cache_path, threshold=options.semantic_cache,
+                                       audit_rate=options.cache_audit)
+else:
+    answer_cache = AnswerCache(max_entries=1024, path=answer_cache_path)
+
+# Spatial questions ("What is left of the Palace?") are answered from the building neighbor table;
+# only the questions no template matches reach the model
+knowledge_reader = KnowledgeQA(qa_pipeline)
+
+# Answers precomputed by npc_answer_bundle.py for this lore are used right away, even before the model has loaded
+with startup_report.measure("bundle load"):
+    answer_bundle = load_answer_bundle()
+npc_reader = BundleQA(knowledge_reader, answer_bundle) if answer_bundle else knowledge_reader
+
+# Run the model on a background thread so the game keeps rendering while the NPC thinks; generated
+# replies are streamed into the dialogue box as they are written, from the lore passages relevant to the question
+if options.generate:
+    qa_worker = StreamingWorker(qa_pipeline, cache=answer_cache, prepare_context=lore_reader.retrieve).start()
+else:
+    qa_worker = InferenceWorker(npc_reader, cache=answer_cache).start()
+
+# Function to display text on the screen
+def draw_text(text, color, x, y):
+    with tracer.span("draw_text"):
+        text_surface = text_cache.render(font, text, color)
+        renderer.blit(text_surface, (x, y))
+
+# Function to calculate distance between two points
+def distance(x1, y1, x2, y2):
+    return math.sqrt((x2 - x1)**2 + (y2 - y1)**2)
+
+# Class for additional sprites
+class SpecificSprite(pygame.sprite.Sprite):
+    def __init__(self, name, image, x, y):
+        super().__init__()
+        self.name = name
+        self.image = image if image.get_size() == (300, 300) else pygame.transform.scale(image, (300, 300))
+        self.rect = self.image.get_rect()
+        self.rect.topleft = (x, y)
+
+# Function to spawn specific sprites in predefined grid spots
+def spawn_specific_sprites(sprite_info_list, grid_spots, rng=random):
+    sprites = []
+    rng.shuffle(grid_spots)  # Randomize the order of grid spots
+
+    for idx, (name, image_path) in enumerate(sprite_info_list):
+        if idx < len(grid_spots):
+            x, y = grid_spots[idx]
+            image = sprite_images[image_path]
+            sprite = SpecificSprite(name, image, x, y)
+            sprites.append(sprite)
+
+    return sprites
+
+# Function to spawn the buildings of a generated town; all buildings of one type share the same image
+def spawn_generated_town(placements):
+    return [SpecificSprite(name, sprite_images[image_path], x, y) for name, image_path, x, y in placements]
+
+# Predefined grid spots around the screen dimensions
+sprite_size = 300  # Size of the sprites
+half_sprite_size = sprite_size // 2
+
+grid_spots = [
+    (0, 0),  # LEFT-UP
+    (SCREEN_WIDTH // 2 - half_sprite_size, 0),  # CENTER-UP
+    (SCREEN_WIDTH - sprite_size, 0),  # RIGHT-UP
+    (0, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-LEFT
+    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT // 2 - half_sprite_size),  # CENTER-RIGHT
+    (0, SCREEN_HEIGHT - sprite_size),  # LEFT-DOWN
+    (SCREEN_WIDTH // 2 - half_sprite_size, SCREEN_HEIGHT - sprite_size),  # CENTER-DOWN
+    (SCREEN_WIDTH - sprite_size, SCREEN_HEIGHT - sprite_size)  # RIGHT-DOWN
+]
+
+# List of specific sprites with names and image paths (excluding the fountain)
+sprite_info_list = list(BUILDING_TYPES)
+
+# Spawn specific sprites: the classic square, or a generated town with --town-size buildings
+if options.town_size > 0:
+    town_placements, world_size = generate_town(options.town_size, sprite_info_list, seed=options.seed,
+                                                lot_size=sprite_size, keep_clear=npc_rect.inflate(200, 200))
+    specific_sprites = spawn_generated_town(town_placements)
+    town_description = "This town is laid out on a grid of streets."
+    town_size_line = lambda count: f"\nIt has {count} buildings.\n"
+else:
+    specific_sprites = spawn_specific_sprites(sprite_info_list, grid_spots, random.Random(options.seed))
+    world_size = (SCREEN_WIDTH, SCREEN_HEIGHT)
+    town_description = "This town is so strange because it only has 8 buildings arranged in a square."
+    town_size_line = lambda count: "" if count == 8 else f"\nNow it has {count} buildings.\n"
+startup_report.record("asset load", time.perf_counter() - asset_load_started)
+
+# Spatial index over the buildings, used for the lore, for culling and for finding what the player is next to
+building_index = SpatialGrid(sprite_size).insert_all(specific_sprites)
+
+# The camera follows the player around worlds bigger than the screen; positions are in world coordinates
+camera = Camera((SCREEN_WIDTH, SCREEN_HEIGHT), world_size)
+
+# Function to draw the scenery under the camera: the tiled background and only the buildings in view
+def draw_scenery(surface):
+    tile_width, tile_height = background_image.get_size()
+    for x in range(-(camera.rect.x % tile_width), SCREEN_WIDTH, tile_width):
+        for y in range(-(camera.rect.y % tile_height), SCREEN_HEIGHT, tile_height):
+            surface.blit(background_image, (x, y))
+    for sprite in building_index.query_rect(camera.rect):
+        surface.blit(sprite.image, camera.to_screen(sprite.rect))
+
+# Only the regions touched by the player, the NPC and the text are redrawn each frame
+renderer = DirtyRenderer(screen, draw_scenery, full_redraw=options.full_redraw)
+
+# Generate the town lore and write it to file; after that it is updated building by building
+world_knowledge = WorldKnowledge()
+town_lore = TownLore(building_index, sprite_size, town_description, town_size_line, path="town_lore.txt",
+                     knowledge=world_knowledge)
+town_lore.build(specific_sprites)
+
+# Set the NPC context to the generated town lore and forget answers about the old layout
+npc_context = town_lore.text
+answer_cache.invalidate("NPC", npc_context)
+lore_reader.set_index(npc_context, town_lore)
+lore_reader.add_context(npc_context)
+knowledge_reader.set_knowledge(npc_context, world_knowledge)
+
+print("Lore has been written to town_lore.txt")
+
+# Function to place villagers on random free spots (not inside a building) around the town
+def spawn_villagers(count, rng):
+    villagers = []
+    for number in range(1, count + 1):
+        for _ in range(20):
+            spot = npc_sprite.get_rect(center=(rng.randrange(world_size[0]), rng.randrange(world_size[1])))
+            if world_rect.contains(spot) and not building_index.query_rect(spot):
+                break
+        else:
+            continue  # No free spot found; skip this villager rather than put it inside a building
+        villagers.append(NPC(f"Villager {number}", spot.centerx, spot.centery, spot.width // 2, npc_context,
+                             sprite=npc_sprite))
+    return villagers
+
+# All NPCs, looked up by position so only the ones near the player or on screen are checked;
+# their questions share one inference worker
+world_rect = pygame.Rect((0, 0), world_size)
+npc_registry = NPCRegistry(cell_size=sprite_size)
+npc_registry.add(NPC("NPC", npc_rect.centerx, npc_rect.centery, npc_rect.width // 2, npc_context, sprite=npc_sprite))
+for villager in spawn_villagers(options.villagers, random.Random(options.seed)):
+    npc_registry.add(villager)
+
+# Function to update the NPC context after buildings changed: answers that don't involve the changed
+# buildings are kept, and the question answering index is the lore's own, already up to date
+def refresh_lore(changed_names):
+    global npc_context
+    old_context = npc_context
+    npc_context = town_lore.text
+    # Only answers about a single, unchanged building stay valid; town-wide ones (the building count) are dropped
+    answer_cache.carry_over(None, old_context, npc_context, changed_names, town_lore.order)
+    for npc in npc_registry:
+        if npc.context is old_context:
+            npc.context = npc_context
+    lore_reader.drop_index(old_context)
+    lore_reader.set_index(npc_context, town_lore)
+    lore_reader.add_context(npc_context)
+    knowledge_reader.drop_knowledge(old_context)
+    knowledge_reader.set_knowledge(npc_context, world_knowledge)
+    renderer.rebuild_static()
+
+# Function to put up a new building with its top-left corner at (x, y)
+def add_building(name, image_path, x, y):
+    sprite = SpecificSprite(name, sprite_images[image_path], x, y)
+    specific_sprites.append(sprite)
+    refresh_lore(town_lore.add(sprite))
+    return sprite
+
+# Function to tear a building down
+def remove_building(sprite):
+    specific_sprites.remove(sprite)
+    refresh_lore(town_lore.remove(sprite))
+
+# Function to move a building so its top-left corner is at (x, y)
+def move_building(sprite, x, y):
+    refresh_lore(town_lore.move(sprite, (x, y)))
+
+# Function to pick an unused name for another building of a type ("Hotel", "Hotel 2", ...)
+def next_building_name(name):
+    number = 1
+    candidate = name
+    while candidate in town_lore.lines:
+        number += 1
+        candidate = f"{name} {number}"
+    return candidate
+
+# Function to build a random building where the player stands, or demolish the one they are next to
+def build_or_demolish():
+    for building in building_index.query_rect(player_rect.inflate(20, 20)):
+        remove_building(building)
+        return
+    name, image_path = random.choice(sprite_info_list)
+    x = max(0, min(player_rect.centerx - half_sprite_size, world_size[0] - sprite_size))
+    y = max(0, min(player_rect.centery - half_sprite_size, world_size[1] - sprite_size))
+    add_building(next_building_name(name), image_path, x, y)
+
+# Function for what the NPC says when a conversation starts
+def town_greeting():
+    if options.town_size > 0:
+        return f"This town is huge, it has {len(specific_sprites)} buildings!"
+    if len(specific_sprites) != 8:
+        return f"This town used to have only 8 buildings, now it has {len(specific_sprites)}!"
+    return "This town is so strange it only has 8 building in a square!"
+
+# Main game loop; in benchmark mode input comes from a recorded script and the loop stops after a fixed number of frames
+def main(benchmark_frames=None, scripted_input=None, profiler=None):
+    global player_rect  # Declare global variables
+
+    running = True
+    in_dialogue = False
+    question = ""
+    answer = ""
+    current_npc = None  # NPC the player is talking to
+    pending_answer = None  # Question waiting on the inference worker
+    wrapped_answer = None  # Answer that answer_lines was laid out for
+    answer_lines = []
+    # Frame phases are only timed while tracing is on (F3 or NPC_TRACE), unless benchmarking
+    profiler = profiler or FrameProfiler(enabled=False, tracer=tracer)
+    frame = 0
+    clock = FixedStepClock(TARGET_FPS)
+
+    while running:
+        # Sleep off the rest of the frame budget, then work out how many movement steps are due;
+        # benchmark runs advance a fixed 1/60 s per frame so recorded input replays the same way
+        steps = clock.tick(1 / 60 if benchmark_frames else None)
+        profiler.start_frame()
+
+        # Handle events
+        events = pygame.event.get()
+        if scripted_input:
+            events += scripted_input.events(frame)
+        for event in events:
+            if event.type == pygame.QUIT:
+                running = False
+                answer_cache.save()
+                finish_tracing()
+                pygame.quit()
+                sys.exit()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_F2:
+                    renderer.toggle_full_redraw()
+                elif event.key == pygame.K_F3:
+                    toggle_tracing()
+                elif in_dialogue:
+                    if event.key == pygame.K_BACKSPACE:
+                        question = question[:-1]
+                    elif event.key == pygame.K_RETURN:
+                        if question.strip():  # Check if the question is not empty
+                            if current_npc:
+                                if pending_answer:
+                                    pending_answer.cancel()
+                                pending_answer = npc_registry.ask(qa_worker, current_npc.name, question)
+                                answer = ""
+                            else:
+                                answer = "Please interact with an NPC first."
+                        question = ""  # Clear the question
+                    else:
+                        question += event.unicode
+                elif event.key == pygame.K_b:
+                    build_or_demolish()
+        keys = scripted_input.pressed(frame) if scripted_input else pygame.key.get_pressed()
+        profiler.mark("events")
+
+        # Player movement, in fixed steps so speed doesn't depend on the frame rate; the player stays within the world
+        for _ in range(steps):
+            move_player(keys, player_position, player_speed, SIMULATION_STEP, player_rect, world_size)
+
+        # Check for interaction with the nearest NPC
+        near_npc = npc_registry.nearest(player_rect.centerx, player_rect.centery, player_rect.width // 2)
+        if near_npc:
+            if keys[pygame.K_e]:
+                in_dialogue = True
+                current_npc = near_npc
+        else:
+            current_npc = None
+
+        # Pick up the answer once the worker is done, or drop it if the player walked away
+        if pending_answer:
+            if not current_npc or pending_answer.npc_name != current_npc.name:
+                pending_answer.cancel()
+                pending_answer = None
+            elif pending_answer.done:
+                answer = pending_answer.answer
+                current_npc.remember(pending_answer.question, answer)
+                pending_answer = None
+
+        # Close dialogue on pressing Esc
+        if keys[pygame.K_ESCAPE]:
+            in_dialogue = False
+            question = ""
+            answer = ""
+            if pending_answer:
+                pending_answer.cancel()
+                pending_answer = None
+        profiler.mark("movement")
+
+        # Scroll with the player; the scenery under the new view is recomposed from the buildings in it
+        if camera.follow(player_rect):
+            renderer.rebuild_static()
+
+        # Restore the background and buildings where last frame's player, NPC and text were
+        renderer.begin_frame()
+
+        # Draw player sprite
+        renderer.blit(player_sprite, camera.to_screen(player_rect))
+
+        # Draw the NPCs in view
+        for npc in npc_registry.in_rect(camera.rect.x - npc_radius, camera.rect.y - npc_radius,
+                                        camera.rect.width + 2 * npc_radius, camera.rect.height + 2 * npc_radius):
+            renderer.blit(npc.sprite, camera.to_screen((npc.x - npc.radius, npc.y - npc.radius)))
+        profiler.mark("blit")
+
+        if near_npc:
+            npc_x, npc_y = camera.to_screen((near_npc.x - near_npc.radius, near_npc.y - near_npc.radius))
+            draw_text("Press E to interact", RED, npc_x - 50, npc_y - 30)
+
+        # Name the building the player is standing next to
+        if not in_dialogue:
+            for building in building_index.query_rect(player_rect.inflate(20, 20)):
+                building_x, building_y = camera.to_screen(building.rect)
+                draw_text(building.name, WHITE, building_x, building_y - 30)
+                break
+
+        # Display interaction window
+        if in_dialogue:
+            # Draw semi-transparent black background
+            renderer.draw_rect((0, 0, 0, 128), (10, 10, SCREEN_WIDTH - 20, SCREEN_HEIGHT - 20))
+            draw_text("You: " + question, WHITE, 20, SCREEN_HEIGHT - 1030)
+            speaker = current_npc.name if current_npc else "NPC"
+            draw_text(f"{speaker}: " + town_greeting(), WHITE, 20, 20)
+            reply = pending_answer.partial if pending_answer else answer
+            if pending_answer and not reply:
+                draw_text(f"{speaker}: thinking...", WHITE, 20, 80)
+            elif reply:
+                # Word-wrap the answer once (or each time a streamed reply grows), not every frame
+                if (speaker, reply) != wrapped_answer:
+                    wrapped_answer = (speaker, reply)
+                    answer_lines = wrap_text(font, f"{speaker}: " + reply, DIALOGUE_TEXT_WIDTH)
+                for idx, line in enumerate(answer_lines):
+                    draw_text(line, WHITE, 20, 80 + idx * LINE_HEIGHT)
+
+        # Show that the NPC model is still loading in the background
+        if not qa_pipeline.ready:
+            draw_text("Loading NPC brain...", WHITE, 20, SCREEN_HEIGHT - 40)
+        else:
+            startup_report.print_once(qa_pipeline.error)
+        profiler.mark("text")
+
+        renderer.end_frame()
+        profiler.mark("flip")
+        profiler.end_frame()
+
+        frame += 1
+        if benchmark_frames and frame >= benchmark_frames:
+            running = False
+
+if __name__ == "__main__":
+    if options.benchmark:
+        scripted_input = ScriptedInput.from_file(pygame, options.input_script) if options.input_script else ScriptedInput(pygame)
+        profiler = FrameProfiler(tracer=tracer)
+        main(options.benchmark, scripted_input, profiler)
+        profiler.print_report()
+        if options.benchmark_output:
+            profiler.write(options.benchmark_output)
+        if options.semantic_cache is not None:
+            print(f"Answer cache: {answer_cache.stats()}")
+        finish_tracing()
+        pygame.quit()
+    else:
+        main()
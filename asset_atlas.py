@@ -0,0 +1,101 @@
+import json
+import os
+import sys
+
+import pygame
+
+ATLAS_IMAGE = "atlas.png"
+ATLAS_MANIFEST = "atlas.json"
+ATLAS_WIDTH = 2048
+PADDING = 2  # Transparent gap between sprites so scaling/filtering never bleeds between them
+
+# In-game sizes of the 2.0, 3.0 and 4.0 sprites. The grass background is left out: it is upscaled to fill
+# the screen, so storing it pre-scaled would only make the atlas bigger to read and decode.
+GAME_ASSET_SIZES = {
+    "player.png": (100, 100),
+    "npc.png": (100, 100),
+    "pyramid.png": (300, 300),
+    "palace.png": (300, 300),
+    "stadium.png": (300, 300),
+    "japanese.png": (300, 300),
+    "tower.png": (300, 300),
+    "hospital.png": (300, 300),
+    "trainstation.png": (300, 300),
+    "hotel.png": (300, 300),
+}
+
+
+# Function to place rectangles into rows ("shelves") of a fixed-width atlas
+def pack_shelves(sizes, width=ATLAS_WIDTH, padding=PADDING):
+    placements = {}
+    x = y = shelf_height = 0
+    # Tallest first keeps the shelves tight
+    for name, (w, h) in sorted(sizes.items(), key=lambda item: (-item[1][1], item[0])):
+        if x + w > width:
+            x = 0
+            y += shelf_height + padding
+            shelf_height = 0
+        placements[name] = (x, y, w, h)
+        x += w + padding
+        shelf_height = max(shelf_height, h)
+    return placements, max(width, max((w for w, _ in sizes.values()), default=0)), y + shelf_height
+
+
+# Function to pre-scale every asset to its in-game size and pack them into one image
+def build_atlas(asset_dir, sizes=GAME_ASSET_SIZES):
+    placements, width, height = pack_shelves(sizes)
+    atlas = pygame.Surface((width, height), pygame.SRCALPHA)
+    for name, (x, y, w, h) in placements.items():
+        image = pygame.image.load(os.path.join(asset_dir, name))
+        if image.get_bitsize() not in (24, 32):
+            image = image.convert(32, pygame.SRCALPHA)
+        atlas.blit(pygame.transform.smoothscale(image, (w, h)), (x, y))
+
+    pygame.image.save(atlas, os.path.join(asset_dir, ATLAS_IMAGE))
+    manifest = {
+        "image": ATLAS_IMAGE,
+        "sprites": {name: list(rect) for name, rect in placements.items()},
+        "sources": {name: os.path.getmtime(os.path.join(asset_dir, name)) for name in placements},
+    }
+    with open(os.path.join(asset_dir, ATLAS_MANIFEST), "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+# Function to check that a built atlas still matches the requested sizes and source images
+def atlas_is_current(asset_dir, sizes, manifest):
+    sprites = manifest.get("sprites", {})
+    if set(sprites) != set(sizes):
+        return False
+    for name, (w, h) in sizes.items():
+        if tuple(sprites[name][2:]) != (w, h):
+            return False
+        if os.path.getmtime(os.path.join(asset_dir, name)) > manifest["sources"].get(name, 0):
+            return False
+    return os.path.exists(os.path.join(asset_dir, manifest["image"]))
+
+
+# Function to load every sprite from the atlas, building it first if it is missing or stale
+def load_atlas(asset_dir=".", sizes=GAME_ASSET_SIZES):
+    """
+    Return a dict of asset file name -> surface at its in-game size. All
+    surfaces are subsurfaces of one decoded atlas image, so the pixels are
+    loaded and stored once. Needs an open display (for convert_alpha).
+    """
+    manifest_path = os.path.join(asset_dir, ATLAS_MANIFEST)
+    manifest = None
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+    if manifest is None or not atlas_is_current(asset_dir, sizes, manifest):
+        manifest = build_atlas(asset_dir, sizes)
+
+    atlas = pygame.image.load(os.path.join(asset_dir, manifest["image"])).convert_alpha()
+    return {name: atlas.subsurface(pygame.Rect(rect)) for name, rect in manifest["sprites"].items()}
+
+
+if __name__ == "__main__":
+    # Usage: python asset_atlas.py "Joc ALJV 4.0"
+    asset_dir = sys.argv[1] if len(sys.argv) > 1 else "."
+    built = build_atlas(asset_dir)
+    print(f"Packed {len(built['sprites'])} sprites into {os.path.join(asset_dir, ATLAS_IMAGE)}")
@@ -0,0 +1,154 @@
+import json
+import time
+
+from stats_utils import percentile
+
+# Input recorded for the benchmark when no script is given: talk to the NPC, ask a question,
+# walk away while it is thinking, then wander around the town
+DEFAULT_INPUT_SCRIPT = [
+    {"frames": 2, "hold": ["e"]},
+    {"frames": 1, "type": "What is left of the Palace?"},
+    {"frames": 1, "press": ["return"]},
+    {"frames": 120},
+    {"frames": 1, "type": "Where is the Hotel?"},
+    {"frames": 1, "press": ["return"]},
+    {"frames": 30},
+    {"frames": 300, "hold": ["right"]},
+    {"frames": 2, "hold": ["escape"]},
+    {"frames": 300, "hold": ["down"]},
+    {"frames": 600, "hold": ["left"]},
+    {"frames": 300, "hold": ["up", "right"]},
+]
+
+
+# Pressed-key lookup that behaves like the result of pygame.key.get_pressed()
+class KeyState:
+    def __init__(self, held):
+        self.held = held
+
+    def __getitem__(self, key):
+        return key in self.held
+
+
+# Replays a recorded input sequence frame by frame
+class ScriptedInput:
+    """
+    Steps are dicts with `frames` (how long the step lasts) and any of
+    `hold` (key names held down), `press` (key names pressed once on the
+    first frame) and `type` (text typed on the first frame). Key names
+    are pygame names such as "left", "e" or "return". The script loops
+    until the benchmark has run the requested number of frames.
+    """
+
+    def __init__(self, pygame, steps=None):
+        self.pygame = pygame
+        self.frames = []  # (held key codes, events) per frame
+        for step in steps or DEFAULT_INPUT_SCRIPT:
+            held = frozenset(pygame.key.key_code(name) for name in step.get("hold", []))
+            events = [self._keydown(pygame.key.key_code(name), "\r" if name == "return" else "")
+                      for name in step.get("press", [])]
+            events += [self._keydown(self._char_code(char), char) for char in step.get("type", "")]
+            for index in range(step.get("frames", 1)):
+                self.frames.append((held, events if index == 0 else []))
+
+    @classmethod
+    def from_file(cls, pygame, path):
+        with open(path) as file:
+            return cls(pygame, json.load(file))
+
+    def _keydown(self, key, unicode):
+        return self.pygame.event.Event(self.pygame.KEYDOWN, key=key, unicode=unicode, mod=0, scancode=0)
+
+    def _char_code(self, char):
+        try:
+            return self.pygame.key.key_code(char)
+        except ValueError:
+            return 0
+
+    def events(self, frame):
+        return self.frames[frame % len(self.frames)][1]
+
+    def pressed(self, frame):
+        return KeyState(self.frames[frame % len(self.frames)][0])
+
+
+# Per-phase timer for the frame loop
+class FrameProfiler:
+    """
+    Call `start_frame()` at the top of the loop, `mark(phase)` after each
+    phase and `end_frame()` after the flip. Time between marks is added to
+    the phase that just finished.
+
+    With a `tracer` (see tracing.Tracer) every phase and frame is also
+    recorded as a span while that tracer is on, even if the profiler
+    itself is disabled.
+    """
+
+    def __init__(self, enabled=True, tracer=None):
+        self.enabled = enabled
+        self.tracer = tracer
+        self.frame_times = []
+        self.phase_totals = {}
+        self._frame_started = 0
+        self._last_mark = 0
+        self._timing = False  # Whether the current frame is being timed
+
+    def start_frame(self):
+        # Switching the tracer on or off takes effect from the next frame
+        self._timing = self.enabled or (self.tracer is not None and self.tracer.enabled)
+        if self._timing:
+            self._frame_started = self._last_mark = time.perf_counter_ns()
+
+    def mark(self, phase):
+        if self._timing:
+            now = time.perf_counter_ns()
+            if self.enabled:
+                self.phase_totals[phase] = self.phase_totals.get(phase, 0.0) + (now - self._last_mark) / 1e9
+            if self.tracer is not None:
+                self.tracer.record(phase, self._last_mark, now - self._last_mark)
+            self._last_mark = now
+
+    def end_frame(self):
+        if self._timing:
+            duration = time.perf_counter_ns() - self._frame_started
+            if self.enabled:
+                self.frame_times.append(duration / 1e9)
+            if self.tracer is not None:
+                self.tracer.record("frame", self._frame_started, duration)
+
+    def report(self):
+        frames = len(self.frame_times)
+        total = sum(self.frame_times) or 1e-9
+        frame_ms = [1000 * seconds for seconds in self.frame_times]
+        return {
+            "frames": frames,
+            # Frames per second of actual work; time the frame limiter spends sleeping is not counted
+            "work_fps": round(frames / total, 1),
+            "frame_ms": {
+                "mean": round(sum(frame_ms) / frames, 3) if frames else 0.0,
+                "p50": round(percentile(frame_ms, 50), 3),
+                "p95": round(percentile(frame_ms, 95), 3),
+                "p99": round(percentile(frame_ms, 99), 3),
+                "max": round(max(frame_ms), 3) if frames else 0.0,
+            },
+            "phases": {
+                phase: {
+                    "mean_ms": round(1000 * seconds / frames, 3) if frames else 0.0,
+                    "share": round(seconds / total, 3),
+                }
+                for phase, seconds in self.phase_totals.items()
+            },
+        }
+
+    def print_report(self):
+        report = self.report()
+        frame_ms = report["frame_ms"]
+        print(f"{report['frames']} frames, {report['work_fps']} fps of work, frame time mean {frame_ms['mean']} ms, "
+              f"p50 {frame_ms['p50']} ms, p95 {frame_ms['p95']} ms, p99 {frame_ms['p99']} ms, max {frame_ms['max']} ms")
+        for phase, stats in report["phases"].items():
+            print(f"  {phase:<10} {stats['mean_ms']:>8} ms  {100 * stats['share']:>5.1f}%")
+        return report
+
+    def write(self, path):
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent=2)
@@ -0,0 +1,65 @@
+import pygame
+
+DEFAULT_FPS = 60
+SIMULATION_STEP = 1 / 120  # Seconds of game time per movement update
+MAX_FRAME_TIME = 0.25  # Don't try to catch up on more than this after a stall
+
+
+# Frame limiter that hands out fixed simulation steps for the real time that has passed
+class FixedStepClock:
+    """
+    `tick()` sleeps off the rest of the frame budget (at most
+    `target_fps` frames per second, 0 for no limit) and returns how many
+    `step`-second movement updates are due, so the game moves at the same
+    speed however fast the machine renders. A frame that took longer than
+    `max_frame_time` only counts as that much, so a stall doesn't turn
+    into a burst of catch-up steps.
+    """
+
+    def __init__(self, target_fps=DEFAULT_FPS, step=SIMULATION_STEP, max_frame_time=MAX_FRAME_TIME):
+        self.target_fps = target_fps
+        self.step = step
+        self.max_frame_time = max_frame_time
+        self.unsimulated_time = 0.0
+        self._clock = pygame.time.Clock()
+
+    def tick(self, frame_time=None):
+        """
+        Wait for the next frame. `frame_time` replaces the measured frame
+        time (benchmark runs replay recorded input at a fixed 1/60 s).
+        """
+        measured = self._clock.tick(self.target_fps) / 1000
+        if frame_time is None:
+            frame_time = measured
+        self.unsimulated_time += min(frame_time, self.max_frame_time)
+        steps = 0
+        while self.unsimulated_time >= self.step:
+            self.unsimulated_time -= self.step
+            steps += 1
+        return steps
+
+
+# Function to move the player for one fixed simulation step in the direction the arrow keys point
+def move_player(keys, position, speed, dt, rect=None, bounds=None):
+    """
+    `position` (a pygame.Vector2) moves `speed` pixels per second. With a
+    `rect` and the `bounds` size it is kept inside (0, 0, *bounds), and
+    the rect is moved to the rounded position.
+    """
+    direction = pygame.Vector2(0, 0)
+    if keys[pygame.K_LEFT]:
+        direction.x -= 1
+    if keys[pygame.K_RIGHT]:
+        direction.x += 1
+    if keys[pygame.K_UP]:
+        direction.y -= 1
+    if keys[pygame.K_DOWN]:
+        direction.y += 1
+    position.update(position + direction * speed * dt)
+
+    if rect is not None:
+        if bounds is not None:
+            position.x = max(0, min(position.x, bounds[0] - rect.width))
+            position.y = max(0, min(position.y, bounds[1] - rect.height))
+        rect.topleft = (round(position.x), round(position.y))
+    return position
@@ -0,0 +1,93 @@
+import pygame
+
+
+# Renderer that only redraws and updates the parts of the screen that changed
+class DirtyRenderer:
+    """
+    Scenery that doesn't move (background and buildings) is composed once
+    into `static_layer`. Every frame the rectangles covered by last
+    frame's dynamic drawing (player, NPC, prompts, dialogue) are restored
+    from the static layer, the new dynamic drawing is done, and only the
+    union of old and new rectangles is pushed to the display.
+
+    With `full_redraw` set it behaves like the original loop: the whole
+    static layer is blitted and the display flipped every frame.
+    """
+
+    def __init__(self, screen, draw_static, full_redraw=False):
+        self.screen = screen
+        self.draw_static = draw_static
+        self.full_redraw = full_redraw
+        self.static_layer = pygame.Surface(screen.get_size()).convert()
+        self._previous = []
+        self._current = []
+        self._needs_full_update = True
+        self.rebuild_static()
+
+    def rebuild_static(self):
+        """
+        Recompose the static layer, e.g. after buildings were added or moved.
+        """
+        self.draw_static(self.static_layer)
+        self._needs_full_update = True
+
+    def toggle_full_redraw(self):
+        self.full_redraw = not self.full_redraw
+        self._needs_full_update = True
+
+    def begin_frame(self):
+        if self.full_redraw or self._needs_full_update:
+            self.screen.blit(self.static_layer, (0, 0))
+        else:
+            for rect in self._previous:
+                self.screen.blit(self.static_layer, rect, rect)
+        self._current = []
+
+    def blit(self, surface, position):
+        rect = self.screen.blit(surface, position)
+        self._current.append(rect)
+        return rect
+
+    def draw_rect(self, color, rect):
+        rect = pygame.draw.rect(self.screen, color, rect)
+        self._current.append(rect)
+        return rect
+
+    def end_frame(self):
+        if self.full_redraw or self._needs_full_update:
+            pygame.display.flip()
+            self._needs_full_update = False
+        else:
+            pygame.display.update(self._previous + self._current)
+        self._previous = self._current
+
+
+# Viewport onto a world that can be bigger than the screen
+class Camera:
+    """
+    `rect` is the part of the world on screen, in world coordinates. It
+    follows a target and is clamped to the world edges, so a world the
+    size of the screen never scrolls.
+    """
+
+    def __init__(self, view_size, world_size):
+        self.rect = pygame.Rect((0, 0), view_size)
+        self.world_size = world_size
+
+    def follow(self, target):
+        """
+        Center on `target` (a rect). Returns True if the view moved.
+        """
+        world_width, world_height = self.world_size
+        x = max(0, min(target.centerx - self.rect.width // 2, world_width - self.rect.width))
+        y = max(0, min(target.centery - self.rect.height // 2, world_height - self.rect.height))
+        if (x, y) == self.rect.topleft:
+            return False
+        self.rect.topleft = (x, y)
+        return True
+
+    def to_screen(self, rect):
+        """
+        Screen position of the top-left corner of a world rect.
+        """
+        return rect[0] - self.rect.x, rect[1] - self.rect.y
@@ -0,0 +1,237 @@
+import argparse
+import gzip
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+from npc_cache import context_hash, normalize_question
+from npc_context_store import answer_missing
+from npc_question_set import load_readme_questions, readme_npc_contexts
+from world_knowledge import WorldKnowledge
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUNDLE_PATH = os.path.join(REPO_DIR, "answer_bundle.json.gz")
+
+# Questions about the town as a whole, asked of every lore that describes buildings; the neighbor
+# table (KnowledgeQA) only answers questions about one building and the building count
+TOWN_QUESTIONS = [
+    "What is this town like?",
+    "Why is this town strange?",
+    "What is special about this town?",
+    "How are the buildings arranged?",
+    "What buildings are there?",
+    "Tell me about this town.",
+]
+# Question templates asked about every name (capitalized words) in a context
+NAME_TEMPLATES = ["What is {name}?", "Where is {name}?"]
+NAME_PATTERN = re.compile(r"\b[A-Z][a-z]+(?: (?:of )?[A-Z][a-z]+)*")
+# Capitalized words that start sentences rather than name things
+NOT_NAMES = {"The", "This", "Its", "It", "Each", "From", "At", "In", "Yet", "Beyond", "Surrounding", "Context",
+             "Lanterns", "Now", "There"}
+
+
+# Precomputed answers keyed by context hash and normalized question
+class AnswerBundle:
+    """
+    Answers computed offline for the questions players are expected to
+    ask, stored as gzipped JSON:
+    {"model", "created", "contexts": {context hash: {"npcs": [...],
+    "answers": {normalized question: [answer, score]}}}}.
+    Keying on the context hash means a bundle built for other lore
+    (a different town layout) simply never matches.
+    """
+
+    def __init__(self, model=None):
+        self.model = model
+        self.created = time.time()
+        self.contexts = {}
+
+    def __len__(self):
+        return sum(len(entry["answers"]) for entry in self.contexts.values())
+
+    def add(self, npc_name, context, question, answer, score):
+        entry = self.contexts.setdefault(context_hash(context), {"npcs": [], "answers": {}})
+        if npc_name not in entry["npcs"]:
+            entry["npcs"].append(npc_name)
+        entry["answers"][normalize_question(question)] = [answer, score]
+
+    def get(self, context, question):
+        entry = self.contexts.get(context_hash(context))
+        if entry is None:
+            return None
+        found = entry["answers"].get(normalize_question(question))
+        if found is None:
+            return None
+        return {"answer": found[0], "score": found[1], "start": None, "end": None}
+
+    def save(self, path=DEFAULT_BUNDLE_PATH):
+        data = {"model": self.model, "created": self.created, "contexts": self.contexts}
+        with gzip.open(path, "wt", encoding="utf-8") as file:
+            json.dump(data, file, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path=DEFAULT_BUNDLE_PATH):
+        with gzip.open(path, "rt", encoding="utf-8") as file:
+            data = json.load(file)
+        bundle = cls(data.get("model"))
+        bundle.created = data.get("created", bundle.created)
+        bundle.contexts = data["contexts"]
+        return bundle
+
+
+# Function to load the answer bundle if one has been built, or None
+def load_answer_bundle(path=DEFAULT_BUNDLE_PATH):
+    if not os.path.exists(path):
+        return None
+    return AnswerBundle.load(path)
+
+
+# Question answering reader that answers from a precomputed bundle before asking the model
+class BundleQA:
+    """
+    Wraps a QA reader (`reader(question=..., context=...)`). Questions
+    found in the bundle are answered without touching the reader, so they
+    come back instantly even while the model is still loading; the rest
+    go to the reader, batched together when a list is passed.
+    """
+
+    def __init__(self, reader, bundle):
+        self.reader = reader
+        self.bundle = bundle
+        self.answered = 0
+        self.passed_on = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, question, context, **kwargs):
+        if not isinstance(question, list):
+            result = self.bundle.get(context, question)
+            with self._lock:
+                if result is not None:
+                    self.answered += 1
+                    return result
+                self.passed_on += 1
+            return self.reader(question=question, context=context, **kwargs)
+
+        results = [self.bundle.get(c, q) for q, c in zip(question, context)]
+        missing = [index for index, result in enumerate(results) if result is None]
+        with self._lock:
+            self.answered += len(results) - len(missing)
+            self.passed_on += len(missing)
+        return answer_missing(self.reader, question, context, missing, results, **kwargs)
+
+
+# Function to template questions from a context: questions about the town if it describes buildings, and
+# questions about its other names; questions about single buildings are left to KnowledgeQA
+def templated_questions(context):
+    buildings = WorldKnowledge.from_lore(context).relations
+    questions = list(TOWN_QUESTIONS) if buildings else []
+    names = []
+    for match in NAME_PATTERN.finditer(context):
+        name = match.group(0)
+        if name.split()[0] in NOT_NAMES:
+            name = " ".join(name.split()[1:])
+        if name and name not in names and name not in buildings and name not in NOT_NAMES:
+            names.append(name)
+    for name in names:
+        questions += [template.format(name=name) for template in NAME_TEMPLATES]
+    return questions
+
+
+# Function to collect (npc name, question, context) for every NPC: its README questions plus the templated ones
+def build_question_set(npc_contexts, readme_path=None):
+    readme = load_readme_questions(readme_path)
+    items = []
+    for npc_name, context in npc_contexts.items():
+        questions = [question for name, question in readme if name == npc_name]
+        for question in templated_questions(context):
+            if question not in questions:
+                questions.append(question)
+        items += [(npc_name, question, context) for question in questions]
+    return items
+
+
+_reader = None
+_contexts = None
+
+
+# Function run once in every pool process to load its own copy of the reader stack
+def _init_process(backend, model, contexts):
+    global _reader, _contexts
+    # Each process gets one core; the pool provides the parallelism
+    import torch
+    torch.set_num_threads(1)
+
+    from npc_server import load_server_reader
+    _reader = load_server_reader(backend, model)
+    _contexts = contexts
+
+
+# Questions travel to the pool processes with the index of their context, not the (possibly long) context itself
+def _answer(item):
+    index, question = item
+    result = _reader(question=question, context=_contexts[index])
+    return index, question, result["answer"], result.get("score")
+
+
+# Function to answer the question set on all CPU cores and gather the answers into a bundle
+def build_bundle(items, backend=None, model=None, processes=None):
+    processes = processes or os.cpu_count() or 1
+    bundle = AnswerBundle(model or os.environ.get("NPC_QA_MODEL") or backend or os.environ.get("NPC_QA_BACKEND", "pipeline"))
+    contexts = []
+    npc_names = []
+    indexes = {}  # context -> position in contexts
+    tasks = []
+    for npc_name, question, context in items:
+        if context not in indexes:
+            indexes[context] = len(contexts)
+            contexts.append(context)
+            npc_names.append([])
+        index = indexes[context]
+        if npc_name not in npc_names[index]:
+            npc_names[index].append(npc_name)
+        tasks.append((index, question))
+    # Questions about the same context stay together so each process encodes a context only once
+    tasks.sort(key=lambda task: task[0])
+
+    with multiprocessing.get_context("spawn").Pool(processes, initializer=_init_process,
+                                                   initargs=(backend, model, contexts)) as pool:
+        chunksize = max(1, len(tasks) // (processes * 4))
+        for index, question, answer, score in pool.imap_unordered(_answer, tasks, chunksize):
+            for npc_name in npc_names[index]:
+                bundle.add(npc_name, contexts[index], question, answer, score)
+    return bundle
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute NPC answers offline into a bundle the games load at startup.")
+    parser.add_argument("--lore", nargs="*", default=None,
+                        help="Town lore files answered for the NPC named \"NPC\" "
+                             "(default: town_lore.txt of every game version)")
+    parser.add_argument("--backend", default=None, help="pipeline, quantized, onnx or cascade (default NPC_QA_BACKEND)")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: one per CPU core)")
+    parser.add_argument("--output", default=DEFAULT_BUNDLE_PATH)
+    args = parser.parse_args(argv)
+
+    lore_paths = args.lore
+    if lore_paths is None:
+        lore_paths = [os.path.join(REPO_DIR, f"Joc ALJV {version}", "town_lore.txt") for version in ("2.0", "3.0", "4.0")]
+    items = build_question_set(readme_npc_contexts)
+    for path in lore_paths:
+        if os.path.exists(path):
+            with open(path) as file:
+                items += build_question_set({"NPC": file.read()})
+
+    started = time.perf_counter()
+    bundle = build_bundle(items, args.backend, args.model, args.processes)
+    elapsed = time.perf_counter() - started
+    bundle.save(args.output)
+    print(f"{len(bundle)} answers for {len(bundle.contexts)} contexts in {elapsed:.1f} s "
+          f"({len(items) / elapsed:.1f} questions/s), written to {args.output} ({os.path.getsize(args.output)} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import threading
+import time
+from collections import Counter
+
+from npc_context_store import ContextStore, answer_missing
+from npc_inference import load_qa_pipeline
+from npc_question_set import readme_question_set
+from tracing import tracer
+
+# Model behind the default pipeline("question-answering")
+DEFAULT_MODEL = "distilbert/distilbert-base-cased-distilled-squad"
+
+# Larger reader the cascade falls back to (NPC_QA_LARGE_MODEL), and the score below which it is asked
+# (NPC_QA_CASCADE_THRESHOLD)
+DEFAULT_LARGE_MODEL = "deepset/roberta-base-squad2"
+DEFAULT_CASCADE_THRESHOLD = 0.3
+
+BACKENDS = ("pipeline", "quantized", "onnx", "cascade")
+
+
+# Function to load the question answering backend picked for this deployment
+def load_qa_backend(name=None, model=None):
+    """
+    Build a pipeline-compatible QA reader. The backend comes from `name`
+    or the NPC_QA_BACKEND environment variable:
+
+    - "pipeline": the default float32 transformers pipeline
+    - "quantized": the same model with int8 dynamic quantization (PyTorch)
+    - "onnx": the same model exported to ONNX Runtime (needs optimum)
+    - "cascade": the quantized model first, and the larger model from
+      NPC_QA_LARGE_MODEL only when its score is low (see CascadeQA)
+    """
+    name = name or os.environ.get("NPC_QA_BACKEND", "pipeline")
+    model = model or os.environ.get("NPC_QA_MODEL")
+    if name == "pipeline":
+        return load_qa_pipeline(model)
+    if name == "quantized":
+        return load_quantized_pipeline(model)
+    if name == "onnx":
+        return load_onnx_pipeline(model)
+    if name == "cascade":
+        return load_cascade_reader(model)
+    raise ValueError(f"Unknown QA backend {name!r}, expected one of {', '.join(BACKENDS)}")
+
+
+# Function to quantize the linear layers of the QA model to int8
+def load_quantized_pipeline(model=None):
+    import torch
+    from transformers import pipeline
+
+    qa_pipeline = pipeline("question-answering", model=model or DEFAULT_MODEL, framework="pt")
+    qa_pipeline.model = torch.ao.quantization.quantize_dynamic(qa_pipeline.model, {torch.nn.Linear}, dtype=torch.qint8)
+    return qa_pipeline
+
+
+# Function to run the QA model through ONNX Runtime, exporting it on first use
+def load_onnx_pipeline(model=None, export_dir="onnx_qa_model"):
+    try:
+        from optimum.onnxruntime import ORTModelForQuestionAnswering
+    except ImportError as error:
+        raise ImportError("The onnx backend needs optimum: pip install optimum[onnxruntime]") from error
+    from transformers import AutoTokenizer, pipeline
+
+    if os.path.isdir(export_dir):
+        ort_model = ORTModelForQuestionAnswering.from_pretrained(export_dir)
+        tokenizer = AutoTokenizer.from_pretrained(export_dir)
+    else:
+        ort_model = ORTModelForQuestionAnswering.from_pretrained(model or DEFAULT_MODEL, export=True)
+        tokenizer = AutoTokenizer.from_pretrained(model or DEFAULT_MODEL)
+        ort_model.save_pretrained(export_dir)
+        tokenizer.save_pretrained(export_dir)
+    return pipeline("question-answering", model=ort_model, tokenizer=tokenizer)
+
+
+# Function to build the small-then-large reader cascade
+def load_cascade_reader(model=None, large_model=None, threshold=None):
+    large_model = large_model or os.environ.get("NPC_QA_LARGE_MODEL") or DEFAULT_LARGE_MODEL
+    if threshold is None:
+        threshold = float(os.environ.get("NPC_QA_CASCADE_THRESHOLD", DEFAULT_CASCADE_THRESHOLD))
+    # Each model has its own tokenizer, so each gets its own context store
+    small = ContextStore(load_quantized_pipeline(model))
+    large = ContextStore(load_qa_pipeline(large_model))
+    return CascadeQA(small, large, threshold)
+
+
+# Question answering reader that only asks the large model when the small one is unsure
+class CascadeQA:
+    """
+    Every question is answered by the `small` reader first. Answers with
+    a score below `threshold` are asked again of the `large` reader, and
+    its answer is returned instead. Lists of questions are escalated
+    together in one call to the large reader.
+
+    `stats()` reports how many questions were escalated and the mean
+    latency per question, split into the time spent in each reader.
+    """
+
+    def __init__(self, small, large, threshold=DEFAULT_CASCADE_THRESHOLD):
+        self.small = small
+        self.large = large
+        self.threshold = threshold
+        self.questions = 0
+        self.escalated = 0
+        self.small_seconds = 0.0
+        self.large_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add_context(self, context):
+        for reader in (self.small, self.large):
+            if hasattr(reader, "add_context"):
+                reader.add_context(context)
+
+    def __call__(self, question, context, **kwargs):
+        single = not isinstance(question, list)
+        questions = [question] if single else question
+        contexts = [context] if single else context
+
+        started = time.perf_counter()
+        with tracer.span("cascade small", questions=len(questions)):
+            results = self.small(question=questions, context=contexts, **kwargs)
+        if isinstance(results, dict):
+            results = [results]
+        small_done = time.perf_counter()
+
+        unsure = [index for index, result in enumerate(results) if (result.get("score") or 0.0) < self.threshold]
+        if unsure:
+            with tracer.span("cascade large", questions=len(unsure)):
+                answer_missing(self.large, questions, contexts, unsure, results, **kwargs)
+        finished = time.perf_counter()
+
+        with self._lock:
+            self.questions += len(questions)
+            self.escalated += len(unsure)
+            self.small_seconds += small_done - started
+            self.large_seconds += finished - small_done
+        return results[0] if single else results
+
+    def stats(self):
+        with self._lock:
+            questions = self.questions or 1
+            return {
+                "questions": self.questions,
+                "escalated": self.escalated,
+                "escalation_rate": round(self.escalated / questions, 3),
+                "threshold": self.threshold,
+                "mean_latency_ms": round(1000 * (self.small_seconds + self.large_seconds) / questions, 2),
+                "mean_small_ms": round(1000 * self.small_seconds / questions, 2),
+                "mean_large_ms": round(1000 * self.large_seconds / questions, 2),
+            }
+
+
+# Function to score how close an answer is to the reference answer (SQuAD-style token F1)
+def answer_f1(answer, reference):
+    answer_tokens = re.findall(r"\w+", answer.lower())
+    reference_tokens = re.findall(r"\w+", reference.lower())
+    common = sum((Counter(answer_tokens) & Counter(reference_tokens)).values())
+    if not answer_tokens or not reference_tokens or not common:
+        return float(answer_tokens == reference_tokens)
+    precision = common / len(answer_tokens)
+    recall = common / len(reference_tokens)
+    return 2 * precision * recall / (precision + recall)
+
+
+# Function to compare backends on the README questions
+def compare_backends(backends=BACKENDS, model=None, repeat=5):
+    """
+    Time every backend on the README question set and measure how often
+    it agrees with the first backend (the float32 reference).
+    """
+    questions = readme_question_set()
+    results = []
+    reference = None
+    for name in backends:
+        started = time.perf_counter()
+        qa_pipeline = load_qa_backend(name, model)
+        load_seconds = time.perf_counter() - started
+
+        answers = [qa_pipeline(question=question, context=context)["answer"] for _, question, context in questions]
+        latencies = []
+        for _ in range(repeat):
+            for _, question, context in questions:
+                started = time.perf_counter()
+                qa_pipeline(question=question, context=context)
+                latencies.append(1000 * (time.perf_counter() - started))
+
+        if reference is None:
+            reference = answers
+        results.append({
+            "backend": name,
+            "load_seconds": round(load_seconds, 2),
+            "mean_latency_ms": round(statistics.mean(latencies), 2),
+            "p95_latency_ms": round(statistics.quantiles(latencies, n=20)[-1], 2),
+            "exact_match": round(sum(a == r for a, r in zip(answers, reference)) / len(answers), 3),
+            "f1": round(statistics.mean(answer_f1(a, r) for a, r in zip(answers, reference)), 3),
+            "answers": answers,
+        })
+    return results
+
+
+# Function to measure the cascade at several thresholds on the README questions
+def evaluate_cascade(thresholds, model=None, large_model=None, repeat=5):
+    """
+    Load the small and large readers once, then for each threshold
+    replay the README questions through a CascadeQA and report its
+    escalation rate, mean latency and agreement with the large model
+    alone (the reference). Thresholds 0 and 1 are the small and the large
+    model on their own.
+    """
+    cascade = load_cascade_reader(model, large_model)
+    pairs = [(question, context) for _, question, context in readme_question_set()]
+    reference = [cascade.large(question=question, context=context)["answer"] for question, context in pairs]
+
+    results = []
+    for threshold in thresholds:
+        reader = CascadeQA(cascade.small, cascade.large, threshold)
+        answers = [reader(question=question, context=context)["answer"] for question, context in pairs]
+        for _ in range(repeat - 1):
+            for question, context in pairs:
+                reader(question=question, context=context)
+        row = reader.stats()
+        row["exact_match"] = round(sum(a == r for a, r in zip(answers, reference)) / len(answers), 3)
+        row["f1"] = round(statistics.mean(answer_f1(a, r) for a, r in zip(answers, reference)), 3)
+        row["answers"] = answers
+        results.append(row)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare NPC question answering backends on the README questions.")
+    parser.add_argument("--backends", nargs="+", default=[name for name in BACKENDS if name != "cascade"], choices=BACKENDS)
+    parser.add_argument("--model", default=None, help="Model name or path (default: %s)" % DEFAULT_MODEL)
+    parser.add_argument("--large-model", default=None, help="Cascade fallback model (default: %s)" % DEFAULT_LARGE_MODEL)
+    parser.add_argument("--cascade-thresholds", nargs="+", type=float, default=None,
+                        help="Evaluate the cascade at these score thresholds instead of comparing backends")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default=None, help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.cascade_thresholds:
+        results = evaluate_cascade(args.cascade_thresholds, args.model, args.large_model, args.repeat)
+        print(f"{'threshold':>9} {'escalated':>10} {'mean ms':>8} {'small ms':>9} {'large ms':>9} {'EM':>6} {'F1':>6}")
+        for row in results:
+            print(f"{row['threshold']:>9} {100 * row['escalation_rate']:>9.1f}% {row['mean_latency_ms']:>8} "
+                  f"{row['mean_small_ms']:>9} {row['mean_large_ms']:>9} {row['exact_match']:>6} {row['f1']:>6}")
+    else:
+        results = compare_backends(args.backends, args.model, args.repeat)
+        print(f"{'backend':<10} {'load s':>7} {'mean ms':>8} {'p95 ms':>8} {'EM':>6} {'F1':>6}")
+        for row in results:
+            print(f"{row['backend']:<10} {row['load_seconds']:>7} {row['mean_latency_ms']:>8} {row['p95_latency_ms']:>8} "
+                  f"{row['exact_match']:>6} {row['f1']:>6}")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+from npc_backends import BACKENDS, load_qa_backend
+from npc_context_store import ContextStore
+from npc_question_set import readme_question_set
+from npc_retrieval import RetrievalQA
+from stats_utils import percentile
+from world_knowledge import KnowledgeQA
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Building names used to generate spatial questions and synthetic lore
+BUILDING_NAMES = ["Pyramid", "Palace", "Stadium", "Japanese Palace", "Tower", "Hospital", "Train Station", "Hotel"]
+DIRECTIONS = ["to the left of", "to the right of", "above", "below"]
+
+
+# Function to read the peak resident set size of this process in MB
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# Function to build spatial questions about every building mentioned in a lore text
+def lore_questions(lore):
+    names = [name for name in BUILDING_NAMES if f"The {name} " in lore]
+    questions = []
+    for name in names:
+        questions.append(f"Where is the {name}?")
+        questions.append(f"What is to the left of the {name}?")
+        questions.append(f"What is above the {name}?")
+    return questions
+
+
+# Function to generate a large town lore with numbered buildings
+def synthetic_lore(sentences, seed=0):
+    rng = random.Random(seed)
+    lines = ["This town is so large that nobody has counted its buildings."]
+    for index in range(sentences):
+        name = f"{rng.choice(BUILDING_NAMES)} {index}"
+        other = f"{rng.choice(BUILDING_NAMES)} {rng.randrange(sentences)}"
+        lines.append(f"The {name} is located {rng.choice(DIRECTIONS)} the {other}.")
+    return "\n".join(lines)
+
+
+# Function to collect the (name, [(question, context)]) suites to replay
+def build_suites(versions, synthetic_sizes):
+    suites = [("readme", [(question, context) for _, question, context in readme_question_set()])]
+
+    for version in versions:
+        path = os.path.join(REPO_DIR, f"Joc ALJV {version}", "town_lore.txt")
+        if not os.path.exists(path):
+            print(f"Skipping version {version}: no town_lore.txt")
+            continue
+        with open(path) as file:
+            lore = file.read()
+        suites.append((f"lore-{version}", [(question, lore) for question in lore_questions(lore)]))
+
+    for size in synthetic_sizes:
+        lore = synthetic_lore(size)
+        rng = random.Random(size)
+        questions = [f"Where is the {rng.choice(BUILDING_NAMES)} {rng.randrange(size)}?" for _ in range(12)]
+        suites.append((f"synthetic-{size}", [(question, lore) for question in questions]))
+    return suites
+
+
+# Function to replay one suite and summarize its latencies
+def run_suite(reader, name, pairs, repeat, warmup=1):
+    for question, context in pairs[:warmup]:
+        reader(question=question, context=context)
+
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for question, context in pairs:
+            asked = time.perf_counter()
+            reader(question=question, context=context)
+            latencies.append(1000 * (time.perf_counter() - asked))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "suite": name,
+        "questions": len(latencies),
+        "context_chars": max(len(context) for _, context in pairs),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(sum(latencies) / len(latencies), 2),
+        "questions_per_second": round(len(latencies) / elapsed, 2),
+    }
+
+
+# Function to wrap the backend the same way the game does
+def build_reader(qa_pipeline, reader_kind):
+    if reader_kind == "pipeline":
+        return qa_pipeline
+    if reader_kind == "context-store":
+        return ContextStore(qa_pipeline)
+    if reader_kind == "knowledge":
+        return KnowledgeQA(RetrievalQA(ContextStore(qa_pipeline)))
+    return RetrievalQA(ContextStore(qa_pipeline))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark NPC question answering latency and throughput.")
+    parser.add_argument("--backend", default=os.environ.get("NPC_QA_BACKEND", "pipeline"), choices=BACKENDS)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--reader", default="knowledge", choices=["pipeline", "context-store", "retrieval", "knowledge"],
+                        help="QA path to measure (knowledge is what the game uses: neighbor table, then retrieval)")
+    parser.add_argument("--versions", nargs="*", default=["2.0", "3.0", "4.0"],
+                        help="Game versions whose town_lore.txt is replayed")
+    parser.add_argument("--synthetic", nargs="*", type=int, default=[1000, 10000],
+                        help="Sizes (in sentences) of generated lore")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default="bench_output.json")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    qa_pipeline = load_qa_backend(args.backend, args.model)
+    model_load_seconds = time.perf_counter() - started
+    reader = build_reader(qa_pipeline, args.reader)
+
+    results = {
+        "backend": args.backend,
+        "model": args.model or getattr(getattr(qa_pipeline, "model", None), "name_or_path", None),
+        "reader": args.reader,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "model_load_seconds": round(model_load_seconds, 2),
+        "suites": [],
+    }
+    for name, pairs in build_suites(args.versions, args.synthetic):
+        if not pairs:
+            continue
+        suite = run_suite(reader, name, pairs, args.repeat)
+        results["suites"].append(suite)
+        print(f"{name:<18} {suite['questions']:>4} q  p50 {suite['p50_ms']:>8} ms  p95 {suite['p95_ms']:>8} ms  "
+              f"p99 {suite['p99_ms']:>8} ms  {suite['questions_per_second']:>7} q/s")
+    results["peak_rss_mb"] = peak_rss_mb()
+    print(f"Model load {results['model_load_seconds']} s, peak RSS {results['peak_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Results written to {args.output}")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+# Function to normalize a question so trivial rephrasings share a cache entry
+def normalize_question(question):
+    question = question.lower()
+    question = re.sub(r"[^\w\s]", " ", question)
+    return " ".join(question.split())
+
+
+# Function to fingerprint an NPC context
+def context_hash(context):
+    return hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+
+
+# Memoized answers keyed on (NPC, context, normalized question)
+class AnswerCache:
+    """
+    Bounded LRU cache of NPC answers with an optional time-to-live and
+    optional JSON persistence between sessions. Entries are keyed on the
+    context hash, so an answer computed against old lore never matches
+    a regenerated context.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=None, path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (answer, stored_at)
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def _key(self, npc_name, context, question):
+        return (npc_name, context_hash(context), normalize_question(question))
+
+    def _expired(self, stored_at):
+        return self.ttl_seconds is not None and time.time() - stored_at > self.ttl_seconds
+
+    def get(self, npc_name, context, question):
+        key = self._key(npc_name, context, question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def get_similar(self, npc_name, context, question):
+        """
+        Answer a rephrased question from the cache. Exact matching has no
+        notion of similar questions; see npc_semantic_cache.
+        """
+        return None
+
+    def put(self, npc_name, context, question, answer):
+        key = self._key(npc_name, context, question)
+        with self._lock:
+            self._entries[key] = (answer, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, npc_name, context=None):
+        """
+        Drop the NPC's answers that were computed for any other context
+        (or all of them when no context is given).
+        """
+        keep = context_hash(context) if context is not None else None
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == npc_name and key[1] != keep]
+            for key in stale:
+                del self._entries[key]
+        return len(stale)
+
+    def carry_over(self, npc_name, old_context, new_context, changed_terms=(), anchor_terms=None):
+        """
+        Move the NPC's answers (every NPC's when `npc_name` is None) from
+        an old context to an edited one, except those whose question or
+        answer mentions any of `changed_terms` (e.g. the names of the
+        buildings whose lore changed). With `anchor_terms` (e.g. the names
+        of all the buildings), only answers tied to one of them are kept;
+        the rest are about the whole town ("How many buildings are
+        there?") and may be stale. Returns how many answers were kept.
+        """
+        old_hash, new_hash = context_hash(old_context), context_hash(new_context)
+        terms = [normalize_question(term) for term in changed_terms]
+        anchors = None if anchor_terms is None else [normalize_question(term) for term in anchor_terms]
+        kept = 0
+        with self._lock:
+            for key in [key for key in self._entries if npc_name in (None, key[0]) and key[1] == old_hash]:
+                answer, stored_at = self._entries.pop(key)
+                text = f" {key[2]} {normalize_question(answer)} "
+                if any(f" {term} " in text for term in terms):
+                    continue
+                if anchors is not None and not any(f" {term} " in text for term in anchors):
+                    continue
+                self._entries[(key[0], new_hash, key[2])] = (answer, stored_at)
+                kept += 1
+        return kept
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self._lock:
+            rows = [[*key, answer, stored_at] for key, (answer, stored_at) in self._entries.items()]
+        with open(path, "w") as file:
+            json.dump(rows, file)
+
+    def load(self, path=None):
+        path = path or self.path
+        with open(path) as file:
+            rows = json.load(file)
+        with self._lock:
+            for npc_name, ctx_hash, question, answer, stored_at in rows[-self.max_entries:]:
+                if not self._expired(stored_at):
+                    self._entries[(npc_name, ctx_hash, question)] = (answer, stored_at)
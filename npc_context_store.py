@@ -0,0 +1,219 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from tracing import tracer
+
+
+# Token ids and character offsets of one NPC context, split into model-sized windows
+class EncodedContext:
+    def __init__(self, context, input_ids, offsets, window, stride):
+        self.context = context
+        self.input_ids = input_ids
+        self.offsets = offsets
+        self.chunks = []  # (first token, last token + 1) of each window
+        step = max(1, window - stride)
+        for start in range(0, max(len(input_ids), 1), step):
+            end = min(start + window, len(input_ids))
+            self.chunks.append((start, end))
+            if end == len(input_ids):
+                break
+
+
+# Question answering reader that tokenizes every context only once
+class ContextStore:
+    """
+    Drop-in replacement for `qa_pipeline(question=..., context=...)`.
+    Each context is tokenized and chunked the first time it is seen (or
+    up front via `add_context()`), and the token ids and offset mappings
+    are kept in memory. A question then only tokenizes the question
+    itself before running the model on the cached windows.
+
+    Contexts can be registered before the model has loaded; they are
+    encoded as soon as `attach()` receives the pipeline. A backend that
+    is already a reader with its own context stores (npc_backends.CascadeQA)
+    is attached as is and answers every question itself.
+    """
+
+    def __init__(self, qa_pipeline=None, max_contexts=64, max_seq_len=384, doc_stride=128,
+                 max_question_len=64, max_answer_len=15):
+        self.max_contexts = max_contexts
+        self.max_seq_len = max_seq_len
+        self.doc_stride = doc_stride
+        self.max_question_len = max_question_len
+        self.max_answer_len = max_answer_len
+        self.tokenizer = None
+        self.model = None
+        self.framework = None
+        self.reader = None  # Backend that answers on its own, if it has no single tokenizer and model
+        self._waiting = []
+        self._encoded = OrderedDict()
+        self._lock = threading.Lock()
+        if qa_pipeline is not None:
+            self.attach(qa_pipeline)
+
+    def attach(self, qa_pipeline):
+        """
+        Take the tokenizer and model from a loaded transformers pipeline
+        and encode any contexts registered so far. Returns the store.
+        """
+        if hasattr(qa_pipeline, "tokenizer"):
+            self.tokenizer = qa_pipeline.tokenizer
+            self.model = qa_pipeline.model
+            self.framework = qa_pipeline.framework
+        else:
+            self.reader = qa_pipeline
+        with self._lock:
+            waiting, self._waiting = self._waiting, []
+        for context in waiting:
+            self.add_context(context)
+        return self
+
+    def add_context(self, context):
+        """
+        Tokenize and chunk a context now (e.g. right after the lore was
+        regenerated) so the first question about it is not slower.
+        """
+        if self.reader is not None:
+            return self.reader.add_context(context)
+        if self.tokenizer is None:
+            with self._lock:
+                self._waiting.append(context)
+            return None
+        return self._get_encoded(context)
+
+    def _get_encoded(self, context):
+        with self._lock:
+            encoded = self._encoded.get(context)
+            if encoded is not None:
+                self._encoded.move_to_end(context)
+                return encoded
+
+        with tracer.span("encode context", chars=len(context)):
+            tokens = self.tokenizer(context, add_special_tokens=False, return_offsets_mapping=True)
+            window = self.max_seq_len - self.max_question_len - self.tokenizer.num_special_tokens_to_add(pair=True)
+            encoded = EncodedContext(context, tokens["input_ids"], tokens["offset_mapping"], window, self.doc_stride)
+
+        with self._lock:
+            self._encoded[context] = encoded
+            while len(self._encoded) > self.max_contexts:
+                self._encoded.popitem(last=False)
+        return encoded
+
+    def __call__(self, question, context, **kwargs):
+        if self.reader is not None:
+            return self.reader(question=question, context=context, **kwargs)
+        if isinstance(question, list):
+            return self.answer_batch(question, context)
+        return self.answer(question, context)
+
+    def answer(self, question, context):
+        return self.answer_batch([question], [context])[0]
+
+    def answer_batch(self, questions, contexts):
+        """
+        Answer several questions in one forward pass: the windows of every
+        (question, context) pair go into the same batch, and the logits are
+        split back per question before the spans are decoded.
+        """
+        if not questions:
+            return []
+        encoded = [self._get_encoded(context) for context in contexts]
+        with tracer.span("tokenize", questions=len(questions)):
+            batch = {name: [] for name in self.tokenizer.model_input_names}
+            context_starts = []
+            for question, enc in zip(questions, encoded):
+                context_starts.append(self._add_rows(batch, question, enc))
+        with tracer.span("forward", windows=len(batch["input_ids"])):
+            start_logits, end_logits = self._forward(batch)
+
+        with tracer.span("decode span"):
+            results = []
+            row = 0
+            for enc, context_start in zip(encoded, context_starts):
+                rows = slice(row, row + len(enc.chunks))
+                results.append(self._best_span(enc, context_start, start_logits[rows], end_logits[rows]))
+                row = rows.stop
+        return results
+
+    def _add_rows(self, batch, question, encoded):
+        # One row per context window; returns where the context tokens start in each row
+        question_ids = self.tokenizer(question, add_special_tokens=False)["input_ids"][:self.max_question_len]
+
+        # Context tokens start right after "[CLS] question [SEP]" (or the model's equivalent)
+        context_start = len(self.tokenizer.build_inputs_with_special_tokens(question_ids, [])) - 1
+
+        for first, last in encoded.chunks:
+            chunk_ids = encoded.input_ids[first:last]
+            batch["input_ids"].append(self.tokenizer.build_inputs_with_special_tokens(question_ids, chunk_ids))
+            if "token_type_ids" in batch:
+                batch["token_type_ids"].append(self.tokenizer.create_token_type_ids_from_sequences(question_ids, chunk_ids))
+        return context_start
+
+    def _best_span(self, encoded, context_start, start_logits, end_logits):
+        best = {"score": 0.0, "start": 0, "end": 0, "answer": ""}
+        for row, (first, last) in enumerate(encoded.chunks):
+            length = last - first
+            if length == 0:
+                continue
+            start_probs = _softmax(start_logits[row, context_start:context_start + length])
+            end_probs = _softmax(end_logits[row, context_start:context_start + length])
+
+            # Best span with start <= end and at most max_answer_len tokens
+            scores = np.triu(np.outer(start_probs, end_probs))
+            scores = np.tril(scores, self.max_answer_len - 1)
+            span_start, span_end = np.unravel_index(np.argmax(scores), scores.shape)
+            score = float(scores[span_start, span_end])
+            if score > best["score"]:
+                char_start = encoded.offsets[first + span_start][0]
+                char_end = encoded.offsets[first + span_end][1]
+                best = {"score": score, "start": char_start, "end": char_end,
+                        "answer": encoded.context[char_start:char_end]}
+        return best
+
+    def _forward(self, batch):
+        pad_id = self.tokenizer.pad_token_id or 0
+        longest = max(len(ids) for ids in batch["input_ids"])
+        inputs = {}
+        for name, rows in batch.items():
+            if name == "attention_mask":
+                continue
+            pad = pad_id if name == "input_ids" else 0
+            inputs[name] = [row + [pad] * (longest - len(row)) for row in rows]
+        if "attention_mask" in batch:
+            inputs["attention_mask"] = [[1] * len(row) + [0] * (longest - len(row)) for row in batch["input_ids"]]
+
+        if self.framework == "pt":
+            import torch
+            with torch.no_grad():
+                outputs = self.model(**{name: torch.tensor(rows) for name, rows in inputs.items()})
+            return outputs.start_logits.cpu().numpy(), outputs.end_logits.cpu().numpy()
+
+        import tensorflow as tf
+        outputs = self.model({name: tf.constant(rows) for name, rows in inputs.items()})
+        return outputs.start_logits.numpy(), outputs.end_logits.numpy()
+
+
+# Function to answer the rows of a question list at `indexes` with a reader and fill them into `results`
+def answer_missing(reader, questions, contexts, indexes, results, **kwargs):
+    """
+    Shared by the readers that answer part of a list themselves and pass
+    the rest on (KnowledgeQA, BundleQA, CascadeQA): the remaining rows go
+    to `reader` in one call, with `batch_size` shrunk to match.
+    """
+    if not indexes:
+        return results
+    if "batch_size" in kwargs:
+        kwargs["batch_size"] = len(indexes)
+    answers = reader(question=[questions[i] for i in indexes], context=[contexts[i] for i in indexes], **kwargs)
+    if isinstance(answers, dict):
+        answers = [answers]
+    for index, answer in zip(indexes, answers):
+        results[index] = answer
+    return results
+
+
+def _softmax(logits):
+    exp = np.exp(logits - np.max(logits))
+    return exp / exp.sum()
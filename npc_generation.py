@@ -0,0 +1,155 @@
+import argparse
+import os
+import threading
+import time
+
+from npc_inference import InferenceWorker, LazyQAPipeline
+from npc_question_set import readme_question_set
+from stats_utils import percentile
+from tracing import tracer
+
+# Small instruction-tuned model for generated NPC dialogue; NPC_CHAT_MODEL overrides it
+DEFAULT_CHAT_MODEL = "HuggingFaceTB/SmolLM2-135M-Instruct"
+
+
+# Function to load the text generation model for NPC dialogue
+def load_chat_generator(model=None):
+    return StreamingGenerator(model or os.environ.get("NPC_CHAT_MODEL") or DEFAULT_CHAT_MODEL)
+
+
+# Small local text generation model whose output is read token by token
+class StreamingGenerator:
+    """
+    `stream(npc_name, question, context)` yields pieces of the reply as
+    the model produces them. Generation runs on a helper thread feeding a
+    TextIteratorStreamer, and stops early once `should_stop()` is true.
+    """
+
+    def __init__(self, model=DEFAULT_CHAT_MODEL, max_new_tokens=60, max_context_chars=1500):
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.model = AutoModelForCausalLM.from_pretrained(model)
+        self.model.eval()
+        self.max_new_tokens = max_new_tokens
+        self.max_context_chars = max_context_chars
+
+    def build_prompt(self, npc_name, question, context):
+        facts = context[:self.max_context_chars]
+        instructions = (f"You are {npc_name}, a character in a small town. Answer the player in one or two "
+                        f"short sentences, using only these facts:\n{facts}")
+        if getattr(self.tokenizer, "chat_template", None):
+            messages = [{"role": "system", "content": instructions}, {"role": "user", "content": question}]
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return f"{instructions}\n\nPlayer: {question}\n{npc_name}:"
+
+    def stream(self, npc_name, question, context, should_stop=None):
+        from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+        class StopWhen(StoppingCriteria):
+            def __call__(self, input_ids, scores, **kwargs):
+                return bool(should_stop and should_stop())
+
+        # A chat template already adds the model's special tokens
+        chat = bool(getattr(self.tokenizer, "chat_template", None))
+        inputs = self.tokenizer(self.build_prompt(npc_name, question, context), return_tensors="pt",
+                                add_special_tokens=not chat)
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        pad_token_id = self.tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.tokenizer.eos_token_id
+        failure = []
+
+        def generate():
+            try:
+                self.model.generate(
+                    **inputs,
+                    streamer=streamer,
+                    max_new_tokens=self.max_new_tokens,
+                    do_sample=False,
+                    stopping_criteria=StoppingCriteriaList([StopWhen()]),
+                    pad_token_id=pad_token_id,
+                )
+            except Exception as error:
+                failure.append(error)
+                streamer.end()
+
+        thread = threading.Thread(target=generate, name="npc-generate", daemon=True)
+        thread.start()
+        for piece in streamer:
+            if piece:
+                yield piece
+        thread.join()
+        if failure:
+            raise failure[0]
+
+
+# Inference worker that streams generated replies into the PendingAnswer as they are produced
+class StreamingWorker(InferenceWorker):
+    """
+    Same interface as InferenceWorker, but the model is a
+    StreamingGenerator (or a LazyQAPipeline loading one) and every
+    question is answered on its own: `pending.partial` grows token by
+    token so the game can show the reply while it is still being
+    written. Cancelling a question stops its generation.
+
+    `prepare_context(question, context)` can shrink the context first,
+    e.g. RetrievalQA.retrieve to keep only the relevant lore passages.
+    """
+
+    def __init__(self, generator, cache=None, prepare_context=None):
+        super().__init__(generator, max_batch_size=1, cache=cache)
+        self.prepare_context = prepare_context
+        self.first_token_seconds = 0.0
+
+    def _answer_batch(self, batch):
+        generator = self.qa_pipeline.get() if isinstance(self.qa_pipeline, LazyQAPipeline) else self.qa_pipeline
+        results = []
+        for pending in batch:
+            context = pending.context
+            if self.prepare_context is not None:
+                context = self.prepare_context(pending.question, context)
+            started = time.perf_counter()
+            with tracer.span("generate"):
+                for piece in generator.stream(pending.npc_name, pending.question, context,
+                                              should_stop=lambda: pending.cancelled):
+                    pending._append(piece)
+            if pending.first_token_at is not None:
+                self.first_token_seconds += pending.first_token_at - started
+            results.append({"answer": pending.partial.strip(), "score": None})
+        return results
+
+    def mean_first_token_ms(self):
+        return round(1000 * self.first_token_seconds / self.stats.questions, 2) if self.stats.questions else 0.0
+
+
+# Function to compare time to first token with full reply time on the README questions
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure streamed NPC reply latency.")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--max-new-tokens", type=int, default=60)
+    args = parser.parse_args(argv)
+
+    generator = StreamingGenerator(args.model or os.environ.get("NPC_CHAT_MODEL") or DEFAULT_CHAT_MODEL,
+                                   max_new_tokens=args.max_new_tokens)
+    first_token_ms = []
+    total_ms = []
+    for npc_name, question, context in readme_question_set():
+        started = time.perf_counter()
+        first = None
+        reply = ""
+        for piece in generator.stream(npc_name, question, context):
+            if first is None:
+                first = time.perf_counter()
+            reply += piece
+        finished = time.perf_counter()
+        first_token_ms.append(1000 * ((first or finished) - started))
+        total_ms.append(1000 * (finished - started))
+        print(f"{npc_name}: {question}\n  -> {reply.strip()}")
+
+    print(f"time to first token p50 {percentile(first_token_ms, 50):.1f} ms, "
+          f"full reply p50 {percentile(total_ms, 50):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
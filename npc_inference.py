@@ -0,0 +1,346 @@
+import importlib
+import itertools
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import tracer
+
+
+# Function to build the default transformers question answering pipeline
+def load_qa_pipeline(model=None):
+    from transformers import pipeline
+    if model:
+        return pipeline("question-answering", model=model)
+    return pipeline("question-answering")
+
+
+# Named startup phase durations (import, model load, asset load, ...)
+class StartupReport:
+    def __init__(self):
+        self.phases = {}
+        self.printed = False
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def measure(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def summary(self):
+        with self._lock:
+            return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.phases.items())
+
+    def print_once(self, error=None):
+        """
+        Print the phase times once; with `error` (the model failed to load)
+        the failure is reported in place of a model load time.
+        """
+        if not self.printed:
+            self.printed = True
+            if error is not None:
+                print(f"Startup: {self.summary()}; NPC model failed to load: {error}")
+            else:
+                print(f"Startup: {self.summary()}")
+
+
+# Question answering pipeline that is built on a background thread
+class LazyQAPipeline:
+    """
+    Stand-in for the transformers pipeline that loads it in the background.
+    Calls behave like `qa_pipeline(question=..., context=...)` and only
+    block if the model is not ready yet. Import and model load times are
+    recorded in `report`.
+    """
+
+    def __init__(self, loader=load_qa_pipeline, report=None, preload_modules=("transformers",)):
+        self.loader = loader
+        self.report = report or StartupReport()
+        self.preload_modules = preload_modules
+        self.error = None
+        self._pipeline = None
+        self._loaded = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._load, name="npc-model-loader", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def ready(self):
+        """
+        True once loading has finished, whether or not it succeeded.
+        """
+        return self._loaded.is_set()
+
+    @property
+    def failed(self):
+        return self._loaded.is_set() and self.error is not None
+
+    def _load(self):
+        try:
+            with self.report.measure("import"):
+                for module in self.preload_modules:
+                    importlib.import_module(module)
+            # Only a model that actually loaded gets a load time in the report
+            started = time.perf_counter()
+            self._pipeline = self.loader()
+            self.report.record("model load", time.perf_counter() - started)
+        except Exception as error:
+            self.error = error
+        finally:
+            self._loaded.set()
+
+    def get(self):
+        """
+        Return the loaded pipeline, waiting for the loader if needed.
+        """
+        self.start()
+        self._loaded.wait()
+        if self.error is not None:
+            raise RuntimeError("Question answering model failed to load") from self.error
+        return self._pipeline
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+
+# Handle for a question that has been sent to the inference worker
+class PendingAnswer:
+    """
+    Result slot for one queued question. The game loop polls `done`
+    every frame and reads `answer` once it is set. Streaming workers
+    also fill in `partial` as the answer is generated.
+    """
+
+    def __init__(self, request_id, npc_name, question, context):
+        self.request_id = request_id
+        self.npc_name = npc_name
+        self.question = question
+        self.context = context
+        self.answer = None
+        self.score = None
+        self.error = None
+        self.cancelled = False
+        self.partial = ""
+        self.submitted_at = time.perf_counter()
+        self.first_token_at = None
+        self._done = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def cancel(self):
+        """
+        Drop the question. If the model is already running on it the
+        result is simply discarded.
+        """
+        self.cancelled = True
+        self._set_done()
+
+    def wait(self, timeout=None):
+        """
+        Block until the answer is ready (used outside the game loop).
+        """
+        self._done.wait(timeout)
+        return self.answer
+
+    def _append(self, text):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.partial += text
+
+    def _finish(self, answer=None, score=None, error=None):
+        if self.cancelled:
+            return
+        self.answer = answer
+        self.score = score
+        self.error = error
+        self._set_done()
+
+    def add_done_callback(self, callback):
+        """
+        Call `callback(pending)` once the answer is ready or the question
+        is cancelled (right away if that already happened). It runs on
+        whichever thread finishes the question.
+        """
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set_done(self):
+        with self._callbacks_lock:
+            if self._done.is_set():
+                return
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+
+# Throughput counters for the inference worker
+class InferenceStats:
+    def __init__(self):
+        self.questions = 0
+        self.batches = 0
+        self.cancelled = 0
+        self.inference_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self.started_at = time.perf_counter()
+
+    @property
+    def mean_batch_size(self):
+        return self.questions / self.batches if self.batches else 0.0
+
+    @property
+    def questions_per_second(self):
+        return self.questions / self.inference_seconds if self.inference_seconds else 0.0
+
+    def summary(self):
+        return {
+            "questions": self.questions,
+            "batches": self.batches,
+            "cancelled": self.cancelled,
+            "mean_batch_size": round(self.mean_batch_size, 2),
+            "questions_per_second": round(self.questions_per_second, 2),
+            "mean_queue_wait_ms": round(1000 * self.queue_wait_seconds / self.questions, 2) if self.questions else 0.0,
+            "uptime_seconds": round(time.perf_counter() - self.started_at, 2),
+        }
+
+
+# Background thread that runs the question answering model
+class InferenceWorker:
+    """
+    Runs `qa_pipeline(question=..., context=...)` on a dedicated thread so
+    the pygame loop never blocks on the model. Questions go in through
+    `submit()` and come back as `PendingAnswer` objects.
+
+    With `max_batch_size` > 1 the worker micro-batches: after the first
+    question arrives it keeps collecting more (from any NPC) for up to
+    `max_wait_ms`, then runs them through the pipeline as one padded batch.
+
+    An optional `cache` (see npc_cache.AnswerCache) answers repeated
+    questions straight from `submit()` without touching the model.
+    Rephrased questions are looked up with `cache.get_similar()` on the
+    worker thread, since that can mean running a sentence encoder.
+    """
+
+    def __init__(self, qa_pipeline, max_batch_size=1, max_wait_ms=0, cache=None):
+        self.qa_pipeline = qa_pipeline
+        self.cache = cache
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self.stats = InferenceStats()
+        self._requests = queue.Queue()
+        self._ids = itertools.count(1)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="npc-inference", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._requests.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, npc_name, question, context):
+        pending = PendingAnswer(next(self._ids), npc_name, question, context)
+        if self.cache is not None:
+            cached = self.cache.get(npc_name, context, question)
+            if cached is not None:
+                pending._finish(answer=cached)
+                return pending
+        self._requests.put(pending)
+        return pending
+
+    # Wait for the first question, then gather more until the batch is full or the latency budget runs out
+    def _collect_batch(self):
+        first = self._requests.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                pending = self._requests.get(timeout=timeout) if timeout > 0 else self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if pending is None:
+                self._requests.put(None)  # Stop after this batch
+                break
+            batch.append(pending)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch is None:
+                break
+
+            live = [pending for pending in batch if not pending.cancelled]
+            self.stats.cancelled += len(batch) - len(live)
+            if self.cache is not None:
+                live = [pending for pending in live if not self._answer_similar(pending)]
+            if not live:
+                continue
+
+            started = time.perf_counter()
+            try:
+                with tracer.span("inference batch", size=len(live)):
+                    results = self._answer_batch(live)
+            except Exception as error:  # Keep the worker alive for the next question
+                for pending in live:
+                    pending._finish(answer="Sorry, I can't answer that right now.", error=error)
+                continue
+            finished = time.perf_counter()
+
+            self.stats.batches += 1
+            self.stats.questions += len(live)
+            self.stats.inference_seconds += finished - started
+            for pending, result in zip(live, results):
+                self.stats.queue_wait_seconds += started - pending.submitted_at
+                if self.cache is not None and not pending.cancelled:
+                    self.cache.put(pending.npc_name, pending.context, pending.question, result["answer"])
+                pending._finish(answer=result["answer"], score=result.get("score"))
+
+    def _answer_similar(self, pending):
+        answer = self.cache.get_similar(pending.npc_name, pending.context, pending.question)
+        if answer is None:
+            return False
+        pending._finish(answer=answer)
+        return True
+
+    def _answer_batch(self, batch):
+        if len(batch) == 1:
+            pending = batch[0]
+            return [self.qa_pipeline(question=pending.question, context=pending.context)]
+
+        # The pipeline pads the whole list into batches of `batch_size` for a single forward pass
+        results = self.qa_pipeline(
+            question=[pending.question for pending in batch],
+            context=[pending.context for pending in batch],
+            batch_size=len(batch),
+        )
+        if isinstance(results, dict):
+            results = [results]
+        return results
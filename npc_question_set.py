@@ -0,0 +1,34 @@
+import os
+import re
+
+# The NPC paragraphs from the root game that the README questions are about
+readme_npc_contexts = {
+    "NPC1": "Context for NPC1. The village of Willowbrook is nestled within the embrace of the Enchanted Forest, its layout reflecting a harmonious blend of natural beauty and rustic charm. At its heart stands the Arboreal Oak, a towering sentinel that serves as the focal point, its sprawling branches sheltering a network of wooden platforms and cozy treehouses. Surrounding the oak, clusters of quaint cottages with thatched roofs intertwine along winding cobblestone paths, adorned with ivy and wildflowers. Lanterns fashioned from enchanted fireflies cast a soft glow upon the village, illuminating the bustling marketplace where villagers gather to trade goods and share tales. Beyond the central square, narrow alleys lead to hidden glades and secret groves, each corner revealing new wonders of the magical realm. In Willowbrook, the boundaries between civilization and nature blur, creating a haven where the spirit of the forest thrives alongside the warmth of community.",
+    "NPC2": "Context for NPC2. The Arboreal Oak, revered as the heart of Willowbrook, stands sentinel amidst the village, its massive trunk rising skyward like a titan of the forest. Its bark, weathered and adorned with intricate patterns, tells tales of centuries past, while its sprawling branches reach out in all directions, forming a vast canopy that shelters the village beneath. From its verdant embrace, wooden platforms and cozy treehouses emerge, woven into its very essence, offering sanctuary to the villagers who call it home. Each season paints the oak in a different hue, from the tender green of spring to the fiery reds and golds of autumn, and in winter, its branches cradle a mantle of snow, a testament to the enduring beauty and strength of this ancient guardian of the Enchanted Forest.",
+    "NPC3": "Context for NPC3. The kingdom of Sylvanara stretches across the verdant expanse of the Enchanted Forest, its borders defined by ancient trees and shimmering rivers. At its heart lies the capital city of Everwood, a majestic metropolis nestled amidst towering canopies and cascading waterfalls. Surrounding Everwood, a patchwork quilt of idyllic villages and bustling market towns dot the landscape, each one a testament to the kingdom's deep connection with nature and magic. From the mystical shores of Moonlight Bay to the enchanting valleys of the Whispering Woods, Sylvanara is a land of untold beauty and wonder, where mythical creatures roam freely and the whispers of the wind carry tales of old. Yet, amidst its ethereal splendor, the kingdom stands as a beacon of strength and unity, ruled by a wise and just monarch who ensures that harmony prevails in this realm where magic and reality intertwine.",
+}
+
+
+# Function to read the per-NPC question list from the README "Questions" section
+def load_readme_questions(path=None):
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), "README.md")
+    with open(path) as file:
+        text = file.read()
+    section = text.split("# Questions", 1)[1] if "# Questions" in text else ""
+
+    questions = []
+    npc_name = None
+    for line in section.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            break  # Next README section
+        if re.fullmatch(r"NPC\d+:", line):
+            npc_name = line[:-1]
+        elif line.startswith("- ") and npc_name:
+            questions.append((npc_name, line[2:].strip()))
+    return questions
+
+
+# Function to pair every README question with its NPC context
+def readme_question_set(path=None):
+    return [(npc_name, question, readme_npc_contexts[npc_name]) for npc_name, question in load_readme_questions(path)]
@@ -0,0 +1,107 @@
+import math
+
+
+# One NPC: where it stands, what it knows and what it has been asked
+class NPC:
+    def __init__(self, name, x, y, radius, context, sprite=None, color=None, shape="circle", max_history=20):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.radius = radius
+        self.context = context
+        self.sprite = sprite  # Image to draw, or None to draw `shape` in `color`
+        self.color = color
+        self.shape = shape
+        self.max_history = max_history
+        self.history = []  # (question, answer) pairs, oldest first
+
+    def remember(self, question, answer):
+        self.history.append((question, answer))
+        del self.history[:-self.max_history]
+
+
+# All NPCs in the world, bucketed in a spatial hash by position
+class NPCRegistry:
+    """
+    NPCs are looked up by name or by position. Positions are hashed into
+    square cells of `cell_size` pixels, so finding the NPC next to the
+    player or the NPCs on screen only looks at the cells around them,
+    however many NPCs there are. Questions go to one shared inference
+    worker, tagged with the NPC's name and asked against its context.
+    """
+
+    def __init__(self, cell_size=200):
+        self.cell_size = cell_size
+        self.npcs = {}  # name -> NPC
+        self.cells = {}  # (col, row) -> [NPC]
+
+    def __len__(self):
+        return len(self.npcs)
+
+    def __iter__(self):
+        return iter(self.npcs.values())
+
+    def get(self, name):
+        return self.npcs.get(name)
+
+    def _cell(self, x, y):
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add(self, npc):
+        if npc.name in self.npcs:
+            self.remove(npc.name)
+        self.npcs[npc.name] = npc
+        self.cells.setdefault(self._cell(npc.x, npc.y), []).append(npc)
+        return npc
+
+    def remove(self, name):
+        npc = self.npcs.pop(name, None)
+        if npc is not None:
+            cell = self._cell(npc.x, npc.y)
+            self.cells[cell].remove(npc)
+            if not self.cells[cell]:
+                del self.cells[cell]
+        return npc
+
+    def move(self, name, x, y):
+        npc = self.remove(name)
+        npc.x, npc.y = x, y
+        self.add(npc)
+
+    def in_rect(self, x, y, width, height):
+        """
+        NPCs whose position lies in the rect, e.g. the ones on screen.
+        """
+        col_start, row_start = self._cell(x, y)
+        col_end, row_end = self._cell(x + width, y + height)
+        found = []
+        for col in range(col_start, col_end + 1):
+            for row in range(row_start, row_end + 1):
+                for npc in self.cells.get((col, row), ()):
+                    if x <= npc.x < x + width and y <= npc.y < y + height:
+                        found.append(npc)
+        return found
+
+    def nearest(self, x, y, reach):
+        """
+        The closest NPC that is within `reach` + its own radius of (x, y), or None.
+        """
+        best = None
+        best_distance = None
+        # NPC radii are assumed to be smaller than a cell
+        span = int(math.ceil(reach / self.cell_size)) + 1
+        col, row = self._cell(x, y)
+        for other_col in range(col - span, col + span + 1):
+            for other_row in range(row - span, row + span + 1):
+                for npc in self.cells.get((other_col, other_row), ()):
+                    distance = math.hypot(npc.x - x, npc.y - y)
+                    if distance <= reach + npc.radius and (best is None or distance < best_distance):
+                        best, best_distance = npc, distance
+        return best
+
+    def ask(self, worker, name, question):
+        """
+        Send a question to the shared inference worker on behalf of an NPC.
+        """
+        npc = self.npcs[name]
+        return worker.submit(npc.name, question, npc.context)
@@ -0,0 +1,183 @@
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+from tracing import tracer
+
+# Words that carry no information for matching lore to questions
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "can", "do", "does", "for", "from", "has", "have",
+    "how", "in", "is", "it", "its", "of", "on", "or", "that", "the", "their", "there", "this", "to",
+    "was", "what", "when", "where", "which", "who", "why", "with", "you", "your",
+}
+
+
+# Function to turn text into lowercase search terms
+def tokenize(text):
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+
+
+# Function to split lore into passages of whole sentences
+def split_passages(text, max_chars=300):
+    sentences = [sentence.strip() for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+    passages = []
+    current = ""
+    for sentence in sentences:
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            passages.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        passages.append(current)
+    return passages
+
+
+# Okapi BM25 over an inverted index, updatable one passage at a time
+class BM25Index:
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {passage key: term frequency}
+        self.lengths = {}  # passage key -> number of terms
+        self.texts = {}
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self.texts)
+
+    def add(self, key, text):
+        if key in self.texts:
+            self.remove(key)
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[key] = count
+        self.lengths[key] = sum(terms.values())
+        self.texts[key] = text
+        self._total_length += self.lengths[key]
+
+    def remove(self, key):
+        if key not in self.texts:
+            return
+        for term in set(tokenize(self.texts[key])):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(key, None)
+                if not docs:
+                    del self.postings[term]
+        self._total_length -= self.lengths.pop(key)
+        del self.texts[key]
+
+    def search(self, query, k=4):
+        """
+        Return up to k (score, key) pairs, best first. Only the postings of
+        the query terms are visited, so the cost does not grow with the
+        number of passages that share no words with the question.
+        """
+        if not self.texts:
+            return []
+        count = len(self.texts)
+        average_length = self._total_length / count or 1
+        scores = {}
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, frequency in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(score, key) for key, score in best]
+
+
+# Passage index over one NPC's lore
+class LoreIndex:
+    def __init__(self, lore="", max_passage_chars=300):
+        self.max_passage_chars = max_passage_chars
+        self.bm25 = BM25Index()
+        for position, passage in enumerate(split_passages(lore, max_passage_chars)):
+            self.bm25.add(position, passage)
+
+    def top_k_context(self, question, k=4):
+        """
+        Join the k passages most relevant to the question, in lore order.
+        """
+        hits = self.bm25.search(question, k)
+        if not hits:
+            # Nothing matched; give the reader the start of the lore instead
+            keys = sorted(self.bm25.texts)[:k]
+        else:
+            keys = sorted(key for _, key in hits)
+        return " ".join(self.bm25.texts[key] for key in keys)
+
+
+# Question answering reader that only reads the lore passages relevant to the question
+class RetrievalQA:
+    """
+    Wraps a QA reader (`reader(question=..., context=...)`). Contexts
+    longer than `max_context_chars` are indexed into passages and only
+    the top-k passages for each question reach the reader, so NPC lore
+    can grow without making every question slower. Shorter contexts go
+    to the reader unchanged.
+
+    The `start`/`end` of an answer refer to the reduced context.
+    """
+
+    def __init__(self, reader, top_k=4, max_context_chars=1500, max_passage_chars=300, max_indexes=64):
+        self.reader = reader
+        self.top_k = top_k
+        self.max_context_chars = max_context_chars
+        self.max_passage_chars = max_passage_chars
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_context(self, context):
+        """
+        Build the passage index for a context ahead of the first question.
+        """
+        if len(context) > self.max_context_chars:
+            return self.index_for(context)
+        if hasattr(self.reader, "add_context"):
+            self.reader.add_context(context)
+        return None
+
+    def set_index(self, context, index):
+        """
+        Register an index that is maintained elsewhere (e.g. updated
+        incrementally as the lore changes) for the given context text.
+        """
+        with self._lock:
+            self._indexes[context] = index
+            self._indexes.move_to_end(context)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+
+    def drop_index(self, context):
+        with self._lock:
+            self._indexes.pop(context, None)
+
+    def index_for(self, context):
+        with self._lock:
+            index = self._indexes.get(context)
+            if index is not None:
+                self._indexes.move_to_end(context)
+                return index
+        index = LoreIndex(context, self.max_passage_chars)
+        self.set_index(context, index)
+        return index
+
+    def retrieve(self, question, context):
+        if len(context) <= self.max_context_chars:
+            return context
+        with tracer.span("retrieve"):
+            return self.index_for(context).top_k_context(question, self.top_k)
+
+    def __call__(self, question, context, **kwargs):
+        if isinstance(question, list):
+            context = [self.retrieve(q, c) for q, c in zip(question, context)]
+        else:
+            context = self.retrieve(question, context)
+        return self.reader(question=question, context=context, **kwargs)
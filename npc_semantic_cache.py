@@ -0,0 +1,198 @@
+import os
+import random
+import re
+from collections import OrderedDict, deque
+
+import numpy as np
+
+from npc_cache import AnswerCache, context_hash, normalize_question
+from tracing import tracer
+
+# Small local sentence encoder for question embeddings; NPC_QA_ENCODER overrides it
+DEFAULT_ENCODER_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_SIMILARITY = 0.85
+
+# Words that flip the meaning of otherwise near-identical questions ("left of" vs "right of");
+# two questions that differ in any of them never share an answer
+CONTRAST_WORDS = {
+    "left", "right", "above", "below", "over", "under", "up", "down", "north", "south", "east", "west",
+    "before", "after", "first", "last", "not", "no", "never", "next", "behind", "front",
+}
+
+
+# Mean-pooled transformer embeddings, L2-normalized so a dot product is the cosine similarity
+class SentenceEncoder:
+    def __init__(self, model=None):
+        from transformers import AutoModel, AutoTokenizer
+
+        model = model or os.environ.get("NPC_QA_ENCODER") or DEFAULT_ENCODER_MODEL
+        self.tokenizer = AutoTokenizer.from_pretrained(model)
+        self.model = AutoModel.from_pretrained(model)
+        self.model.eval()
+
+    def encode(self, texts):
+        import torch
+
+        inputs = self.tokenizer(texts, padding=True, truncation=True, max_length=64, return_tensors="pt")
+        with torch.no_grad():
+            hidden = self.model(**inputs).last_hidden_state
+        mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        vectors = ((hidden * mask).sum(1) / mask.sum(1).clamp(min=1e-9)).numpy()
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+# Function to collect the names in a context (words that only ever appear capitalized), lowercased
+def entity_words(context):
+    capitalized = set(re.findall(r"\b[A-Z][a-z]+\b", context))
+    lowercase = set(re.findall(r"\b[a-z]+\b", context))
+    return frozenset(word.lower() for word in capitalized if word.lower() not in lowercase)
+
+
+# Function to pick out the words two questions must agree on to share an answer
+def contrast_words(question, entities=frozenset()):
+    words = set(normalize_question(question).split())
+    return frozenset(word for word in words
+                     if word in CONTRAST_WORDS or word in entities or re.fullmatch(r"\d+", word))
+
+
+# Answer cache that also matches paraphrased questions by embedding similarity
+class SemanticAnswerCache(AnswerCache):
+    """
+    An AnswerCache (exact matches, LRU eviction, TTL, persistence) that
+    can also answer a question it has not seen word for word:
+    `get_similar()` embeds the question and compares it with the
+    questions already answered for the same NPC and context, returning
+    the stored answer when the cosine similarity reaches `threshold`.
+    Questions that differ in a direction, number, negation or a name from
+    the context ("Where is the Hotel?" and "Where is the Palace?") never
+    match.
+
+    The per-NPC vector index is rebuilt lazily after the entries change,
+    and each question is embedded only once. The encoder is loaded on
+    first use, so `get()` stays cheap enough for the game thread and the
+    embedding work happens where `get_similar()` is called (the
+    inference worker).
+
+    With `audit_rate` > 0, that fraction of similarity hits is not
+    served. The question goes to the model instead, and when its answer
+    comes back through `put()` it is compared with the cached one.
+    Disagreements are counted as false hits and logged in `audit_log`.
+    """
+
+    def __init__(self, max_entries=1024, ttl_seconds=None, path=None, encoder=None, threshold=DEFAULT_SIMILARITY,
+                 audit_rate=0.0, max_audit_log=200):
+        self.encoder = encoder  # SentenceEncoder, or None to load the default one on first use
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.semantic_hits = 0
+        self.audited = 0
+        self.false_hits = 0
+        self.audit_log = deque(maxlen=max_audit_log)
+        self._embeddings = {}  # normalized question -> vector
+        self._index = None  # (npc, context hash) -> (normalized questions, matrix); None when stale
+        self.max_audit_log = max_audit_log
+        # entry key -> (matched question, similarity, cached answer); oldest dropped past max_audit_log,
+        # since cancelled or failed questions never come back through put()
+        self._auditing = OrderedDict()
+        self._entities = {}  # context hash -> names in that context
+        super().__init__(max_entries=max_entries, ttl_seconds=ttl_seconds, path=path)
+
+    def _embed(self, questions):
+        missing = [question for question in questions if question not in self._embeddings]
+        if missing:
+            if self.encoder is None:
+                self.encoder = SentenceEncoder()
+            for question, vector in zip(missing, self.encoder.encode(missing)):
+                self._embeddings[question] = vector
+
+    def _build_index(self):
+        with self._lock:
+            keys = list(self._entries)
+        groups = {}
+        for npc_name, ctx_hash, question in keys:
+            groups.setdefault((npc_name, ctx_hash), []).append(question)
+        self._embed([question for _, _, question in keys])
+        # Forget the vectors of questions, and the names of contexts, that were evicted
+        live = {question for _, _, question in keys}
+        self._embeddings = {question: vector for question, vector in self._embeddings.items() if question in live}
+        live_contexts = {ctx_hash for _, ctx_hash, _ in keys}
+        self._entities = {ctx_hash: names for ctx_hash, names in self._entities.items() if ctx_hash in live_contexts}
+        self._index = {group: (questions, np.stack([self._embeddings[question] for question in questions]))
+                       for group, questions in groups.items()}
+        return self._index
+
+    def get_similar(self, npc_name, context, question):
+        """
+        The stored answer to the most similar question this NPC was
+        asked about this context, or None below the threshold.
+        """
+        with tracer.span("semantic lookup"):
+            index = self._index
+            if index is None:
+                index = self._build_index()
+            group = index.get((npc_name, context_hash(context)))
+            if group is None:
+                return None
+            normalized = normalize_question(question)
+            self._embed([normalized])
+            similarities = group[1] @ self._embeddings[normalized]
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            matched = group[0][best]
+            entities = self._entities.get(context_hash(context))
+            if entities is None:
+                entities = self._entities.setdefault(context_hash(context), entity_words(context))
+            if similarity < self.threshold or contrast_words(matched, entities) != contrast_words(normalized, entities):
+                return None
+
+            with self._lock:
+                entry = self._entries.get((npc_name, context_hash(context), matched))
+            if entry is None or self._expired(entry[1]):
+                self._index = None
+                return None
+            if self.audit_rate and random.random() < self.audit_rate:
+                self._auditing[(npc_name, context_hash(context), normalized)] = (matched, similarity, entry[0])
+                while len(self._auditing) > self.max_audit_log:
+                    self._auditing.popitem(last=False)
+                return None
+            self.semantic_hits += 1
+            return entry[0]
+
+    def put(self, npc_name, context, question, answer):
+        super().put(npc_name, context, question, answer)
+        self._index = None
+        audit = self._auditing.pop(self._key(npc_name, context, question), None)
+        if audit is not None:
+            matched, similarity, cached = audit
+            self.audited += 1
+            if normalize_question(cached) != normalize_question(answer):
+                self.false_hits += 1
+                self.audit_log.append({"npc": npc_name, "question": question, "matched": matched,
+                                       "similarity": round(similarity, 3), "cached": cached, "model": answer})
+
+    def invalidate(self, npc_name, context=None):
+        self._index = None
+        return super().invalidate(npc_name, context)
+
+    def carry_over(self, npc_name, old_context, new_context, changed_terms=(), anchor_terms=None):
+        self._index = None
+        return super().carry_over(npc_name, old_context, new_context, changed_terms, anchor_terms)
+
+    def clear(self):
+        super().clear()
+        self._index = None
+
+    def load(self, path=None):
+        super().load(path)
+        self._index = None
+
+    def stats(self):
+        stats = super().stats()
+        stats.update({
+            "semantic_hits": self.semantic_hits,
+            "threshold": self.threshold,
+            "audited": self.audited,
+            "false_hits": self.false_hits,
+            "false_hit_rate": round(self.false_hits / self.audited, 3) if self.audited else 0.0,
+        })
+        return stats
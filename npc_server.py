@@ -0,0 +1,307 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import threading
+
+from npc_cache import AnswerCache, context_hash
+from tracing import finish_tracing
+
+# Where the server listens by default, and the environment variable that points the games at it
+DEFAULT_ADDRESS = "unix:/tmp/npc_qa.sock"
+SERVER_ENV = "NPC_QA_SERVER"
+
+
+# Function to read the server address the games should use, or None to run the model in-process
+def server_address():
+    return os.environ.get(SERVER_ENV) or None
+
+
+# Function to split "unix:/path/to.sock" or "host:port" into what the socket calls need
+def parse_address(address):
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    return "tcp", (host or "127.0.0.1", int(port))
+
+
+# Function to build the same reader stack the game uses, around the backend picked by NPC_QA_BACKEND
+def load_server_reader(backend=None, model=None):
+    from npc_backends import load_qa_backend
+    from npc_context_store import ContextStore
+    from npc_retrieval import RetrievalQA
+    from world_knowledge import KnowledgeQA
+
+    return KnowledgeQA(RetrievalQA(ContextStore(load_qa_backend(backend, model))))
+
+
+# Inference service that hosts one model for many game processes
+class QAServer:
+    """
+    Speaks JSON lines over a Unix or TCP socket. Each request is one
+    object with an "op":
+
+    - {"op": "ask", "id", "npc", "question", "context" or "context_hash"}
+      answers with {"id", "answer", "score"} (or "error")
+    - {"op": "context", "context"} stores a context so later questions
+      can refer to it by hash instead of sending it again
+    - {"op": "cancel", "id"} drops a question that is still queued
+    - {"op": "stats", "id"} returns the worker and cache counters
+
+    Questions from every connection go to one InferenceWorker, so
+    concurrent clients are micro-batched into the same forward passes
+    (the ContextStore runs the windows of every question in a batch
+    through the model together).
+    Replies can come back out of order; clients match them by "id".
+    """
+
+    def __init__(self, worker, max_contexts=256):
+        self.worker = worker
+        self.max_contexts = max_contexts
+        self.contexts = {}  # context hash -> context text
+        self.connections = 0
+
+    def _store_context(self, context):
+        key = context_hash(context)
+        if key not in self.contexts:
+            if len(self.contexts) >= self.max_contexts:
+                self.contexts.pop(next(iter(self.contexts)))
+            self.contexts[key] = context
+        return key
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        pending_by_id = {}
+        write_lock = asyncio.Lock()
+        self.connections += 1
+
+        async def send(message):
+            async with write_lock:
+                writer.write((json.dumps(message) + "\n").encode("utf-8"))
+                await writer.drain()
+
+        def answered(request_id, pending):
+            pending_by_id.pop(request_id, None)
+            if pending.cancelled:
+                return
+            reply = {"id": request_id, "answer": pending.answer, "score": pending.score}
+            if pending.error is not None:
+                reply["error"] = str(pending.error)
+            asyncio.ensure_future(send(reply))
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    await send({"error": "invalid json"})
+                    continue
+                if not isinstance(request, dict):
+                    await send({"error": "request must be an object"})
+                    continue
+                op = request.get("op", "ask")
+
+                if op == "ask":
+                    request_id = request.get("id")
+                    if not isinstance(request.get("question"), str) or not request["question"].strip():
+                        await send({"id": request_id, "error": "missing question"})
+                        continue
+                    if "context" in request and not isinstance(request["context"], str):
+                        await send({"id": request_id, "error": "context must be a string"})
+                        continue
+                    if not isinstance(request.get("npc", "NPC"), str):
+                        await send({"id": request_id, "error": "npc must be a string"})
+                        continue
+                    if "context" in request:
+                        context = self.contexts[self._store_context(request["context"])]
+                    else:
+                        context = self.contexts.get(request.get("context_hash"))
+                        if context is None:
+                            await send({"id": request_id, "error": "unknown context"})
+                            continue
+                    pending = self.worker.submit(request.get("npc", "NPC"), request["question"], context)
+                    pending_by_id[request_id] = pending
+                    pending.add_done_callback(
+                        lambda done, request_id=request_id: loop.call_soon_threadsafe(answered, request_id, done))
+                elif op == "context":
+                    if not isinstance(request.get("context"), str):
+                        await send({"error": "context must be a string"})
+                        continue
+                    await send({"context_hash": self._store_context(request["context"])})
+                elif op == "cancel":
+                    pending = pending_by_id.pop(request.get("id"), None)
+                    if pending is not None:
+                        pending.cancel()
+                elif op == "stats":
+                    stats = {"id": request.get("id"), "worker": self.worker.stats.summary(),
+                             "contexts": len(self.contexts), "connections": self.connections}
+                    if self.worker.cache is not None:
+                        stats["cache"] = self.worker.cache.stats()
+                    await send(stats)
+                else:
+                    await send({"error": f"unknown op {op!r}"})
+        finally:
+            # The game went away; don't spend model time on its questions
+            for pending in pending_by_id.values():
+                pending.cancel()
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, address):
+        kind, target = parse_address(address)
+        if kind == "unix":
+            if os.path.exists(target):
+                os.remove(target)
+            server = await asyncio.start_unix_server(self.handle, path=target)
+        else:
+            server = await asyncio.start_server(self.handle, host=target[0], port=target[1])
+        print(f"NPC inference server listening on {address}")
+        async with server:
+            await server.serve_forever()
+
+
+# Pipeline-compatible client that sends questions to a running QAServer
+class RemoteQAPipeline:
+    """
+    Drop-in replacement for the in-process reader:
+    `reader(question=..., context=...)` returns the same
+    {"answer", "score", "start", "end"} dict (or a list of them for
+    lists of questions, which are all sent before waiting so the server
+    can batch them). Safe to call from several threads; one socket is
+    shared and a background thread routes replies by request id.
+
+    Each context is sent in full once and by hash afterwards.
+    """
+
+    def __init__(self, address=None, timeout=60, npc_name="NPC"):
+        self.address = address or server_address() or DEFAULT_ADDRESS
+        self.timeout = timeout
+        self.npc_name = npc_name
+        kind, target = parse_address(self.address)
+        family = socket.AF_UNIX if kind == "unix" else socket.AF_INET
+        self._socket = socket.socket(family, socket.SOCK_STREAM)
+        self._socket.connect(target)
+        self._file = self._socket.makefile("rb")
+        self._ids = itertools.count(1)
+        self._sent_contexts = set()
+        self._waiting = {}  # request id -> [event, reply]
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_replies, name="npc-qa-client", daemon=True)
+        self._reader.start()
+
+    def _send(self, message):
+        data = (json.dumps(message) + "\n").encode("utf-8")
+        with self._lock:
+            self._socket.sendall(data)
+
+    def _read_replies(self):
+        for line in self._file:
+            reply = json.loads(line)
+            slot = self._waiting.pop(reply.get("id"), None)
+            if slot is not None:
+                slot[1] = reply
+                slot[0].set()
+        # Connection closed: wake everyone still waiting
+        for slot in list(self._waiting.values()):
+            slot[1] = {"error": "server connection closed"}
+            slot[0].set()
+
+    def _ask(self, question, context):
+        request_id = next(self._ids)
+        slot = [threading.Event(), None]
+        self._waiting[request_id] = slot
+        key = context_hash(context)
+        request = {"op": "ask", "id": request_id, "npc": self.npc_name, "question": question}
+        if key in self._sent_contexts:
+            request["context_hash"] = key
+        else:
+            request["context"] = context
+            self._sent_contexts.add(key)
+        self._send(request)
+        return request_id, slot, key
+
+    def _result(self, request_id, slot, key, question, context):
+        if not slot[0].wait(self.timeout):
+            self._waiting.pop(request_id, None)
+            self._send({"op": "cancel", "id": request_id})
+            raise TimeoutError(f"No answer from the NPC server within {self.timeout} s")
+        reply = slot[1]
+        if reply.get("error") == "unknown context":
+            # The server was restarted or evicted the context; send it again
+            self._sent_contexts.discard(key)
+            return self._result(*self._ask(question, context), question, context)
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        return {"answer": reply["answer"], "score": reply.get("score"), "start": None, "end": None}
+
+    def add_context(self, context):
+        key = context_hash(context)
+        if key not in self._sent_contexts:
+            self._send({"op": "context", "context": context})
+            self._sent_contexts.add(key)
+
+    def __call__(self, question, context, **kwargs):
+        if isinstance(question, list):
+            sent = [self._ask(q, c) for q, c in zip(question, context)]
+            return [self._result(*ask, q, c) for ask, q, c in zip(sent, question, context)]
+        return self._result(*self._ask(question, context), question, context)
+
+    def stats(self):
+        """
+        The server's worker, context and cache counters.
+        """
+        request_id = next(self._ids)
+        slot = [threading.Event(), None]
+        self._waiting[request_id] = slot
+        self._send({"op": "stats", "id": request_id})
+        if not slot[0].wait(self.timeout):
+            self._waiting.pop(request_id, None)
+            raise TimeoutError(f"No answer from the NPC server within {self.timeout} s")
+        reply = dict(slot[1])
+        if "error" in reply:
+            raise RuntimeError(reply["error"])
+        reply.pop("id", None)
+        return reply
+
+    def close(self):
+        self._socket.close()
+
+
+def main(argv=None):
+    from npc_inference import InferenceWorker
+
+    parser = argparse.ArgumentParser(description="Host the NPC question answering model for several games.")
+    parser.add_argument("--address", default=server_address() or DEFAULT_ADDRESS,
+                        help="unix:/path/to.sock or host:port (default %(default)s)")
+    parser.add_argument("--backend", default=None, help="pipeline, quantized or onnx (default NPC_QA_BACKEND)")
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10)
+    parser.add_argument("--semantic-cache", type=float, nargs="?", const=0.85, default=None, metavar="THRESHOLD",
+                        help="Also reuse answers to rephrased questions (sentence embedding similarity)")
+    args = parser.parse_args(argv)
+
+    reader = load_server_reader(args.backend, args.model)
+    if args.semantic_cache is not None:
+        from npc_semantic_cache import SemanticAnswerCache
+        cache = SemanticAnswerCache(max_entries=4096, threshold=args.semantic_cache)
+    else:
+        cache = AnswerCache(max_entries=4096)
+    worker = InferenceWorker(reader, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+                             cache=cache).start()
+    try:
+        asyncio.run(QAServer(worker).serve(args.address))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        worker.stop()
+        finish_tracing()
+
+
+if __name__ == "__main__":
+    main()
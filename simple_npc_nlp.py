@@ -1,31 +1,81 @@
-from transformers import pipeline
-
-# Load the question answering pipeline
-qa_pipeline = pipeline("question-answering")
-
-# Dictionary to hold contexts for different NPCs
-npc_contexts = {
-    "NPC1": "Context for NPC1. This NPC is interested in space exploration.",
-    "NPC2": "Context for NPC2. This NPC is interested in ancient history.",
-    "NPC3": "Context for NPC3. This NPC is interested in technology advancements.",
-    # Add more NPCs and their contexts as needed
-}
-
-def get_answer_for_npc(npc_name, question):
-    """
-    Get the answer to a question for a specific NPC.
-    """
-    context = npc_contexts.get(npc_name, "")
-    if not context:
-        return "NPC not found.", None
-    
-    answer = qa_pipeline(question=question, context=context)
-    return answer["answer"], context
-
-# Example usage:
-npc_name = "NPC1"
-question = "What was the goal of the Apollo program?"
-answer, context = get_answer_for_npc(npc_name, question)
-print(f"For {npc_name}:")
-print(f"Question: {question}")
-print(f"Answer: {answer}")
+from npc_inference import InferenceWorker
+from npc_cache import AnswerCache
+from npc_context_store import ContextStore
+from npc_retrieval import RetrievalQA
+from npc_backends import load_qa_backend
+from npc_server import RemoteQAPipeline, server_address
+
+# Load the question answering backend (set NPC_QA_BACKEND to pipeline, quantized or onnx);
+# contexts are tokenized once and reused across questions, and long NPC lore is narrowed
+# down to the most relevant passages before the model reads it. With NPC_QA_SERVER set the
+# questions go to a shared npc_server.py instead of a model in this process
+if server_address():
+    qa_pipeline = RemoteQAPipeline(server_address())
+else:
+    qa_pipeline = RetrievalQA(ContextStore(load_qa_backend()), top_k=4)
+
+# Dictionary to hold contexts for different NPCs
+npc_contexts = {
+    "NPC1": "Context for NPC1. This NPC is interested in space exploration.",
+    "NPC2": "Context for NPC2. This NPC is interested in ancient history.",
+    "NPC3": "Context for NPC3. This NPC is interested in technology advancements.",
+    # Add more NPCs and their contexts as needed
+}
+
+for context in npc_contexts.values():
+    qa_pipeline.add_context(context)
+
+# Answers already computed for (NPC, context, question), kept between runs
+answer_cache = AnswerCache(max_entries=1024, path="answer_cache.json")
+
+def get_answer_for_npc(npc_name, question):
+    """
+    Get the answer to a question for a specific NPC.
+    """
+    context = npc_contexts.get(npc_name, "")
+    if not context:
+        return "NPC not found.", None
+
+    cached = answer_cache.get(npc_name, context, question)
+    if cached is not None:
+        return cached, context
+
+    answer = qa_pipeline(question=question, context=context)
+    answer_cache.put(npc_name, context, question, answer["answer"])
+    return answer["answer"], context
+
+def get_answers_for_npcs(npc_questions, max_batch_size=8, max_wait_ms=20):
+    """
+    Answer many (npc_name, question) pairs at once. Questions for all NPCs
+    are coalesced into padded batches by a micro-batching worker.
+    """
+    worker = InferenceWorker(qa_pipeline, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms, cache=answer_cache).start()
+    pending_answers = []
+    for npc_name, question in npc_questions:
+        context = npc_contexts.get(npc_name, "")
+        pending_answers.append(worker.submit(npc_name, question, context) if context else None)
+
+    answers = [pending.wait() if pending else "NPC not found." for pending in pending_answers]
+    worker.stop()
+    return answers, worker.stats
+
+# Example usage:
+npc_name = "NPC1"
+question = "What was the goal of the Apollo program?"
+answer, context = get_answer_for_npc(npc_name, question)
+print(f"For {npc_name}:")
+print(f"Question: {question}")
+print(f"Answer: {answer}")
+
+# Example batched usage across several NPCs:
+npc_questions = [
+    ("NPC1", "What is this NPC interested in?"),
+    ("NPC2", "What is this NPC interested in?"),
+    ("NPC3", "What is this NPC interested in?"),
+]
+answers, stats = get_answers_for_npcs(npc_questions)
+for (npc_name, question), answer in zip(npc_questions, answers):
+    print(f"{npc_name}: {question} -> {answer}")
+print(f"Batching stats: {stats.summary()}")
+print(f"Cache stats: {answer_cache.stats()}")
+answer_cache.save()
@@ -0,0 +1,10 @@
+import math
+
+
+# Function to compute a nearest-rank percentile
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = min(max(1, math.ceil(pct / 100 * len(ordered))), len(ordered))
+    return ordered[rank - 1]
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from npc_answer_bundle import AnswerBundle, BundleQA, build_question_set
+from npc_cache import context_hash
+from world_knowledge import KnowledgeQA, WorldKnowledge
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# Stand-in for the model: answers every question with its first word
+def first_word_reader(question, context, **kwargs):
+    if isinstance(question, list):
+        return [first_word_reader(q, c) for q, c in zip(question, context)]
+    return {"answer": question.split()[0], "score": 0.5, "start": None, "end": None}
+
+
+class AnswerBundleTest(unittest.TestCase):
+    def setUp(self):
+        with open(os.path.join(REPO_DIR, "Joc ALJV 4.0", "town_lore.txt")) as file:
+            self.lore = file.read()
+
+    def test_town_lore_gets_questions_the_knowledge_table_cannot_answer(self):
+        items = build_question_set({"NPC": self.lore})
+        self.assertTrue(items)
+        knowledge = WorldKnowledge.from_lore(self.lore)
+        for _, question, _ in items:
+            self.assertIsNone(knowledge.answer(question), question)
+
+    def test_bundle_built_from_town_lore_answers_for_it(self):
+        bundle = AnswerBundle("stub")
+        for npc_name, question, context in build_question_set({"NPC": self.lore}):
+            result = first_word_reader(question=question, context=context)
+            bundle.add(npc_name, context, question, result["answer"], result["score"])
+        self.assertIn(context_hash(self.lore), bundle.contexts)
+        self.assertTrue(bundle.contexts[context_hash(self.lore)]["answers"])
+
+        calls = []
+        def model(question, context, **kwargs):
+            calls.append(question)
+            return first_word_reader(question, context)
+        reader = BundleQA(KnowledgeQA(model), bundle)
+        self.assertEqual(reader(question="What is this town like?", context=self.lore)["answer"], "What")
+        self.assertEqual(calls, [])
+        self.assertEqual(reader.answered, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from npc_inference import LazyQAPipeline
+
+
+def failing_loader():
+    raise OSError("no model here")
+
+
+class LazyQAPipelineTest(unittest.TestCase):
+    def test_failed_load_is_reported(self):
+        pipeline = LazyQAPipeline(loader=failing_loader, preload_modules=()).start()
+        with self.assertRaises(RuntimeError):
+            pipeline.get()
+        self.assertTrue(pipeline.ready)
+        self.assertTrue(pipeline.failed)
+        self.assertNotIn("model load", pipeline.report.phases)
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            pipeline.report.print_once(pipeline.error)
+        self.assertIn("NPC model failed to load: no model here", output.getvalue())
+
+    def test_successful_load(self):
+        pipeline = LazyQAPipeline(loader=lambda: (lambda **kwargs: {"answer": "yes"}), preload_modules=()).start()
+        self.assertEqual(pipeline(question="q", context="c"), {"answer": "yes"})
+        self.assertFalse(pipeline.failed)
+        self.assertIn("model load", pipeline.report.phases)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stats_utils import percentile
+
+
+class PercentileTest(unittest.TestCase):
+    def test_odd_length(self):
+        values = [5, 1, 4, 2, 3]
+        self.assertEqual(percentile(values, 50), 3)
+        self.assertEqual(percentile(values, 95), 5)
+        self.assertEqual(percentile(values, 10), 1)
+        self.assertEqual(percentile(values, 30), 2)
+
+    def test_even_length(self):
+        values = list(range(1, 11))
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 95), 10)
+        self.assertEqual(percentile(values, 25), 3)
+        self.assertEqual(percentile(values, 99), 10)
+
+    def test_edges(self):
+        self.assertEqual(percentile([], 50), 0.0)
+        self.assertEqual(percentile([7], 0), 7)
+        self.assertEqual(percentile([1, 2, 3], 100), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
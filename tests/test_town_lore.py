@@ -0,0 +1,87 @@
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+import pygame
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from npc_cache import AnswerCache
+from town_lore import TownLore
+from town_spatial import SpatialGrid
+from world_knowledge import WorldKnowledge
+
+SPRITE_SIZE = 50
+WORLD_SIZE = 1000
+
+
+# Stand-in for a building sprite: the lore only looks at name and rect
+class Building:
+    def __init__(self, name, x, y):
+        self.name = name
+        self.rect = pygame.Rect(x, y, SPRITE_SIZE, SPRITE_SIZE)
+
+
+def town_size_line(count):
+    return f"\nThe town has {count} buildings.\n"
+
+
+class TownLoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def make_lore(self, sprites, name):
+        path = os.path.join(self.directory.name, name)
+        lore = TownLore(SpatialGrid(64).insert_all(sprites), SPRITE_SIZE, "A test town.", town_size_line, path=path,
+                        knowledge=WorldKnowledge())
+        lore.build(sprites)
+        return lore
+
+    def random_position(self, rng):
+        return rng.randrange(WORLD_SIZE), rng.randrange(WORLD_SIZE)
+
+    def test_random_edits_match_a_fresh_build(self):
+        rng = random.Random(17)
+        buildings = [Building(f"Building {number}", *self.random_position(rng)) for number in range(40)]
+        lore = self.make_lore(buildings, "edited.txt")
+        by_name = {sprite.name: sprite for sprite in buildings}
+        next_number = len(buildings)
+
+        for step in range(300):
+            operation = rng.choice(("add", "move", "remove")) if len(by_name) > 2 else "add"
+            if operation == "add":
+                sprite = Building(f"Building {next_number}", *self.random_position(rng))
+                next_number += 1
+                by_name[sprite.name] = sprite
+                lore.add(sprite)
+            elif operation == "move":
+                lore.move(by_name[rng.choice(lore.order)], self.random_position(rng))
+            else:
+                lore.remove(by_name.pop(rng.choice(lore.order)))
+
+            fresh = self.make_lore([by_name[name] for name in lore.order], "fresh.txt")
+            self.assertEqual(lore.text, fresh.text, f"lore text differs after step {step} ({operation})")
+            with open(lore.path, "rb") as edited_file, open(fresh.path, "rb") as fresh_file:
+                self.assertEqual(edited_file.read(), fresh_file.read(), f"lore file differs after step {step} ({operation})")
+            self.assertEqual(lore.knowledge.relations, fresh.knowledge.relations)
+
+
+class CarryOverTest(unittest.TestCase):
+    def test_town_wide_answers_are_dropped(self):
+        cache = AnswerCache()
+        cache.put("NPC", "old lore", "How many buildings are there?", "8")
+        cache.put("NPC", "old lore", "Where is the Hotel?", "to the left of the Palace")
+        cache.put("NPC", "old lore", "Where is the Bank?", "below the Mill")
+
+        kept = cache.carry_over(None, "old lore", "new lore", ["Bank"], ["Hotel", "Palace", "Bank", "Mill"])
+        self.assertEqual(kept, 1)
+        self.assertIsNone(cache.get("NPC", "new lore", "How many buildings are there?"))
+        self.assertIsNone(cache.get("NPC", "new lore", "Where is the Bank?"))
+        self.assertEqual(cache.get("NPC", "new lore", "Where is the Hotel?"), "to the left of the Palace")
+
+
+if __name__ == "__main__":
+    unittest.main()
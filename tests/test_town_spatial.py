@@ -0,0 +1,123 @@
+import os
+import random
+import sys
+import unittest
+
+import pygame
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from town_spatial import DIRECTIONS, OPPOSITE, SpatialGrid, _band_blocked
+
+SPRITE_SIZE = 50
+
+
+# Stand-in for a building sprite: the grid only looks at name and rect
+class Building:
+    def __init__(self, name, x, y):
+        self.name = name
+        self.rect = pygame.Rect(x, y, SPRITE_SIZE, SPRITE_SIZE)
+
+
+# Function to measure how far `other` lies in `direction` from `sprite`, and how far off the axis
+def along_and_offset(sprite, other, direction):
+    cx, cy = sprite.rect.center
+    ox, oy = other.rect.center
+    if direction in ("left", "right"):
+        along = cx - ox if direction == "left" else ox - cx
+        return along, oy - cy
+    along = cy - oy if direction == "up" else oy - cy
+    return along, ox - cx
+
+
+# Function to find the nearest neighbor by comparing against every other building
+def brute_force_key(sprite, others, direction, band):
+    best_key = None
+    for other in others:
+        if other is sprite:
+            continue
+        along, offset = along_and_offset(sprite, other, direction)
+        if along > 0 and abs(offset) < band:
+            key = (along, abs(offset))
+            if best_key is None or key < best_key:
+                best_key = key
+    return best_key
+
+
+class SpatialGridTest(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(14)
+        self.band = SPRITE_SIZE
+        self.buildings = [Building(f"Building {number}", rng.randrange(4000), rng.randrange(4000))
+                          for number in range(3000)]
+        self.grid = SpatialGrid(64).insert_all(self.buildings)
+        self.sample = rng.sample(self.buildings, 200)
+
+    def test_nearest_matches_brute_force(self):
+        for sprite in self.sample:
+            for direction in DIRECTIONS:
+                found = self.grid.nearest(sprite, direction, self.band)
+                expected = brute_force_key(sprite, self.buildings, direction, self.band)
+                if expected is None:
+                    self.assertIsNone(found)
+                else:
+                    along, offset = along_and_offset(sprite, found, direction)
+                    self.assertEqual((along, abs(offset)), expected)
+
+    def test_neighbors_names_nearest(self):
+        for sprite in self.sample:
+            neighbors = self.grid.neighbors(sprite, self.band)
+            for direction in DIRECTIONS:
+                nearest = self.grid.nearest(sprite, direction, self.band)
+                self.assertEqual(neighbors[direction], nearest.name if nearest else None)
+
+    def test_facing_matches_brute_force(self):
+        for sprite in self.sample:
+            for direction in DIRECTIONS:
+                expected = set()
+                for other in self.buildings:
+                    if other is sprite:
+                        continue
+                    along, offset = along_and_offset(sprite, other, direction)
+                    if along > 0 and abs(offset) < self.band and \
+                            self.grid.nearest(other, OPPOSITE[direction], self.band) is sprite:
+                        expected.add(other)
+                self.assertEqual(set(self.grid.facing(sprite, direction, self.band)), expected)
+
+    def test_remove_and_move_keep_queries_exact(self):
+        rng = random.Random(41)
+        for sprite in rng.sample(self.buildings, 300):
+            self.grid.remove(sprite)
+            self.buildings.remove(sprite)
+        for sprite in rng.sample(self.buildings, 300):
+            sprite.rect.topleft = (rng.randrange(4000), rng.randrange(4000))
+            self.grid.move(sprite)
+        for sprite in rng.sample(self.buildings, 100):
+            for direction in DIRECTIONS:
+                found = self.grid.nearest(sprite, direction, self.band)
+                expected = brute_force_key(sprite, self.buildings, direction, self.band)
+                found_key = None
+                if found is not None:
+                    along, offset = along_and_offset(sprite, found, direction)
+                    found_key = (along, abs(offset))
+                self.assertEqual(found_key, expected)
+
+    def test_query_rect_matches_brute_force(self):
+        rng = random.Random(7)
+        for _ in range(50):
+            rect = pygame.Rect(rng.randrange(4000), rng.randrange(4000), rng.randrange(1, 400), rng.randrange(1, 400))
+            expected = {sprite for sprite in self.buildings if sprite.rect.colliderect(rect)}
+            self.assertEqual(set(self.grid.query_rect(rect)), expected)
+
+
+class BandBlockedTest(unittest.TestCase):
+    def test_band_blocked(self):
+        self.assertFalse(_band_blocked([], 50))
+        self.assertFalse(_band_blocked([10, 20], 50))  # Nothing on the negative side
+        self.assertTrue(_band_blocked([-10, 20], 50))
+        self.assertTrue(_band_blocked([-40, 0, 45], 50))
+        self.assertFalse(_band_blocked([-60, 45], 50))  # Gap of 105 leaves room for a sprite in between
+
+
+if __name__ == "__main__":
+    unittest.main()
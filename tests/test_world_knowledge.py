@@ -0,0 +1,35 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from world_knowledge import WorldKnowledge
+
+LORE = """A test town.
+
+The Hotel is located to the right of the Stadium and above the Hospital.
+The Stadium is located to the left of the Hotel.
+The Hospital is located below the Hotel.
+"""
+
+
+class WorldKnowledgeTest(unittest.TestCase):
+    def setUp(self):
+        self.knowledge = WorldKnowledge.from_lore(LORE)
+
+    def test_direction_question(self):
+        self.assertEqual(self.knowledge.answer("What is left of the Hotel?"), "The Stadium is to the left of the Hotel.")
+        self.assertEqual(self.knowledge.answer("What is right of the Hotel?"), "There is nothing to the right of the Hotel.")
+
+    def test_right_next_to_is_a_neighbors_question(self):
+        self.assertEqual(self.knowledge.answer("What is right next to the Hotel?"),
+                         "Next to the Hotel: the Stadium, the Hospital.")
+
+    def test_unknown_building_is_not_answered(self):
+        self.assertIsNone(self.knowledge.answer("What is left of the Castle?"))
+        self.assertIsNone(self.knowledge.answer("Where is Willowbrook?"))
+
+
+if __name__ == "__main__":
+    unittest.main()
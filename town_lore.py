@@ -0,0 +1,163 @@
+import threading
+
+from npc_retrieval import BM25Index
+from town_spatial import DIRECTIONS
+
+
+# Function to describe where a building is from its nearest neighbors
+def describe_building(name, neighbors):
+    line = f"The {name} is located "
+
+    locations = []
+    if neighbors['left']:
+        locations.append(f"to the right of the {neighbors['left']}")
+    if neighbors['right']:
+        locations.append(f"to the left of the {neighbors['right']}")
+    if neighbors['up']:
+        locations.append(f"below the {neighbors['up']}")
+    if neighbors['down']:
+        locations.append(f"above the {neighbors['down']}")
+
+    if locations:
+        line += " and ".join(locations) + ".\n"
+    else:
+        line += "in an isolated spot.\n"
+    return line
+
+
+# Town lore kept up to date one building at a time
+class TownLore:
+    """
+    Holds one lore line per building (its nearest neighbors in each
+    direction), built from a SpatialGrid. When a building is added, moved
+    or removed only its own line and the lines of the buildings that
+    face it are recomputed. The lore file is patched from the first
+    changed line onwards, so new buildings are appended rather than the
+    whole file being rewritten.
+
+    Each line is also a passage in a BM25 index, so the object works as
+    a RetrievalQA index (`top_k_context`) that is updated in place.
+
+    The text is `header`, a blank line, the building lines and then
+    `footer(count)` if a footer is given. A WorldKnowledge table passed
+    as `knowledge` is kept in step with the lines.
+    """
+
+    def __init__(self, index, band, header, footer=None, path=None, knowledge=None):
+        self.index = index
+        self.band = band
+        self.header = header
+        self.footer = footer
+        self.path = path
+        self.knowledge = knowledge
+        self.lines = {}  # building name -> lore line
+        self.order = []  # building names in file order
+        self.bm25 = BM25Index()
+        self._text = None
+        self._lock = threading.Lock()
+
+    def build(self, sprites):
+        """
+        Describe every building and write the whole file once.
+        """
+        for sprite in sprites:
+            self._set_line(sprite)
+        self._text = None
+        if self.path:
+            with open(self.path, "wb") as file:
+                file.write(self.text.encode("utf-8"))
+        return self.text
+
+    @property
+    def text(self):
+        if self._text is None:
+            parts = [self.header + "\n\n"]
+            parts += [self.lines[name] for name in self.order]
+            parts.append(self._footer_text())
+            self._text = "".join(parts)
+        return self._text
+
+    def _footer_text(self):
+        return self.footer(len(self.order)) if self.footer else ""
+
+    def _set_line(self, sprite):
+        neighbors = self.index.neighbors(sprite, self.band)
+        if self.knowledge is not None:
+            self.knowledge.set_building(sprite.name, neighbors)
+        line = describe_building(sprite.name, neighbors)
+        if sprite.name not in self.lines:
+            self.order.append(sprite.name)
+        elif self.lines[sprite.name] == line:
+            return False
+        self.lines[sprite.name] = line
+        with self._lock:
+            self.bm25.remove(sprite.name)
+            self.bm25.add(sprite.name, line.strip())
+        return True
+
+    def _facing(self, sprite):
+        return {other for direction in DIRECTIONS for other in self.index.facing(sprite, direction, self.band)}
+
+    def add(self, sprite):
+        """
+        Add a building to the index and the lore. Returns the names of
+        the buildings whose lines changed.
+        """
+        self.index.insert(sprite)
+        return self._update({sprite} | self._facing(sprite))
+
+    def remove(self, sprite):
+        affected = self._facing(sprite)
+        self.index.remove(sprite)
+        position = self.order.index(sprite.name)
+        self.order.pop(position)
+        del self.lines[sprite.name]
+        if self.knowledge is not None:
+            self.knowledge.remove_building(sprite.name)
+        with self._lock:
+            self.bm25.remove(sprite.name)
+        return self._update(affected, first_changed=position) | {sprite.name}
+
+    def move(self, sprite, position):
+        """
+        Move a building to a new top-left position.
+        """
+        affected = self._facing(sprite)
+        sprite.rect.topleft = position
+        self.index.move(sprite)
+        return self._update(affected | {sprite} | self._facing(sprite))
+
+    def _update(self, sprites, first_changed=None):
+        changed = {sprite.name for sprite in sprites if self._set_line(sprite)}
+        positions = [self.order.index(name) for name in changed]
+        if first_changed is not None:
+            positions.append(first_changed)
+        self._text = None
+        if positions:
+            self._patch_file(min(positions))
+        return changed
+
+    def _patch_file(self, first_changed):
+        """
+        Rewrite the file from the first changed line to the end, leaving
+        everything before it untouched.
+        """
+        if not self.path:
+            return
+        offset = len((self.header + "\n\n").encode("utf-8"))
+        offset += sum(len(self.lines[name].encode("utf-8")) for name in self.order[:first_changed])
+        tail = "".join(self.lines[name] for name in self.order[first_changed:]) + self._footer_text()
+        with open(self.path, "r+b") as file:
+            file.seek(offset)
+            file.truncate()
+            file.write(tail.encode("utf-8"))
+
+    def top_k_context(self, question, k=4):
+        """
+        Join the k lore lines most relevant to the question (RetrievalQA index interface).
+        """
+        with self._lock:
+            hits = self.bm25.search(question, k)
+            if not hits:
+                return self.header
+            return " ".join(self.bm25.texts[key] for _, key in hits)
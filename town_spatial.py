@@ -0,0 +1,177 @@
+import pygame
+
+DIRECTIONS = ("left", "right", "up", "down")
+OPPOSITE = {"left": "right", "right": "left", "up": "down", "down": "up"}
+
+
+# Uniform grid over sprite rects for proximity and nearest-neighbor queries
+class SpatialGrid:
+    """
+    Buckets sprites by the grid cells their rects overlap. Rect queries
+    only look at the cells under the rect, and nearest-neighbor queries
+    walk outwards cell by cell from the sprite and stop as soon as no
+    closer match is possible, so both cost roughly the same however many
+    buildings the town has.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = cell_size
+        self.cells = {}
+        self._sprite_cells = {}
+        self.min_col = self.min_row = 0
+        self.max_col = self.max_row = -1
+
+    def __len__(self):
+        return len(self._sprite_cells)
+
+    def _cells_for_rect(self, rect):
+        size = self.cell_size
+        for col in range(rect.left // size, (rect.right - 1) // size + 1):
+            for row in range(rect.top // size, (rect.bottom - 1) // size + 1):
+                yield col, row
+
+    def insert(self, sprite):
+        if sprite in self._sprite_cells:
+            self.remove(sprite)
+        cells = list(self._cells_for_rect(sprite.rect))
+        for cell in cells:
+            self.cells.setdefault(cell, []).append(sprite)
+        self._sprite_cells[sprite] = cells
+
+        cols = [col for col, _ in cells]
+        rows = [row for _, row in cells]
+        if len(self._sprite_cells) == 1:
+            self.min_col, self.max_col, self.min_row, self.max_row = min(cols), max(cols), min(rows), max(rows)
+        else:
+            self.min_col = min(self.min_col, *cols)
+            self.max_col = max(self.max_col, *cols)
+            self.min_row = min(self.min_row, *rows)
+            self.max_row = max(self.max_row, *rows)
+
+    def insert_all(self, sprites):
+        for sprite in sprites:
+            self.insert(sprite)
+        return self
+
+    def remove(self, sprite):
+        for cell in self._sprite_cells.pop(sprite, []):
+            bucket = self.cells[cell]
+            bucket.remove(sprite)
+            if not bucket:
+                del self.cells[cell]
+
+    def move(self, sprite):
+        """
+        Re-bucket a sprite after its rect changed.
+        """
+        self.insert(sprite)
+
+    def query_rect(self, rect):
+        """
+        Return the sprites whose rects intersect `rect`.
+        """
+        rect = pygame.Rect(rect)
+        found = []
+        seen = set()
+        for cell in self._cells_for_rect(rect):
+            for sprite in self.cells.get(cell, ()):
+                if sprite not in seen:
+                    seen.add(sprite)
+                    if sprite.rect.colliderect(rect):
+                        found.append(sprite)
+        return found
+
+    def nearest(self, sprite, direction, band):
+        """
+        Nearest sprite whose center lies in `direction` from this sprite's
+        center and within `band` pixels of it on the other axis (the rule
+        the town lore has always used). Ties go to the better aligned one.
+        """
+        size = self.cell_size
+        cx, cy = sprite.rect.center
+        horizontal = direction in ("left", "right")
+        backwards = direction in ("left", "up")
+        center = cx if horizontal else cy
+        across = cy if horizontal else cx
+        lines = range((across - band) // size, (across + band) // size + 1)
+        line = center // size
+        low, high = (self.min_col, self.max_col) if horizontal else (self.min_row, self.max_row)
+
+        best = None
+        best_key = None
+        while low <= line <= high:
+            # Distance from the sprite's center to the near edge of this column/row of cells
+            edge = center - (line + 1) * size if backwards else line * size - center
+            if best_key is not None and edge > best_key[0]:
+                break
+            for other_line in lines:
+                cell = (line, other_line) if horizontal else (other_line, line)
+                for other in self.cells.get(cell, ()):
+                    if other is sprite:
+                        continue
+                    ox, oy = other.rect.center
+                    along = (cx - ox if backwards else ox - cx) if horizontal else (cy - oy if backwards else oy - cy)
+                    offset = abs(oy - cy) if horizontal else abs(ox - cx)
+                    if along > 0 and offset < band:
+                        key = (along, offset)
+                        if best_key is None or key < best_key:
+                            best, best_key = other, key
+            line += -1 if backwards else 1
+        return best
+
+    def facing(self, sprite, direction, band):
+        """
+        Sprites lying in `direction` from this sprite whose nearest
+        neighbor looking back the other way is this sprite, i.e. the ones
+        whose neighbors change when it is added, moved or removed. The
+        walk stops once closer sprites block the whole band.
+        """
+        size = self.cell_size
+        cx, cy = sprite.rect.center
+        horizontal = direction in ("left", "right")
+        backwards = direction in ("left", "up")
+        center = cx if horizontal else cy
+        across = cy if horizontal else cx
+        lines = range((across - band) // size, (across + band) // size + 1)
+        line = center // size
+        low, high = (self.min_col, self.max_col) if horizontal else (self.min_row, self.max_row)
+
+        found = []
+        offsets = []  # Offsets of everything passed so far; together they may block the whole band
+        while low <= line <= high:
+            for other_line in lines:
+                cell = (line, other_line) if horizontal else (other_line, line)
+                for other in self.cells.get(cell, ()):
+                    if other is sprite or other in found:
+                        continue
+                    ox, oy = other.rect.center
+                    along = (cx - ox if backwards else ox - cx) if horizontal else (cy - oy if backwards else oy - cy)
+                    offset = (oy - cy) if horizontal else (ox - cx)
+                    if along > 0 and abs(offset) < band:
+                        offsets.append(offset)
+                        if self.nearest(other, OPPOSITE[direction], band) is sprite:
+                            found.append(other)
+            if _band_blocked(offsets, band):
+                break
+            line += -1 if backwards else 1
+        return found
+
+    def neighbors(self, sprite, band):
+        """
+        Names of the nearest building in each direction (None where there is none).
+        """
+        result = {}
+        for direction in DIRECTIONS:
+            other = self.nearest(sprite, direction, band)
+            result[direction] = other.name if other else None
+        return result
+
+
+# Function to check whether sprites at these offsets cover every offset within the band
+def _band_blocked(offsets, band):
+    if not offsets:
+        return False
+    ordered = sorted(offsets)
+    if ordered[0] > 0 or ordered[-1] < 0:
+        return False
+    return all(high - low < 2 * band for low, high in zip(ordered, ordered[1:]))
@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from stats_utils import percentile
+
+# Environment variable that turns tracing on at startup; its value is where the trace is written
+TRACE_ENV = "NPC_TRACE"
+DEFAULT_TRACE_PATH = "npc_trace.json"
+
+
+# Span returned while tracing is off; entering and leaving it does nothing
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+# One timed region of code, recorded when it closes
+class _Span:
+    __slots__ = ("tracer", "name", "args", "started")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        finished = time.perf_counter_ns()
+        self.tracer.events.append((self.name, threading.get_ident(), self.started, finished - self.started, self.args))
+        return False
+
+
+# Named spans around the hot paths of the game and the NPC model
+class Tracer:
+    """
+    `with tracer.span("forward"):` times a block of code. While the
+    tracer is off a span is a shared do-nothing object, so the calls can
+    stay in the frame loop and the inference path for good. Spans can be
+    opened from any thread and nest naturally.
+
+    The last `max_events` spans are kept. They can be written as a
+    Chrome trace (chrome://tracing, Perfetto) or a speedscope profile,
+    and summarized per span name with `stats()`.
+    """
+
+    def __init__(self, enabled=False, max_events=200000):
+        self.enabled = enabled
+        self.events = deque(maxlen=max_events)  # (name, thread id, start ns, duration ns, args)
+        self.thread_names = {}
+        self.started_ns = time.perf_counter_ns()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NO_SPAN
+        thread = threading.current_thread()
+        if thread.ident not in self.thread_names:
+            self.thread_names[thread.ident] = thread.name
+        return _Span(self, name, args or None)
+
+    def record(self, name, started_ns, duration_ns, **args):
+        """
+        Add a span that was timed elsewhere (perf_counter_ns clock).
+        """
+        if self.enabled:
+            thread = threading.current_thread()
+            if thread.ident not in self.thread_names:
+                self.thread_names[thread.ident] = thread.name
+            self.events.append((name, thread.ident, started_ns, duration_ns, args or None))
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        return self.enabled
+
+    def clear(self):
+        self.events.clear()
+
+    def stats(self):
+        """
+        Count, total, mean, p50, p95 and max in milliseconds per span name,
+        slowest total first.
+        """
+        durations = {}
+        for name, _, _, duration, _ in list(self.events):
+            durations.setdefault(name, []).append(duration / 1e6)
+        stats = {
+            name: {
+                "count": len(values),
+                "total_ms": round(sum(values), 3),
+                "mean_ms": round(sum(values) / len(values), 3),
+                "p50_ms": round(percentile(values, 50), 3),
+                "p95_ms": round(percentile(values, 95), 3),
+                "max_ms": round(max(values), 3),
+            }
+            for name, values in durations.items()
+        }
+        return dict(sorted(stats.items(), key=lambda item: -item[1]["total_ms"]))
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"{'span':<24} {'count':>7} {'total ms':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9}")
+        for name, row in stats.items():
+            print(f"{name:<24} {row['count']:>7} {row['total_ms']:>10} {row['mean_ms']:>9} {row['p50_ms']:>9} "
+                  f"{row['p95_ms']:>9} {row['max_ms']:>9}")
+        return stats
+
+    def chrome_trace(self):
+        """
+        Spans as Chrome trace "complete" events (microseconds since the tracer was made).
+        """
+        pid = os.getpid()
+        trace_events = [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}}
+            for tid, thread_name in self.thread_names.items()
+        ]
+        for name, tid, started, duration, args in list(self.events):
+            event = {"name": name, "ph": "X", "pid": pid, "tid": tid,
+                     "ts": (started - self.started_ns) / 1000, "dur": duration / 1000}
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def speedscope(self):
+        """
+        Spans as a speedscope file with one evented profile per thread.
+        """
+        frames = []
+        frame_index = {}
+        by_thread = {}
+        for name, tid, started, duration, _ in list(self.events):
+            if name not in frame_index:
+                frame_index[name] = len(frames)
+                frames.append({"name": name})
+            by_thread.setdefault(tid, []).append((started, started + duration, frame_index[name]))
+
+        profiles = []
+        for tid, spans in by_thread.items():
+            # Open events sorted by start (outer spans first), close events by end (inner spans first)
+            events = [(start, 1, -(end - start), "O", frame) for start, end, frame in spans]
+            events += [(end, 0, end - start, "C", frame) for start, end, frame in spans]
+            events.sort()
+            profiles.append({
+                "type": "evented",
+                "name": self.thread_names.get(tid, str(tid)),
+                "unit": "milliseconds",
+                "startValue": (min(start for start, _, _ in spans) - self.started_ns) / 1e6,
+                "endValue": (max(end for _, end, _ in spans) - self.started_ns) / 1e6,
+                "events": [{"type": kind, "frame": frame, "at": (at - self.started_ns) / 1e6}
+                           for at, _, _, kind, frame in events],
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": "npc_nlp trace",
+            "exporter": "tracing.py",
+        }
+
+    def write(self, path=None):
+        """
+        Write the Chrome trace to `path` and the speedscope profile next
+        to it (name.speedscope.json). Returns both paths.
+        """
+        path = path or DEFAULT_TRACE_PATH
+        speedscope_path = os.path.splitext(path)[0] + ".speedscope.json"
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+        with open(speedscope_path, "w") as file:
+            json.dump(self.speedscope(), file)
+        return path, speedscope_path
+
+
+# Function to get the trace file named by NPC_TRACE ("1" means the default name), or None when it is unset
+def trace_path():
+    value = os.environ.get(TRACE_ENV)
+    if not value or value == "0":
+        return None
+    return DEFAULT_TRACE_PATH if value == "1" else value
+
+
+# The process-wide tracer the game and the NPC modules record into; on from the start when NPC_TRACE is set
+tracer = Tracer(enabled=trace_path() is not None)
+
+
+# Function to write the trace files and print the per-span statistics, if anything was recorded
+def finish_tracing(path=None):
+    if not tracer.events:
+        return None
+    paths = tracer.write(path or trace_path())
+    tracer.print_stats()
+    print(f"Trace written to {paths[0]} (Chrome / Perfetto) and {paths[1]} (speedscope)")
+    tracer.clear()
+    return paths
+
+
+# Function to switch tracing on or off while the game runs; switching it off writes what was recorded
+def toggle_tracing(path=None):
+    if tracer.toggle():
+        print("Tracing on")
+    else:
+        finish_tracing(path)
+    return tracer.enabled
@@ -0,0 +1,188 @@
+import re
+import threading
+from collections import OrderedDict
+
+from npc_cache import normalize_question
+from npc_context_store import answer_missing
+from tracing import tracer
+
+# Words a question can use for each direction, and how the answer phrases it
+DIRECTION_WORDS = {
+    "left": "left", "right": "right",
+    "above": "up", "over": "up", "north": "up", "up": "up",
+    "below": "down", "under": "down", "beneath": "down", "south": "down", "down": "down",
+}
+DIRECTION_PHRASES = {"left": "to the left of", "right": "to the right of", "up": "above", "down": "below"}
+# How the lore places a building relative to its neighbor in each direction ("left" neighbor -> "to the right of" it)
+LOCATED_PHRASES = {"left": "to the right of", "right": "to the left of", "up": "below", "down": "above"}
+
+# Question templates, matched against the normalized question (lowercase, no punctuation)
+DIRECTION_QUESTION = re.compile(
+    r"^(?:what|which building|which)(?: is| s)? (?:located |found |directly |right )?(?:to the |on the )?"
+    r"(" + "|".join(DIRECTION_WORDS) + r")(?: of| from)? (?:the )?(.+)$"
+)
+NEIGHBORS_QUESTION = re.compile(
+    r"^(?:what|which buildings?)(?: is| are| s)? (?:right |directly )?(?:next to|near|around|beside|by|close to) (?:the )?(.+)$"
+)
+WHERE_QUESTION = re.compile(r"^where(?: is| s) (?:the )?(.+)$")
+COUNT_QUESTION = re.compile(r"^how many buildings\b")
+
+# One lore line per building, as written by the game ("The X is located to the right of the Y and ...")
+LORE_LINE = re.compile(r"^The (.+?) is located (.+)\.$")
+LORE_RELATION = re.compile(r"^(to the right of|to the left of|below|above) the (.+)$")
+LORE_DIRECTIONS = {phrase: direction for direction, phrase in LOCATED_PHRASES.items()}
+
+
+# Building neighbor table with a question layer for the common spatial questions
+class WorldKnowledge:
+    """
+    Holds each building's nearest neighbor in every direction (the same
+    dicts get_neighboring_sprite_info produces) and answers questions
+    like "What is left of the Palace?", "What is next to the Hotel?",
+    "Where is the Tower?" and "How many buildings are there?" straight
+    from the table. `answer()` returns None for anything else.
+    """
+
+    def __init__(self):
+        self.relations = {}  # building name -> {"left": name or None, "right": ..., "up": ..., "down": ...}
+        self._names = {}  # normalized name -> building name
+
+    @classmethod
+    def from_neighbor_info(cls, buildings_info):
+        knowledge = cls()
+        for name, neighbors in buildings_info:
+            knowledge.set_building(name, neighbors)
+        return knowledge
+
+    @classmethod
+    def from_lore(cls, lore):
+        """
+        Rebuild the table from lore text written by the game; lines that
+        aren't building descriptions are ignored.
+        """
+        knowledge = cls()
+        for line in lore.splitlines():
+            match = LORE_LINE.match(line.strip())
+            if not match:
+                continue
+            neighbors = {"left": None, "right": None, "up": None, "down": None}
+            if match.group(2) != "in an isolated spot":
+                for part in match.group(2).split(" and "):
+                    relation = LORE_RELATION.match(part)
+                    if relation:
+                        neighbors[LORE_DIRECTIONS[relation.group(1)]] = relation.group(2)
+            knowledge.set_building(match.group(1), neighbors)
+        return knowledge
+
+    def __len__(self):
+        return len(self.relations)
+
+    def set_building(self, name, neighbors):
+        self.relations[name] = dict(neighbors)
+        self._names[normalize_question(name)] = name
+
+    def remove_building(self, name):
+        self.relations.pop(name, None)
+        self._names.pop(normalize_question(name), None)
+
+    def _building(self, text):
+        return self._names.get(text.strip())
+
+    def answer(self, question):
+        question = normalize_question(question)
+
+        # A template that matches but names no known building falls through to the next one
+        # ("What is right next to the Hotel?" looks like a "right of" question at first)
+        match = DIRECTION_QUESTION.match(question)
+        name = self._building(match.group(2)) if match else None
+        if name is not None:
+            direction = DIRECTION_WORDS[match.group(1)]
+            other = self.relations[name][direction]
+            if other is None:
+                return f"There is nothing {DIRECTION_PHRASES[direction]} the {name}."
+            return f"The {other} is {DIRECTION_PHRASES[direction]} the {name}."
+
+        match = NEIGHBORS_QUESTION.match(question)
+        name = self._building(match.group(1)) if match else None
+        if name is not None:
+            others = [other for other in self.relations[name].values() if other]
+            if not others:
+                return f"The {name} stands on its own."
+            return f"Next to the {name}: " + ", ".join(f"the {other}" for other in others) + "."
+
+        match = WHERE_QUESTION.match(question)
+        name = self._building(match.group(1)) if match else None
+        if name is not None:
+            places = [f"{LOCATED_PHRASES[direction]} the {other}"
+                      for direction, other in self.relations[name].items() if other]
+            if not places:
+                return f"The {name} is in an isolated spot."
+            return f"The {name} is " + " and ".join(places) + "."
+
+        if COUNT_QUESTION.match(question) and self.relations:
+            return f"There are {len(self.relations)} buildings."
+        return None
+
+
+# Question answering reader that answers from the neighbor table when a template matches
+class KnowledgeQA:
+    """
+    Wraps a QA reader (`reader(question=..., context=...)`). Each context
+    gets a WorldKnowledge table, either registered with
+    `set_knowledge()` or parsed from the lore text on first use. Questions
+    a template can answer never reach the model; the rest go to the
+    reader, batched together when a list of questions is passed.
+
+    Answers from the table have score 1.0 and no `start`/`end` span.
+    """
+
+    def __init__(self, reader, max_tables=64):
+        self.reader = reader
+        self.max_tables = max_tables
+        self.answered = 0
+        self.passed_on = 0
+        self._tables = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_knowledge(self, context, knowledge):
+        with self._lock:
+            self._tables[context] = knowledge
+            self._tables.move_to_end(context)
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+
+    def drop_knowledge(self, context):
+        with self._lock:
+            self._tables.pop(context, None)
+
+    def knowledge_for(self, context):
+        with self._lock:
+            knowledge = self._tables.get(context)
+            if knowledge is not None:
+                self._tables.move_to_end(context)
+                return knowledge
+        knowledge = WorldKnowledge.from_lore(context)
+        self.set_knowledge(context, knowledge)
+        return knowledge
+
+    def lookup(self, question, context):
+        with tracer.span("knowledge lookup"):
+            text = self.knowledge_for(context).answer(question)
+        if text is None:
+            return None
+        return {"answer": text, "score": 1.0, "start": None, "end": None}
+
+    def __call__(self, question, context, **kwargs):
+        if not isinstance(question, list):
+            result = self.lookup(question, context)
+            if result is not None:
+                self.answered += 1
+                return result
+            self.passed_on += 1
+            return self.reader(question=question, context=context, **kwargs)
+
+        results = [self.lookup(q, c) for q, c in zip(question, context)]
+        missing = [index for index, result in enumerate(results) if result is None]
+        self.answered += len(results) - len(missing)
+        self.passed_on += len(missing)
+        return answer_missing(self.reader, question, context, missing, results, **kwargs)